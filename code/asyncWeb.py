@@ -0,0 +1,229 @@
+from quart import Quart, Response, render_template, jsonify, request
+import asyncio
+import json
+import os
+import sys
+import time
+
+from control.async_port import AsyncDynamixelPort
+from control.calibration import RangeEstimator
+from control.calibration_store import CalibrationStore
+from control.joint_mapping import JointMapping, load_joint_limits
+from control.streaming import AsyncFrameBroadcaster, KEEPALIVE_SECONDS
+
+# web.py on Quart (same API as Flask): the same routes and page from one
+# event loop, with no thread per request or per /stream client, and nothing
+# in a request ever waits on the bus (see control/async_port.py).
+#   python asyncWeb.py                    runs it under uvicorn
+#   uvicorn asyncWeb:app --port 5000      or any other ASGI server
+
+app = Quart(__name__)
+app.config["MAX_CONTENT_LENGTH"] = 1 << 20
+
+MOTOR_IDS = [0, 1, 2, 10, 11, 12] # Starting from the wrist
+DEVICE = os.environ.get("KIRIGIRISU_DEVICE", "/dev/ttyUSB0") # e.g. "sim:" for the virtual bus
+STREAM_RATE = float(os.environ.get("KIRIGIRISU_STREAM_HZ", "60")) # /stream encoder frames per second
+CALIBRATION_SECONDS = 10 # upper bound, ends earlier once every motor's range has settled
+# 0 keeps the exact min/max; e.g. 0.5 trims the outermost 0.5% of samples per side
+CALIBRATION_PERCENTILE = float(os.environ.get("KIRIGIRISU_CALIBRATION_PERCENTILE", "0"))
+
+if __name__ == "__main__":
+    # Checked before the bus is opened
+    try:
+        import uvicorn
+    except ImportError:
+        sys.exit("asyncWeb.py needs an ASGI server: pip install uvicorn (or run asyncWeb:app under another one)")
+
+print("[INIT] Attempting to initialize Dynamixel controller...")
+from control.dynamixel_port import open_controller
+
+controller = open_controller(device=DEVICE, dxl_ids=MOTOR_IDS, motor_with_torque=MOTOR_IDS)
+controller.disable_torque(MOTOR_IDS)
+port = AsyncDynamixelPort(controller)
+print("[INIT] Dynamixel controller initialized successfully.")
+
+calibration_store = CalibrationStore()
+joint_mapping = None
+
+def load_joint_mapping():
+    global joint_mapping
+    if calibration_store.data is None:
+        joint_mapping = None
+        return
+    try:
+        joint_mapping = JointMapping(MOTOR_IDS, calibration_store.data, load_joint_limits())
+    except FileNotFoundError as e:
+        print(f"[INIT] Joint angles unavailable until the ROS 2 bridge has run once: {e.filename}")
+        joint_mapping = None
+
+load_joint_mapping()
+
+broadcaster = AsyncFrameBroadcaster(port.next_frame, MOTOR_IDS, rate=STREAM_RATE)
+calibrating = False
+calibration_task = None
+estimator = RangeEstimator(len(MOTOR_IDS))
+background = []
+
+
+async def calibrate_motors():
+    # Saves once when it ends, whether it timed out, settled or was stopped
+    global calibrating
+    frame = await port.next_frame()
+    start_time = time.monotonic()
+    while calibrating and (time.monotonic() - start_time < CALIBRATION_SECONDS):
+        try:
+            frame = await asyncio.wait_for(port.next_frame(frame.seq), 0.1)
+        except asyncio.TimeoutError:
+            continue
+        estimator.update(frame.positions, frame.valid, frame.timestamp)
+        if estimator.converged(frame.timestamp).all():
+            print(f"[CALIBRATION] Ranges settled after {time.monotonic() - start_time:.1f}s")
+            break
+    cleaned = save_results()
+    await asyncio.sleep(1)
+    calibrating = False
+    publish_calibration_state()
+    return cleaned
+
+def save_results():
+    cleaned = estimator.result(MOTOR_IDS, CALIBRATION_PERCENTILE)
+    calibration_store.save(cleaned)
+    load_joint_mapping()
+    print("Calibration saved:", cleaned)
+    return cleaned
+
+def calibration_state():
+    if calibrating or calibration_store.data is None:
+        return {"running": calibrating}
+    return {"running": False, "calibration": calibration_store.data}
+
+async def conditional_json(body, etag):
+    # 304 when the client already has this version (If-None-Match)
+    response = Response(body, mimetype="application/json")
+    response.set_etag(etag)
+    response.headers["Cache-Control"] = "no-cache"
+    return await response.make_conditional(request)
+
+def publish_calibration_state():
+    broadcaster.publish_event("calibration", calibration_state())
+
+def hardware_state(alert=None):
+    health = controller.motor_health()
+    return {"errors": {dxl_id: state["hardware_errors"] for dxl_id, state in health.items() if "hardware_errors" in state},
+            "alert": alert}
+
+def publish_hardware_state(alert=None):
+    broadcaster.publish_event("hardware", hardware_state(alert))
+
+
+@app.before_serving
+async def startup():
+    port.start_acquisition()
+    background.append(asyncio.ensure_future(broadcaster.run()))
+    publish_calibration_state()
+    # Alerts come from the acquisition thread
+    loop = asyncio.get_running_loop()
+    controller.add_hardware_listener(lambda alert: loop.call_soon_threadsafe(publish_hardware_state, alert))
+    publish_hardware_state()
+
+@app.after_serving
+async def shutdown():
+    for task in background:
+        task.cancel()
+    await port.close()
+
+
+@app.route("/")
+async def index():
+    return await render_template("index.html")
+
+@app.route("/toggle_calibration", methods=["POST"])
+async def toggle_calibration():
+    global calibrating, calibration_task, estimator
+    if not calibrating:
+        print("[ASGI] Calibration starting")
+        calibrating = True
+        estimator = RangeEstimator(len(MOTOR_IDS))
+        calibration_task = asyncio.ensure_future(calibrate_motors())
+        publish_calibration_state()
+        return jsonify(status="started")
+    print("[ASGI] Calibration stopping, waiting for it to finish...")
+    calibrating = False
+    cleaned = await calibration_task # only this request waits; the task saves
+    print(f"[ASGI] Calibration stopped, results: {cleaned}")
+    return jsonify(status="stopped", calibration=cleaned)
+
+@app.route("/status")
+async def status():
+    state = calibration_state()
+    return await conditional_json(json.dumps(state), f"{calibration_store.etag}-{int(state['running'])}")
+
+@app.route("/stream")
+async def stream():
+    # Server-sent events, as in web.py; the generator is cancelled when the
+    # client goes away
+    subscriber = broadcaster.subscribe()
+
+    async def events():
+        try:
+            while True:
+                messages = await subscriber.get(KEEPALIVE_SECONDS)
+                yield b"".join(messages) if messages else b": keepalive\n\n"
+        finally:
+            broadcaster.unsubscribe(subscriber)
+
+    response = Response(events(), mimetype="text/event-stream",
+                        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+    response.timeout = None # open for as long as the page is
+    return response
+
+@app.route("/encoder_values")
+async def encoder_values():
+    frame = port.latest_frame() or await port.next_frame()
+    return jsonify({f"motor_{motor_id}": int(frame.positions[i]) for i, motor_id in enumerate(MOTOR_IDS)})
+
+@app.route("/joint_values")
+async def joint_values():
+    # Everything here runs on the event loop thread, so one JointMapping is
+    # safe to share; keep the one this request started with across the await
+    mapping = joint_mapping
+    if mapping is None:
+        return jsonify(error="joint limits not available"), 503
+    frame = port.latest_frame() or await port.next_frame()
+    angles = mapping.map(frame.positions).tolist()
+    return jsonify(dict(zip(mapping.joint_names, angles)))
+
+@app.route("/metrics", methods=["GET", "POST"])
+async def metrics():
+    if request.method == "POST":
+        body = await request.get_json(force=True, silent=True)
+        if not isinstance(body, dict):
+            body = {}
+        if body.get("enabled") is False or body.get("reset"):
+            controller.disable_metrics()
+        if body.get("enabled", body.get("reset", False)):
+            controller.enable_metrics()
+    acquisition = controller.acquisition
+    result = {"enabled": controller.metrics is not None,
+              "acquisition": dict(acquisition.stats.summary(), realtime=acquisition.realtime,
+                                  filters=acquisition.filters.settings()) if acquisition is not None else None,
+              "stream_clients": broadcaster.subscriber_count(),
+              "async_port": {"reads": port.reads, "coalesced_reads": port.coalesced_reads,
+                             "writes": port.writes, "coalesced_writes": port.coalesced_writes},
+              "health": controller.motor_health()}
+    if controller.metrics is not None:
+        result.update(controller.metrics.snapshot())
+    return jsonify(result)
+
+@app.route("/calibration-data")
+async def serve_calibration_data():
+    if calibration_store.body is None:
+        return jsonify(error="not calibrated"), 404
+    return await conditional_json(calibration_store.body, calibration_store.etag)
+
+
+if __name__ == "__main__":
+    try:
+        uvicorn.run(app, host="0.0.0.0", port=5000, log_level="warning")
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,194 @@
+from control.dynamixel_port import (DynamixelPort, DEFAULT_DEVICE, PROTOCOL_VERSION, BAUDRATE_INDEX,
+                                    ADDR_BAUD_RATE, ADDR_RETURN_DELAY_TIME, ADDR_TORQUE_ENABLE, make_port_handler)
+from dynamixel_sdk import PacketHandler, COMM_SUCCESS
+import argparse
+import os
+import time
+
+import numpy as np
+
+# Find, change and benchmark the bus baud rate.
+#   python baudTool.py scan
+#   python baudTool.py migrate --baud 1000000 --return-delay-us 0
+#   python baudTool.py bench --bauds 57600 1000000 2000000 4000000
+# migrate moves one servo at a time and pings it at the new baud before
+# touching the next, so a failure strands at most one servo (rerun scan to
+# find it). bench migrates the chain through every candidate, measures sync
+# read / sync write / write+read cycles, then puts the chain back on the
+# baud (and, after --return-delay-us, the return delay) it started with
+# unless --keep is given. Use the result with
+# KIRIGIRISU_BAUDRATE=<baud>.
+
+SCAN_BAUDS = [57600, 1000000, 2000000, 3000000, 4000000, 115200, 9600]
+TX_BUFFER_BYTES = 4096 # serial driver buffer, drained after the write benchmark
+
+
+def scan(portHandler, packetHandler, bauds=SCAN_BAUDS):
+    # -> {dxl_id: baud}
+    found = {}
+    for baud in bauds:
+        portHandler.setBaudRate(baud)
+        data, result = packetHandler.broadcastPing(portHandler)
+        if result != COMM_SUCCESS:
+            continue
+        for dxl_id in data:
+            found.setdefault(dxl_id, baud)
+    return found
+
+
+def migrate(portHandler, packetHandler, found, baud, return_delay_us=None, ids=None):
+    # Returns the updated {dxl_id: baud}; raises RuntimeError on the first
+    # servo that doesn't answer at the new baud.
+    found = dict(found)
+    for dxl_id in sorted(found if ids is None else ids):
+        current = found[dxl_id]
+        portHandler.setBaudRate(current)
+        packetHandler.write1ByteTxRx(portHandler, dxl_id, ADDR_TORQUE_ENABLE, 0) # EEPROM is locked with torque on
+        if return_delay_us is not None:
+            result, error = packetHandler.write1ByteTxRx(portHandler, dxl_id, ADDR_RETURN_DELAY_TIME, return_delay_us // 2)
+            if result != COMM_SUCCESS or error:
+                raise RuntimeError(f"ID {dxl_id}: return delay write failed ({packetHandler.getTxRxResult(result)})")
+        if current != baud:
+            # The reply may already come back at the new baud, so only the ping below counts
+            packetHandler.write1ByteTxRx(portHandler, dxl_id, ADDR_BAUD_RATE, BAUDRATE_INDEX[baud])
+            time.sleep(0.05)
+            portHandler.setBaudRate(baud)
+            _, result, _ = packetHandler.ping(portHandler, dxl_id)
+            if result != COMM_SUCCESS:
+                raise RuntimeError(f"ID {dxl_id} does not answer at {baud} after migrating from {current}, run scan")
+            found[dxl_id] = baud
+    portHandler.setBaudRate(baud)
+    return found
+
+
+def read_return_delays(portHandler, packetHandler, found):
+    # -> {dxl_id: Return Delay Time register (2 us units)}
+    delays = {}
+    for dxl_id, baud in sorted(found.items()):
+        portHandler.setBaudRate(baud)
+        value, result, error = packetHandler.read1ByteTxRx(portHandler, dxl_id, ADDR_RETURN_DELAY_TIME)
+        if result != COMM_SUCCESS or error:
+            raise RuntimeError(f"ID {dxl_id}: return delay read failed ({packetHandler.getTxRxResult(result)})")
+        delays[dxl_id] = value
+    return delays
+
+
+def latency_stats(samples):
+    ms = np.asarray(samples) * 1000
+    return np.percentile(ms, 50), np.percentile(ms, 99), ms.max()
+
+
+def measure(fn, seconds):
+    latencies, failures = [], 0
+    start = time.perf_counter()
+    while time.perf_counter() - start < seconds:
+        t = time.perf_counter()
+        ok = fn()
+        latencies.append(time.perf_counter() - t)
+        failures += ok is False
+    return len(latencies) / (time.perf_counter() - start), latencies, failures
+
+
+def bench(controller, found, bauds, seconds, return_delay_us):
+    # -> [(baud, read Hz, read failures %), ...]
+    portHandler, packetHandler = controller.portHandler, controller.packetHandler
+    pwm = controller.goals["pwm"].copy() # rewritten unchanged by the write benchmark
+
+    def sync_write():
+        controller.set_goals(pwm=pwm)
+
+    def cycle():
+        controller.set_goals(pwm=pwm)
+        return controller.fetch_present_status()
+
+    results = []
+    # read: sync read latency; write: sustained sync write rate (writePort
+    # blocks once the driver buffer is full); cycle: sync write + sync read
+    print(f"{'baud':>8} {'read Hz':>8} {'p50 ms':>7} {'p99 ms':>7} {'max ms':>7} {'fail %':>6}"
+          f" {'write Hz':>9} {'cycle Hz':>8} {'cyc p99':>7}")
+    for baud in bauds:
+        with controller.lock:
+            found = migrate(portHandler, packetHandler, found, baud, return_delay_us)
+        controller.baudrate = baud
+        read_rate, read_latencies, failures = measure(controller.fetch_present_status, seconds)
+        write_rate, _, _ = measure(sync_write, seconds / 2)
+        time.sleep(TX_BUFFER_BYTES * 10 / baud)
+        cycle_rate, cycle_latencies, _ = measure(cycle, seconds / 2)
+        p50, p99, worst = latency_stats(read_latencies)
+        _, c99, _ = latency_stats(cycle_latencies)
+        fail = 100.0 * failures / max(len(read_latencies), 1)
+        print(f"{baud:>8} {read_rate:>8.1f} {p50:>7.2f} {p99:>7.2f} {worst:>7.2f} {fail:>6.2f}"
+              f" {write_rate:>9.0f} {cycle_rate:>8.1f} {c99:>7.2f}")
+        results.append((baud, read_rate, fail))
+    return found, results
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("command", choices=["scan", "migrate", "bench"])
+    parser.add_argument("--device", default=os.environ.get("KIRIGIRISU_DEVICE", DEFAULT_DEVICE))
+    parser.add_argument("--ids", type=int, nargs="+", default=None, help="default: every servo scan finds")
+    parser.add_argument("--baud", type=int, choices=sorted(BAUDRATE_INDEX), help="migrate target")
+    parser.add_argument("--bauds", type=int, nargs="+", choices=sorted(BAUDRATE_INDEX), default=[57600, 1000000, 2000000, 4000000])
+    parser.add_argument("--return-delay-us", type=int, default=None, help="0-508, XC330 default is 500")
+    parser.add_argument("--seconds", type=float, default=3.0)
+    parser.add_argument("--keep", type=int, choices=sorted(BAUDRATE_INDEX), default=None, help="leave the chain at this baud after bench")
+    args = parser.parse_args()
+
+    portHandler = make_port_handler(args.device, args.ids)
+    packetHandler = PacketHandler(PROTOCOL_VERSION)
+    if not portHandler.openPort():
+        print("Failed to open port")
+        return
+
+    found = scan(portHandler, packetHandler)
+    for dxl_id, baud in sorted(found.items()):
+        print(f"ID {dxl_id:>3}: {baud}")
+    if not found:
+        print("No servos found")
+        return
+    if args.ids is not None:
+        missing = set(args.ids) - set(found)
+        if missing:
+            print(f"Not found: {sorted(missing)}")
+            return
+        found = {dxl_id: found[dxl_id] for dxl_id in args.ids}
+
+    if args.command == "migrate":
+        if args.baud is None:
+            parser.error("migrate needs --baud")
+        found = migrate(portHandler, packetHandler, found, args.baud, args.return_delay_us)
+        print(f"Migrated {sorted(found)} to {args.baud}, run with KIRIGIRISU_BAUDRATE={args.baud}")
+
+    elif args.command == "bench":
+        original = found.copy()
+        start_baud = max(set(found.values()), key=list(found.values()).count)
+        found = migrate(portHandler, packetHandler, found, start_baud)
+        # --return-delay-us is only for the bench unless kept, so remember what to put back
+        delays = read_return_delays(portHandler, packetHandler, found) if args.return_delay_us is not None else {}
+        ids = sorted(found)
+        # Torque stays off: setup() disables it for every motor not in motor_with_torque
+        controller = DynamixelPort(device=args.device, dxl_ids=ids, motor_with_torque=[],
+                                   port_handler=portHandler, baudrate=start_baud)
+        found, results = bench(controller, found, args.bauds, args.seconds, args.return_delay_us)
+        clean = [r for r in results if r[2] < 0.1] or results
+        best = max(clean, key=lambda r: r[1])
+        print(f"Fastest reliable baud: {best[0]} ({best[1]:.1f} Hz)")
+        if args.keep is not None:
+            found = migrate(portHandler, packetHandler, found, args.keep, args.return_delay_us)
+            print(f"Left at {args.keep}, run with KIRIGIRISU_BAUDRATE={args.keep}")
+        else:
+            groups = {}
+            for dxl_id, baud in original.items():
+                delay = delays.get(dxl_id)
+                groups.setdefault((baud, None if delay is None else 2 * delay), []).append(dxl_id)
+            for (baud, return_delay_us), ids_at_baud in groups.items():
+                found = migrate(portHandler, packetHandler, found, baud, return_delay_us, ids=ids_at_baud)
+            restored = "baud rates and return delays" if delays else "baud rates"
+            print(f"Restored the original {restored}, use --keep <baud> or migrate to switch")
+
+    portHandler.closePort()
+
+
+if __name__ == "__main__":
+    main()
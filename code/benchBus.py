@@ -0,0 +1,48 @@
+from control.dynamixel_port import DynamixelPort, ADDR_PRESENT_POSITION
+import argparse
+import os
+import time
+
+# Maximum /joint_states rate the bus allows: the old per-motor read4ByteTxRx
+# loop vs. a single fetch_present_status() sync read, for several chain lengths.
+# Defaults to the simulated bus so it runs without hardware; on the real rig
+# pass --device /dev/ttyUSB0 and only chain lengths that are actually wired.
+
+
+def per_motor_reads(controller):
+    for dxl_id in controller.dxl_ids:
+        controller.packetHandler.read4ByteTxRx(controller.portHandler, dxl_id, ADDR_PRESENT_POSITION)
+
+
+def sync_read(controller):
+    controller.fetch_present_status()
+
+
+def measure(fn, controller, seconds):
+    count = 0
+    start = time.perf_counter()
+    while time.perf_counter() - start < seconds:
+        fn(controller)
+        count += 1
+    return count / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--device", default=os.environ.get("KIRIGIRISU_DEVICE", "sim:"))
+    parser.add_argument("--motors", type=int, nargs="+", default=[6, 12, 24])
+    parser.add_argument("--seconds", type=float, default=3.0)
+    args = parser.parse_args()
+
+    print(f"{'motors':>6} {'per-motor Hz':>13} {'sync read Hz':>13}")
+    for n in args.motors:
+        dxl_ids = list(range(n))
+        controller = DynamixelPort(device=args.device, dxl_ids=dxl_ids, motor_with_torque=[])
+        old = measure(per_motor_reads, controller, args.seconds)
+        new = measure(sync_read, controller, args.seconds)
+        print(f"{n:>6} {old:>13.1f} {new:>13.1f}")
+        controller.portHandler.closePort()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+from control.filters import FilterStage, make_filter
+from control.recorder import open_log
+import argparse
+import time
+
+import numpy as np
+
+# What each position filter setting costs in latency and buys in smoothness.
+# By default on a synthetic signal at bus rate (a slow sweep, then holding
+# still, with encoder quantization and hand tremor); --log runs the same
+# settings over a recorded session (record.py) instead.
+#   lag       shift (ms) that best lines the filtered signal up with the
+#             clean one (synthetic) or the raw one (log)
+#   predicted latency() at rest and at 1000 ticks/s
+#   jitter    synthetic: std (ticks) while holding still; log: RMS of the
+#             second difference, i.e. how rough the trace is
+#   step      one vectorized FilterStage.step() over every motor (us)
+
+FILTERS = ["none", "lowpass:20", "lowpass:5", "oneeuro:1.0,0.005", "oneeuro:0.5,0.01"]
+
+
+def synthetic(n, rate, seconds, seed=0):
+    # -> timestamps, clean (float), raw ticks (int32), rest mask over time
+    rng = np.random.default_rng(seed)
+    t = np.arange(int(seconds * rate)) / rate
+    sweep = t < seconds / 2
+    phase = rng.uniform(0, 2 * np.pi, n)
+    clean = 2048 + 600 * np.sin(2 * np.pi * 0.4 * np.minimum(t, seconds / 2)[:, None] + phase)
+    tremor = 1.5 * np.sin(2 * np.pi * 8.0 * t[:, None] + phase)
+    raw = np.rint(clean + tremor + rng.normal(0, 1.0, clean.shape)).astype(np.int32)
+    return t, clean, raw, ~sweep
+
+
+def run(spec, t, raw, valid):
+    n = raw.shape[1]
+    stage = FilterStage(n, position=make_filter(spec, n))
+    out = np.empty(raw.shape)
+    currents = np.zeros(n, np.int16)
+    start = time.perf_counter()
+    for i in range(len(t)):
+        stage.step(t[i], raw[i], currents, valid[i])
+        out[i] = stage.positions
+    return out, (time.perf_counter() - start) / len(t), stage
+
+
+def lag(t, reference, filtered, max_lag=0.3):
+    # Shift (s) minimizing the mean |filtered(t) - reference(t - shift)|
+    shifts = np.arange(0.0, max_lag, 0.001)
+    errors = [np.mean([np.abs(filtered[:, j] - np.interp(t - shift, t, reference[:, j])).mean()
+                       for j in range(reference.shape[1])]) for shift in shifts]
+    return shifts[int(np.argmin(errors))]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--filters", nargs="+", default=FILTERS)
+    parser.add_argument("--log", help="a .kirilog from record.py instead of the synthetic signal")
+    parser.add_argument("--motors", type=int, default=6)
+    parser.add_argument("--rate", type=float, default=200.0, help="synthetic frames per second")
+    parser.add_argument("--seconds", type=float, default=10.0)
+    args = parser.parse_args()
+
+    if args.log:
+        meta, frames = open_log(args.log)
+        t = frames["timestamp"] - frames["timestamp"][0]
+        raw = np.ascontiguousarray(frames["positions"])
+        valid = frames["valid"].astype(bool)
+        reference, rest = raw.astype(np.float64), None
+        print(f"{args.log}: {len(t)} frames of {meta['motor_ids']}, {len(t) / t[-1]:.0f} Hz")
+    else:
+        t, reference, raw, rest = synthetic(args.motors, args.rate, args.seconds)
+        valid = np.ones(raw.shape, bool)
+        print(f"synthetic: {args.motors} motors at {args.rate:.0f} Hz, {args.seconds:.0f} s")
+
+    print(f"{'filter':<20} {'lag ms':>7} {'predicted ms':>14} {'jitter':>8} {'step us':>8}")
+    for spec in args.filters:
+        filtered, step, stage = run(spec, t, raw, valid)
+        f = stage.position
+        predicted = f"{f.latency(0) * 1000:.1f}/{f.latency(1000) * 1000:.1f}" if f is not None else "0/0"
+        if rest is not None:
+            held = filtered[rest]
+            jitter = held[len(held) // 10:].std(axis=0).mean() # once it has settled
+        else:
+            jitter = np.sqrt((np.diff(filtered, 2, axis=0) ** 2).mean())
+        print(f"{spec:<20} {lag(t, reference, filtered) * 1000:7.1f} {predicted:>14} {jitter:8.2f} {step * 1e6:8.1f}")
+
+
+if __name__ == "__main__":
+    main()
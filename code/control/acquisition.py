@@ -0,0 +1,139 @@
+import threading
+import time
+
+import numpy as np
+
+from .filters import FilterStage
+from .loop import ERROR_BACKOFF, LoopRunner, RT_CPUS, RT_PRIORITY
+
+
+class Frame:
+    def __init__(self, n):
+        self.seq = 0
+        self.timestamp = 0.0 # time.monotonic() when the bus read finished (several buses: mean of their read midpoints)
+        self.positions = np.zeros((n), np.int32)
+        self.currents = np.zeros((n), np.int16)
+        self.velocities = np.zeros((n), np.float64) # ticks/s
+        self.present_velocities = np.zeros((n), np.int32) # Present Velocity register, 0.229 rev/min units
+        self.filtered_positions = np.zeros((n), np.float64) # see filters.py, same as positions when unfiltered
+        self.filtered_currents = np.zeros((n), np.float64)
+        self.valid = np.zeros((n), bool) # answered in this read; otherwise positions etc. are held over
+        self.age = np.full((n), np.inf) # s since each motor last answered, inf if it never did
+
+    def ages(self, now, out=None):
+        # age as of `now` (time.monotonic()): a frame that stopped being
+        # republished (acquisition stopped, daemon gone) keeps getting older
+        return np.add(self.age, now - self.timestamp, out=out)
+
+    def copy_to(self, out):
+        out.seq = self.seq
+        out.timestamp = self.timestamp
+        np.copyto(out.positions, self.positions)
+        np.copyto(out.currents, self.currents)
+        np.copyto(out.velocities, self.velocities)
+        np.copyto(out.present_velocities, self.present_velocities)
+        np.copyto(out.filtered_positions, self.filtered_positions)
+        np.copyto(out.filtered_currents, self.filtered_currents)
+        np.copyto(out.valid, self.valid)
+        np.copyto(out.age, self.age)
+        return out
+
+
+class LatestFrame:
+    # Double-buffered latest-sample snapshot for one writer and any number of
+    # readers. The writer fills the buffer readers are not pointed at, then
+    # publishes it by bumping `seq`; a reader retries only if the writer lapped
+    # it and started reusing its buffer mid-copy. Readers never take a lock.
+    def __init__(self, n):
+        self.n = n
+        self.seq = 0
+        self._buffers = (Frame(n), Frame(n))
+
+    def publish(self, timestamp, positions, currents, velocities, valid, age, filtered_positions, filtered_currents,
+                present_velocities):
+        seq = self.seq + 1
+        buf = self._buffers[seq & 1]
+        buf.seq = 0 # torn while being written
+        buf.timestamp = timestamp
+        np.copyto(buf.positions, positions)
+        np.copyto(buf.currents, currents)
+        np.copyto(buf.velocities, velocities)
+        np.copyto(buf.present_velocities, present_velocities)
+        np.copyto(buf.filtered_positions, filtered_positions)
+        np.copyto(buf.filtered_currents, filtered_currents)
+        np.copyto(buf.valid, valid)
+        np.copyto(buf.age, age)
+        buf.seq = seq
+        self.seq = seq
+
+    def latest(self, out=None):
+        if out is None:
+            out = Frame(self.n)
+        while True:
+            seq = self.seq
+            buf = self._buffers[seq & 1]
+            buf.copy_to(out)
+            if buf.seq == seq:
+                return out
+
+
+class Acquisition(LoopRunner):
+    # Polls port.fetch_present_status() back to back (or every `period`
+    # seconds) and publishes each frame, run through `filters` (default: from
+    # KIRIGIRISU_FILTER_*), into `frames`. Gets the realtime priority/affinity
+    # from KIRIGIRISU_RT_PRIORITY / KIRIGIRISU_RT_CPUS. A read that raises
+    # (port unplugged, DynamixelError) publishes a frame with every motor
+    # invalid, so ages keep growing, and the loop keeps trying.
+    def __init__(self, port, period=0.0, priority=RT_PRIORITY, cpus=RT_CPUS, filters=None):
+        super().__init__(period=period, name="dxl-acquisition", priority=priority, cpus=cpus)
+        self.port = port
+        self.n = len(port.dxl_ids)
+        self.frames = LatestFrame(self.n)
+        self.filters = filters if filters is not None else FilterStage.from_specs(self.n)
+        self._last_ok = np.full((self.n), -np.inf)
+        self._age = np.zeros((self.n))
+        self._new_frame = threading.Condition()
+
+    @property
+    def rate(self):
+        # smoothed frames/s
+        return self.stats.rate
+
+    def stop(self):
+        self._stop_event.set()
+        with self._new_frame:
+            self._new_frame.notify_all()
+        super().stop()
+
+    def wait(self, after_seq, timeout=None):
+        # Blocks until a frame newer than after_seq is published, for
+        # consumers that want every frame rather than just the latest one.
+        with self._new_frame:
+            self._new_frame.wait_for(lambda: self.frames.seq > after_seq or self._stop_event.is_set(), timeout)
+        return self.frames.seq > after_seq
+
+    def step(self):
+        n = self.n
+        valid = self.port.present_valid[:n]
+        now = None
+        try:
+            self.port.fetch_present_status()
+            # A MultiBusPort stamps its frame with when the buses were read,
+            # aligned across them; other ports take the time the read returned
+            now = getattr(self.port, "timestamp", None)
+        except Exception as e:
+            self.stats.error(self.name, e)
+            valid[:] = False
+            self._stop_event.wait(ERROR_BACKOFF)
+        if not now:
+            now = time.monotonic()
+        positions = self.port.present_positions[:n]
+        currents = self.port.present_currents[:n]
+        filters = self.filters
+        filters.step(now, positions, currents, valid)
+        np.copyto(self._last_ok, now, where=valid)
+        np.subtract(now, self._last_ok, out=self._age)
+        self.frames.publish(now, positions, currents, filters.velocities, valid, self._age,
+                            filters.positions, filters.currents, self.port.present_velocities[:n])
+        with self._new_frame:
+            self._new_frame.notify_all()
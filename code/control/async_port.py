@@ -0,0 +1,160 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from .acquisition import Frame
+
+# asyncio face of a DynamixelPort (or anything with its interface: sim,
+# replay, shm:, several buses). Bus transactions run one at a time on a
+# dedicated executor thread, so coroutines never block on serial I/O:
+#   aport = AsyncDynamixelPort(open_controller(...))
+#   frame = await aport.fetch_present_status()
+#   await aport.set_goal_positions(positions)
+# Requests are coalesced: coroutines that ask for a read while one is in
+# flight share its result, and goals that arrive while a goal write is
+# queued or in flight are merged (latest value wins) into the next single
+# write. With start_acquisition() running, reads don't touch the bus at all
+# and just wait for the acquisition loop's next frame.
+
+
+class AsyncDynamixelPort:
+    def __init__(self, port):
+        self.port = port
+        self.dxl_ids = port.dxl_ids
+        self.frame = None # newest acquisition frame, once start_acquisition() runs
+        self.reads = 0 # bus reads actually done
+        self.coalesced_reads = 0 # fetches that shared one of them
+        self.writes = 0
+        self.coalesced_writes = 0
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="dxl-bus")
+        self._read = None # in-flight fetch
+        self._goals = {} # merged, not yet written
+        self._write = None # write the next set_goals() joins
+        self._write_lock = asyncio.Lock()
+        self._waiters = []
+        self._loop = None
+        self._pump = None
+        self._pump_stop = threading.Event()
+
+    async def call(self, fn, *args):
+        # Anything else that talks to the bus, e.g. await aport.call(port.disable_torque, ids)
+        return await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+
+    def _fetch(self):
+        n = len(self.dxl_ids)
+        self.port.fetch_present_status()
+        self.reads += 1
+        frame = Frame(n)
+        frame.seq = self.reads
+        frame.timestamp = time.monotonic()
+        np.copyto(frame.positions, self.port.present_positions[:n])
+        np.copyto(frame.currents, self.port.present_currents[:n])
+        np.copyto(frame.present_velocities, self.port.present_velocities[:n])
+        np.copyto(frame.valid, self.port.present_valid[:n])
+        frame.age[frame.valid] = 0.0
+        np.copyto(frame.filtered_positions, frame.positions) # no filter stage outside acquisition
+        np.copyto(frame.filtered_currents, frame.currents)
+        return frame
+
+    def _read_done(self, future):
+        if self._read is future:
+            self._read = None
+
+    async def fetch_present_status(self):
+        # -> a Frame, shared with every other awaiter of the same read: treat
+        # it as read-only
+        if self._pump is not None:
+            return await self.next_frame(self.frame.seq if self.frame is not None else 0)
+        if self._read is None:
+            self._read = asyncio.ensure_future(self.call(self._fetch))
+            self._read.add_done_callback(self._read_done)
+        else:
+            self.coalesced_reads += 1
+        return await asyncio.shield(self._read)
+
+    async def _write_goals(self):
+        # Waits out the write in flight; goals merged meanwhile ride along
+        async with self._write_lock:
+            if self._write is asyncio.current_task():
+                self._write = None
+            goals, self._goals = self._goals, {}
+            self.writes += 1
+            await self.call(self.port.set_goals, goals.get("position"), goals.get("current"), goals.get("pwm"))
+
+    async def set_goals(self, pos=None, cur=None, pwm=None):
+        for name, values in (("position", pos), ("current", cur), ("pwm", pwm)):
+            if values is not None:
+                self._goals[name] = np.array(values)
+        if self._write is None:
+            self._write = asyncio.ensure_future(self._write_goals())
+        else:
+            self.coalesced_writes += 1
+        await asyncio.shield(self._write)
+
+    async def set_goal_positions(self, pos):
+        await self.set_goals(pos=pos)
+
+    async def set_goal_currents(self, cur):
+        await self.set_goals(cur=cur)
+
+    async def set_goal_pwms(self, pwm):
+        await self.set_goals(pwm=pwm)
+
+    async def set_goal_positions_currents(self, pos, cur):
+        await self.set_goals(pos=pos, cur=cur)
+
+    async def disable_torque(self, ids):
+        await self.call(self.port.disable_torque, ids)
+
+    def start_acquisition(self, period=0.0):
+        # Call from the event loop. A thread hands each acquisition frame to
+        # the loop; next_frame() waiters are woken there, without a thread each.
+        acquisition = self.port.start_acquisition(period)
+        if self._pump is None:
+            self._loop = asyncio.get_running_loop()
+            self._pump_stop.clear()
+            self._pump = threading.Thread(target=self._pump_frames, args=(acquisition,), name="dxl-frame-pump", daemon=True)
+            self._pump.start()
+        return acquisition
+
+    def _pump_frames(self, acquisition):
+        seq = 0
+        while not self._pump_stop.is_set():
+            if not acquisition.wait(seq, timeout=0.1):
+                continue
+            frame = self.port.latest_frame() # a fresh Frame per publish, the loop's readers may hold on to it
+            seq = frame.seq
+            self._loop.call_soon_threadsafe(self._publish, frame)
+
+    def _publish(self, frame):
+        self.frame = frame
+        waiters, self._waiters = self._waiters, []
+        for waiter in waiters:
+            if not waiter.done():
+                waiter.set_result(frame)
+
+    async def next_frame(self, after_seq=0):
+        # The first acquisition frame newer than after_seq
+        if self.frame is not None and self.frame.seq > after_seq:
+            return self.frame
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        return await waiter
+
+    def latest_frame(self):
+        return self.frame
+
+    def stop_acquisition(self):
+        if self._pump is not None:
+            self._pump_stop.set()
+            self._pump.join()
+            self._pump = None
+        self.port.stop_acquisition()
+
+    async def close(self):
+        self.stop_acquisition()
+        await self.call(self.port.cleanup)
+        self._executor.shutdown()
@@ -0,0 +1,75 @@
+import numpy as np
+
+from .joint_mapping import TICKS_PER_REV
+
+# Per-motor range estimation for calibration, fed one acquisition frame at a
+# time. Running min/max are exact; a coarse histogram per motor (bin_width
+# ticks, spanning a turn either side of the first reading so multi-turn
+# ranges fit) gives outlier-robust percentile limits when asked for.
+
+
+class RangeEstimator:
+    def __init__(self, n, bin_width=8, min_span=64, settle_time=3.0, extend_tolerance=4):
+        self.n = n
+        self.bin_width = bin_width
+        self.min_span = min_span # ticks a motor must move before it can converge
+        self.settle_time = settle_time # seconds without a new extreme
+        self.extend_tolerance = extend_tolerance # ticks that count as a new extreme
+        self.bins = 2 * TICKS_PER_REV // bin_width
+        self.counts = np.zeros((n, self.bins), np.int64)
+        self.samples = np.zeros(n, np.int64)
+        self.min = np.full(n, np.iinfo(np.int64).max, np.int64)
+        self.max = np.full(n, np.iinfo(np.int64).min, np.int64)
+        self.origin = np.zeros(n, np.int64) # histogram lower edge
+        self.started = np.zeros(n, bool)
+        self.last_extended = np.zeros(n, np.float64)
+        self._rows = np.arange(n)
+        self._bin = np.zeros(n, np.intp)
+
+    def update(self, positions, valid, timestamp):
+        positions = np.asarray(positions, np.int64)
+        new = valid & ~self.started
+        if new.any():
+            self.origin[new] = positions[new] - TICKS_PER_REV
+            self.min[new] = positions[new]
+            self.max[new] = positions[new]
+            self.last_extended[new] = timestamp
+            self.started |= new
+        extended = valid & ((positions < self.min - self.extend_tolerance) |
+                            (positions > self.max + self.extend_tolerance))
+        self.last_extended[extended] = timestamp
+        np.minimum(self.min, positions, out=self.min, where=valid)
+        np.maximum(self.max, positions, out=self.max, where=valid)
+        np.floor_divide(positions - self.origin, self.bin_width, out=self._bin)
+        np.clip(self._bin, 0, self.bins - 1, out=self._bin)
+        np.add.at(self.counts, (self._rows[valid], self._bin[valid]), 1)
+        self.samples += valid
+
+    def converged(self, timestamp):
+        # Per motor: moved at least min_span and no new extreme for settle_time
+        return (self.started & (self.max - self.min >= self.min_span) &
+                (timestamp - self.last_extended >= self.settle_time))
+
+    def percentile_limits(self, q):
+        # (low, high) at the q and 100-q percentiles, clipped to the exact range
+        cumulative = np.cumsum(self.counts, axis=1)
+        total = np.maximum(cumulative[:, -1:], 1)
+        low_bin = np.argmax(cumulative >= total * (q / 100), axis=1)
+        high_bin = np.argmax(cumulative >= total * (1 - q / 100), axis=1)
+        low = self.origin + low_bin * self.bin_width
+        high = self.origin + (high_bin + 1) * self.bin_width - 1
+        return np.clip(low, self.min, self.max), np.clip(high, self.min, self.max)
+
+    def limits(self, percentile=0.0):
+        if percentile > 0:
+            return self.percentile_limits(percentile)
+        return self.min.copy(), self.max.copy()
+
+    def result(self, motor_ids, percentile=0.0):
+        # calibration.json layout: {"<motor id>": {"min": ticks, "max": ticks}}
+        low, high = self.limits(percentile)
+        return {
+            motor_id: {"min": int(low[i]), "max": int(high[i])}
+            for i, motor_id in enumerate(motor_ids)
+            if self.started[i]
+        }
@@ -0,0 +1,68 @@
+import hashlib
+import json
+import os
+import threading
+
+from .joint_mapping import CALIBRATION_PATH
+
+# static/calibration.json kept in memory: readers get the parsed dict, the
+# serialized body and an ETag without touching the disk, writers persist it
+# atomically. `version` goes up on every change seen by this process, either
+# a save() or (via refresh()) a new file written by another process.
+
+
+class CalibrationStore:
+    def __init__(self, path=CALIBRATION_PATH):
+        self.path = path
+        self.version = 0
+        self.data = None # {"<motor id>": {"min": ticks, "max": ticks}}
+        self.body = None # JSON bytes as served to clients
+        self.etag = None
+        self._signature = None # (mtime_ns, size, inode) of the loaded file
+        self._lock = threading.Lock()
+        self.refresh()
+
+    def _stat(self):
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return (st.st_mtime_ns, st.st_size, st.st_ino)
+
+    def _set(self, body, signature):
+        data = json.loads(body)
+        self.data = data
+        self.body = body
+        self.etag = hashlib.sha1(body).hexdigest()[:16]
+        self._signature = signature
+        self.version += 1
+
+    def refresh(self):
+        # Picks up a file replaced behind our back; a stat() when unchanged.
+        # Returns True if the calibration changed.
+        signature = self._stat()
+        if signature == self._signature:
+            return False
+        with self._lock:
+            if signature is None:
+                self.data = self.body = self.etag = None
+                self._signature = None
+                self.version += 1
+                return True
+            with open(self.path, "rb") as f:
+                body = f.read()
+            try:
+                self._set(body, self._stat())
+            except ValueError:
+                return False # caught mid-write by a non-atomic writer, retry next time
+        return True
+
+    def save(self, data):
+        body = json.dumps(data, indent=2).encode()
+        with self._lock:
+            temp_path = self.path + ".tmp"
+            with open(temp_path, "wb") as f:
+                f.write(body)
+            os.replace(temp_path, self.path)
+            self._set(body, self._stat())
+        return self.version
@@ -0,0 +1,140 @@
+import json
+import os
+import struct
+import time
+
+from .joint_mapping import STATIC_DIR
+from .protocol2 import BROADCAST_ID, INST_PING, INST_STATUS, INST_SYNC_READ, build_packet, parse_packets
+
+# What's on the bus: IDs, model numbers and firmware, found with one
+# broadcast ping and cached in static/topology.json per device. A cached
+# topology is confirmed at startup with one sync read of model number ..
+# firmware version, which takes a few ms where the broadcast ping waits out a
+# reply slot for every possible ID. A motor that is missing, replaced or
+# re-flashed fails that check and triggers a new scan; a motor *added* to the
+# chain doesn't, run `python pingTest.py --refresh` after adding one.
+
+TOPOLOGY_PATH = os.path.join(STATIC_DIR, "topology.json")
+MAX_ID = 252
+PING_SLOT_MS = 3.0 # per-ID reply window of a broadcast ping, as in PacketHandler.broadcastPing
+LATENCY_MS = 16.0 # USB adapter latency allowance, as the SDK's LATENCY_TIMER
+RETURN_DELAY_MS = 0.508 # longest Return Delay Time (9)
+ADDR_MODEL_NUMBER = 0
+ADDR_FIRMWARE_VERSION = 6
+STATUS_PING_LENGTH = 14 # header .. crc of a ping status packet
+
+
+class Topology:
+    def __init__(self, device, baudrate, motors, source="scan"):
+        self.device = device
+        self.baudrate = baudrate
+        self.motors = dict(sorted(motors.items())) # dxl_id -> (model_number, firmware)
+        self.source = source # "scan", or "cache" if confirmed from static/topology.json
+        self.changes = None # vs. the cached topology it replaced: {"missing", "added", "changed"}
+
+    @property
+    def ids(self):
+        return list(self.motors)
+
+    def to_json(self):
+        return {
+            "baudrate": self.baudrate,
+            "motors": {str(dxl_id): {"model": model, "firmware": firmware}
+                       for dxl_id, (model, firmware) in self.motors.items()},
+            "discovered": time.time(),
+        }
+
+    @classmethod
+    def from_json(cls, device, data):
+        motors = {int(dxl_id): (m["model"], m["firmware"]) for dxl_id, m in data["motors"].items()}
+        return cls(device, data["baudrate"], motors, "cache")
+
+
+def _load_all(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return {}
+
+
+def load_topology(device, baudrate, path=TOPOLOGY_PATH):
+    data = _load_all(path).get(device)
+    if data is None or data.get("baudrate") != baudrate:
+        return None
+    return Topology.from_json(device, data)
+
+
+def save_topology(topology, path=TOPOLOGY_PATH):
+    data = _load_all(path)
+    data[topology.device] = topology.to_json()
+    temp_path = path + ".tmp"
+    with open(temp_path, "w") as f:
+        json.dump(data, f, indent=2)
+    os.replace(temp_path, path)
+
+
+def _exchange(port, packet, wait_ms, expected=None):
+    # Sends `packet` and collects status packets until every ID in `expected`
+    # has answered or wait_ms is up -> {dxl_id: params} (error byte first)
+    port.clearPort()
+    port.writePort(packet)
+    deadline = time.monotonic() + wait_ms / 1000
+    rx = bytearray()
+    replies = {}
+    while True:
+        chunk = port.readPort(4096)
+        if chunk:
+            rx += chunk
+            for dxl_id, instruction, params, crc_ok in parse_packets(rx):
+                if instruction == INST_STATUS and crc_ok:
+                    replies[dxl_id] = bytes(params)
+            if expected is not None and expected <= replies.keys():
+                return replies
+        elif time.monotonic() >= deadline:
+            return replies
+        else:
+            time.sleep(0.0002)
+
+
+def broadcast_ping(port, baudrate, max_id=MAX_ID):
+    # One broadcast ping -> {dxl_id: (model_number, firmware)}. Waits out the
+    # reply slot of every ID up to max_id.
+    byte_ms = 10000.0 / baudrate
+    wait_ms = (max_id + 1) * (PING_SLOT_MS + STATUS_PING_LENGTH * byte_ms) + LATENCY_MS
+    replies = _exchange(port, build_packet(BROADCAST_ID, INST_PING), wait_ms)
+    return {dxl_id: struct.unpack_from("<HB", params, 1)
+            for dxl_id, params in replies.items() if len(params) >= 4}
+
+
+def sync_ping(port, baudrate, dxl_ids):
+    # One sync read of model number .. firmware version for dxl_ids ->
+    # {dxl_id: (model_number, firmware)} for those that answered. Returns as
+    # soon as the last one has.
+    length = ADDR_FIRMWARE_VERSION + 1 - ADDR_MODEL_NUMBER
+    byte_ms = 10000.0 / baudrate
+    wait_ms = len(dxl_ids) * ((11 + length) * byte_ms + RETURN_DELAY_MS) + (14 + len(dxl_ids)) * byte_ms + LATENCY_MS
+    packet = build_packet(BROADCAST_ID, INST_SYNC_READ, struct.pack("<HH", ADDR_MODEL_NUMBER, length) + bytes(dxl_ids))
+    replies = _exchange(port, packet, wait_ms, set(dxl_ids))
+    return {dxl_id: (params[1] | (params[2] << 8), params[1 + ADDR_FIRMWARE_VERSION])
+            for dxl_id, params in replies.items() if len(params) == 1 + length}
+
+
+def discover(port, device, baudrate, path=TOPOLOGY_PATH, refresh=False, max_id=MAX_ID):
+    # port: an open PortHandler at `baudrate`. The cached topology if one sync
+    # ping confirms it, otherwise a broadcast ping (saved for next time).
+    cached = None if refresh else load_topology(device, baudrate, path)
+    if cached is not None:
+        found = sync_ping(port, baudrate, cached.ids)
+        if found == cached.motors:
+            return cached
+    topology = Topology(device, baudrate, broadcast_ping(port, baudrate, max_id))
+    if cached is not None:
+        topology.changes = {
+            "missing": [dxl_id for dxl_id in cached.motors if dxl_id not in topology.motors],
+            "added": [dxl_id for dxl_id in topology.motors if dxl_id not in cached.motors],
+            "changed": [dxl_id for dxl_id, motor in topology.motors.items()
+                        if dxl_id in cached.motors and cached.motors[dxl_id] != motor],
+        }
+    save_topology(topology, path)
+    return topology
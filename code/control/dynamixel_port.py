@@ -1,10 +1,28 @@
 from dynamixel_sdk import *
 import numpy as np
+import os
 import random
 import socket
+import struct
 import sys
 import threading
+import time
 
+from .acquisition import Acquisition
+from .discovery import discover
+from .errors import DynamixelError
+from .health import HardwareStatus, MotorHealth
+from .loop import ERROR_LOG_SECONDS
+from .metrics import BusMetrics
+from .protocol2 import (BROADCAST_ID, ERRBIT_ALERT, HEADER, INST_FAST_SYNC_READ, SyncWriteFrame, build_packet, crc16,
+                        store_goals, unstuff)
+from .multi_bus import BUS_SEPARATOR, MultiBusPort
+from .replay import REPLAY_PREFIX, ReplayPort
+from .shared_port import SHM_PREFIX, SharedPort
+from .sim_bus import DEFAULT_IDS as SIM_DEFAULT_IDS, SIM_PREFIX, SimPortHandler
+
+ADDR_BAUD_RATE = 8
+ADDR_RETURN_DELAY_TIME = 9 # 2 us units
 ADDR_TORQUE_ENABLE = 64
 ADDR_GOAL_POSITION = 116
 ADDR_GOAL_PWM = 100
@@ -12,12 +30,35 @@ ADDR_GOAL_CURRENT = 102
 ADDR_POSITION_D_GAIN = 80
 ADDR_POSITION_I_GAIN = 82
 ADDR_POSITION_P_GAIN = 84
+GOAL_SPAN_LENGTH = 20 # Goal PWM (100) .. Goal Position (116-119)
 ADDR_PRESENT_CURRENT = 126
 ADDR_PRESENT_POSITION = 132
 ADDR_HARDWARE_ERROR_STATUS = 70
+ADDR_PRESENT_INPUT_VOLTAGE = 144
+ADDR_PRESENT_TEMPERATURE = 146
+ADDR_INDIRECT_ADDRESS = 168 # 2 bytes each, only writable with torque off
+ADDR_INDIRECT_DATA = 224
+# Mapped to the first indirect data bytes at setup, so the health monitor
+# reads error status, voltage and temperature in one 4-byte sync read
+HARDWARE_STATUS_ADDRS = (ADDR_HARDWARE_ERROR_STATUS, ADDR_PRESENT_INPUT_VOLTAGE, ADDR_PRESENT_INPUT_VOLTAGE + 1,
+                         ADDR_PRESENT_TEMPERATURE)
+HARDWARE_INDIRECT = struct.pack(f"<{len(HARDWARE_STATUS_ADDRS)}H", *HARDWARE_STATUS_ADDRS)
+HARDWARE_STATUS_DTYPE = np.dtype({"names": ["error", "voltage", "temperature"],
+                                  "formats": ["u1", "<u2", "u1"], "offsets": [0, 1, 3], "itemsize": 4})
+PRESENT_STATUS_LENGTH = 10 # present current (2) + velocity (4) + position (4)
+POSITION_GAINS = (1000, 10, 100) # Position D, I, P (80, 82, 84)
+SETUP_READ_LENGTH = ADDR_GOAL_POSITION + 4 - ADDR_TORQUE_ENABLE # torque enable (64) .. goal position (116-119)
+PRESENT_STATUS_DTYPE = np.dtype({"names": ["current", "velocity", "position"],
+                                 "formats": ["<i2", "<i4", "<i4"], "offsets": [0, 2, 6], "itemsize": 10})
+# Fast Sync Read block: error, id, present status, crc
+FAST_STATUS_DTYPE = np.dtype({"names": ["error", "id", "current", "velocity", "position"],
+                              "formats": ["u1", "u1", "<i2", "<i4", "<i4"], "offsets": [0, 1, 2, 4, 8], "itemsize": 14})
 PROTOCOL_VERSION = 2.0
-BAUDRATE = 57600
+BAUDRATE = int(os.environ.get("KIRIGIRISU_BAUDRATE", "57600")) # pick with baudTool.py bench
+# XC330 Baud Rate (8) register values
+BAUDRATE_INDEX = {9600: 0, 57600: 1, 115200: 2, 1000000: 3, 2000000: 4, 3000000: 5, 4000000: 6, 4500000: 7}
 BIMANUAL_PORT = 9000
+METRICS_ENABLED = os.environ.get("KIRIGIRISU_METRICS", "0") == "1" # per-transaction timing, see metrics.py
 TORQUE_ENABLE = 1
 TORQUE_DISABLE = 0
 ADDR_OPERATING_MODE = 11
@@ -25,11 +66,48 @@ CURRENT_CONTROL_MODE = 0
 CURRENT_BASE_POSITION_CONTROL_MODE = 5
 EXTENDED_POSITION_CONTROL_MODE = 4
 PWM_CONTROL_MODE = 16
+DEFAULT_DEVICE = "/dev/ttyUSB0"
+# fetch_present_status transports
+READ_MODE_SYNC = "sync" # GroupSyncRead, one status packet per motor
+READ_MODE_FAST = "fast" # Fast Sync Read, one concatenated status packet
+READ_MODE_BULK = "bulk" # GroupBulkRead, per-motor address ranges (bulk_ranges)
+WRITE_RETRIES = 2 # extra attempts on a comm failure before DynamixelError
 
 def logprint(message):
     #pass
     print(message, file=sys.stderr)
 
+def process_age():
+    # Seconds since this process started, None where /proc isn't available
+    try:
+        with open("/proc/self/stat") as f:
+            start_ticks = int(f.read().rsplit(")", 1)[1].split()[19])
+        return time.clock_gettime(time.CLOCK_BOOTTIME) - start_ticks / os.sysconf("SC_CLK_TCK")
+    except (OSError, ValueError, AttributeError):
+        return None
+
+def make_port_handler(device, dxl_ids=None):
+    # "sim:" / "sim:0,1,2" selects the in-process virtual bus (see sim_bus.py);
+    # a bare "sim:" holds dxl_ids, or the default arms when that's None
+    if device.startswith(SIM_PREFIX):
+        return SimPortHandler.from_device(device, SIM_DEFAULT_IDS if dxl_ids is None else dxl_ids)
+    return PortHandler(device)
+
+def open_controller(device, dxl_ids, motor_with_torque, **kwargs):
+    # "replay:<log>[,<speed>x][,loop]" plays a recorded session (see replay.py)
+    if device.startswith(REPLAY_PREFIX):
+        return ReplayPort.from_device(device, dxl_ids)
+    # "shm:[<name>]" reads a bus shared by daemon.py (see shared_port.py)
+    if device.startswith(SHM_PREFIX):
+        return SharedPort.from_device(device, dxl_ids)
+    # "<dev>@<ids>;<dev>@<ids>" reads several adapters in parallel (see multi_bus.py)
+    if BUS_SEPARATOR in device:
+        return MultiBusPort.from_device(device, dxl_ids, motor_with_torque, **kwargs)
+    # dxl_ids=None: every motor on the bus (see discovery.py)
+    if dxl_ids is None:
+        return DynamixelPort.discover(device, motor_with_torque, **kwargs)
+    return DynamixelPort(device, dxl_ids, motor_with_torque, **kwargs)
+
 class DynamixelPort:
     method_dict = {
         1 : "write1ByteTxRx",
@@ -37,138 +115,623 @@ class DynamixelPort:
         4 : "write4ByteTxRx"
     }
 
-    def __init__(self, device, dxl_ids, motor_with_torque, control_mode=PWM_CONTROL_MODE):
+    def __init__(self, device, dxl_ids, motor_with_torque, control_mode=PWM_CONTROL_MODE, port_handler=None,
+                 read_mode=READ_MODE_SYNC, bulk_ranges=None, baudrate=BAUDRATE, metrics=METRICS_ENABLED):
         self.lock = threading.Lock() #prevent simultaneous access
+        self.metrics = None
+        self.topology = None # set when built by discover()
         self.device = device
         self.dxl_ids = dxl_ids
         self.motor_with_torque = motor_with_torque
-        self.portHandler = PortHandler(device)
+        self.portHandler = port_handler if port_handler is not None else make_port_handler(device, dxl_ids)
         self.packetHandler = PacketHandler(PROTOCOL_VERSION)
         self.control_mode=control_mode
+        self.baudrate = baudrate
+        self.startup = {} # seconds per init step, see _report_first_frame
+        self._created = time.monotonic()
+        self._first_frame_pending = True
         if self.portHandler.openPort():
             logprint("Succeeded to open the port")
         else:
-            logprint("Failed to open the port")
-            logprint("Press any key to terminate...")
-            quit()
-        if self.portHandler.setBaudRate(BAUDRATE):
+            raise DynamixelError(f"Failed to open the port {device}")
+        if self.portHandler.setBaudRate(self.baudrate):
             logprint("Succeeded to change the baudrate")
         else:
-            logprint("Failed to change the baudrate")
-            logprint("Press any key to terminate...")
-            quit()
+            raise DynamixelError(f"Failed to change the baudrate to {self.baudrate}")
+        self.startup["open"] = time.monotonic() - self._created
+        self.health = MotorHealth(dxl_ids)
+        self.hardware = HardwareStatus(dxl_ids)
+        self.hardware_listeners = [] # fn(alert), see add_hardware_listener
+        self._hardware_mapped = set() # dxl_ids whose indirect data holds HARDWARE_STATUS_ADDRS
+        self._setup_registers = {} # dxl_id -> bytes at ADDR_TORQUE_ENABLE.., as of setup
+        t = time.monotonic()
         self.setup()
-        self.pos_writer = GroupSyncWrite(self.portHandler, self.packetHandler, ADDR_GOAL_POSITION, 4)
-        self.cur_writer = GroupSyncWrite(self.portHandler, self.packetHandler, ADDR_GOAL_CURRENT, 2)
-        self.pwm_writer = GroupSyncWrite(self.portHandler, self.packetHandler, ADDR_GOAL_PWM, 2)
-        self.groupSyncRead = GroupSyncRead(self.portHandler, self.packetHandler, ADDR_PRESENT_CURRENT, 10)
-        for dxl_id in dxl_ids:
-            dxl_addparam_result = self.groupSyncRead.addParam(dxl_id)
-            if dxl_addparam_result != True:
-                logprint("[ID:%03d] groupSyncRead addparam failed" % dxl_id)
-                quit()
-        self.present_currents = np.zeros((16), np.int16)
-        self.present_positions = np.zeros((16), np.int32)
+        self.startup["setup"] = time.monotonic() - t
+        # Pre-built sync write packets; goal_* are views into their data bytes
+        self.pos_frame = SyncWriteFrame(dxl_ids, ADDR_GOAL_POSITION, 4)
+        self.cur_frame = SyncWriteFrame(dxl_ids, ADDR_GOAL_CURRENT, 2)
+        self.pwm_frame = SyncWriteFrame(dxl_ids, ADDR_GOAL_PWM, 2)
+        self.goal_position = self.pos_frame.field(0, np.int32)
+        self.goal_current = self.cur_frame.field(0, np.int16)
+        self.goal_pwm = self.pwm_frame.field(0, np.int16)
+        self.goal_frame = SyncWriteFrame(dxl_ids, ADDR_GOAL_PWM, GOAL_SPAN_LENGTH)
+        self.goals = {
+            "pwm": self.goal_frame.field(ADDR_GOAL_PWM - ADDR_GOAL_PWM, np.int16),
+            "current": self.goal_frame.field(ADDR_GOAL_CURRENT - ADDR_GOAL_PWM, np.int16),
+            "position": self.goal_frame.field(ADDR_GOAL_POSITION - ADDR_GOAL_PWM, np.int32),
+        }
+        self._load_goal_registers()
+        self.groupSyncRead = GroupSyncRead(self.portHandler, self.packetHandler, ADDR_PRESENT_CURRENT, PRESENT_STATUS_LENGTH)
+        n = max(16, len(dxl_ids))
+        self.present_currents = np.zeros((n), np.int16)
+        self.present_positions = np.zeros((n), np.int32)
+        self.present_velocities = np.zeros((n), np.int32) # 0.229 rev/min units
+        self.present_valid = np.zeros((n), bool)
+        # Raw present status blocks of the last read, decoded in one go
+        self._status_buf = bytearray(len(dxl_ids) * PRESENT_STATUS_LENGTH)
+        self._status = np.frombuffer(self._status_buf, PRESENT_STATUS_DTYPE)
+        self._attempted = np.zeros((len(dxl_ids)), bool) # motors whose reply the last read waited for
+        self._tx_failures = 0
+        self._tx_failure_logged_at = -ERROR_LOG_SECONDS
+        self.acquisition = None
+        self.read_mode = read_mode
+        if read_mode == READ_MODE_BULK:
+            self.bulk_ranges = {dxl_id: (ADDR_PRESENT_CURRENT, PRESENT_STATUS_LENGTH) for dxl_id in dxl_ids}
+            self.bulk_ranges.update(bulk_ranges or {})
+            self.bulk_data = {}
+            self.groupBulkRead = GroupBulkRead(self.portHandler, self.packetHandler)
+            for addr, length in self.bulk_ranges.values():
+                if addr > ADDR_PRESENT_CURRENT or addr + length < ADDR_PRESENT_CURRENT + PRESENT_STATUS_LENGTH:
+                    raise ValueError(f"bulk range {addr}+{length} must cover the present status registers")
+        self._rebuild_reads()
+        if read_mode != READ_MODE_SYNC and self._active_index.size:
+            # Probe once; firmware without Fast Sync Read simply doesn't answer
+            valid = self.present_valid[:len(dxl_ids)]
+            with self.lock:
+                valid[:] = False
+                if read_mode == READ_MODE_FAST:
+                    self._fast_sync_read(valid)
+                else:
+                    self._bulk_read(valid)
+            if not valid[self._active_index].all():
+                logprint(f"{read_mode} read not supported by every motor, falling back to sync read")
+                self.read_mode = READ_MODE_SYNC
+                self._rebuild_reads()
+        if metrics:
+            self.enable_metrics()
+
+    @classmethod
+    def from_topology(cls, topology, motor_with_torque=(), **kwargs):
+        return cls(topology.device, topology.ids, list(motor_with_torque), baudrate=topology.baudrate, **kwargs)
+
+    @classmethod
+    def discover(cls, device, motor_with_torque=(), baudrate=BAUDRATE, refresh=False, **kwargs):
+        # Port over whatever discovery finds on `device`; the cached topology
+        # costs one sync read, a changed chain one broadcast ping
+        port_handler = make_port_handler(device)
+        if not port_handler.openPort() or not port_handler.setBaudRate(baudrate):
+            raise DynamixelError(f"Failed to open {device} at {baudrate}")
+        t = time.monotonic()
+        topology = discover(port_handler, device, baudrate, refresh=refresh)
+        logprint(f"Discovered {topology.ids} on {device} ({topology.source}, {(time.monotonic() - t) * 1000:.0f} ms)")
+        if topology.changes:
+            logprint(f"Chain changed since the last scan: {topology.changes}")
+        if not topology.ids:
+            raise DynamixelError(f"No motors answer on {device} at {baudrate}")
+        port = cls.from_topology(topology, motor_with_torque, port_handler=port_handler, **kwargs)
+        port.topology = topology
+        return port
+
+    def enable_metrics(self):
+        if self.metrics is None:
+            metrics = BusMetrics()
+            n = len(self.dxl_ids)
+            if self.read_mode == READ_MODE_FAST:
+                read_bytes = 14 + n + 10 + n * FAST_STATUS_DTYPE.itemsize
+            elif self.read_mode == READ_MODE_BULK:
+                read_bytes = 10 + 5 * n + sum(11 + length for _, length in self.bulk_ranges.values())
+            else:
+                read_bytes = 14 + n + n * (11 + PRESENT_STATUS_LENGTH)
+            metrics.op("fetch_present_status").wire_time = read_bytes * 10.0 / self.baudrate
+            self.metrics = metrics
+        return self.metrics
+
+    def disable_metrics(self):
+        self.metrics = None
+
+    def _locked(self, op):
+        # self.lock, timed per operation when metrics are enabled
+        metrics = self.metrics
+        if metrics is None:
+            return self.lock
+        return metrics.transaction(op, self.lock)
 
     def writeTxRx(self, dxl_id, addr, value):
-        with self.lock:
-            method = getattr(self.packetHandler, self.method_dict[value.itemsize])
-            dxl_comm_result, dxl_error = self.packetHandler.__getattribute__(self.method_dict[value.itemsize])(self.portHandler, dxl_id, addr, int(value))
-            if dxl_comm_result != COMM_SUCCESS:
-                logprint("%s" % self.packetHandler.getTxRxResult(dxl_comm_result))
-                exit()
-            elif dxl_error != 0:
-                logprint("%s" % self.packetHandler.getRxPacketError(dxl_error))
-                exit()
+        with self._locked("writeTxRx"):
+            self._write(dxl_id, addr, value)
+
+    def _write(self, dxl_id, addr, value):
+        # caller holds self.lock. Comm failures are retried, an error in the
+        # status packet is not; raises DynamixelError
+        write = getattr(self.packetHandler, self.method_dict[value.itemsize])
+        for attempt in range(WRITE_RETRIES + 1):
+            dxl_comm_result, dxl_error = write(self.portHandler, dxl_id, addr, int(value))
+            if dxl_comm_result == COMM_SUCCESS and dxl_error == 0:
+                return
+            if self.metrics is not None:
+                self.metrics.error("writeTxRx")
+            if dxl_comm_result == COMM_SUCCESS:
+                raise DynamixelError(self.packetHandler.getRxPacketError(dxl_error), dxl_id, dxl_comm_result, dxl_error)
+        raise DynamixelError(self.packetHandler.getTxRxResult(dxl_comm_result), dxl_id, dxl_comm_result, dxl_error)
 
     def setup(self):
-        for dxl_id in self.dxl_ids:
-            self.writeTxRx(dxl_id, ADDR_TORQUE_ENABLE, np.int8(TORQUE_DISABLE))
-            #self.writeTxRx(dxl_id, ADDR_OPERATING_MODE, np.int8(CURRENT_BASE_POSITION_CONTROL_MODE))
-            #self.writeTxRx(dxl_id, ADDR_OPERATING_MODE, np.int8(PWM_CONTROL_MODE))
-            self.writeTxRx(dxl_id, ADDR_OPERATING_MODE, np.int8(self.control_mode))
-            self.writeTxRx(dxl_id, ADDR_POSITION_D_GAIN, np.int16(1000))
-            self.writeTxRx(dxl_id, ADDR_POSITION_I_GAIN, np.int16(10))
-            self.writeTxRx(dxl_id, ADDR_POSITION_P_GAIN, np.int16(100))
-            if dxl_id in self.motor_with_torque:
-                self.writeTxRx(dxl_id, ADDR_TORQUE_ENABLE, np.int8(TORQUE_ENABLE))
+        # A motor that doesn't take its setup starts offline; it gets set up
+        # again once it answers a probe (see fetch_present_status)
+        with self.lock:
+            errors = self._setup_motors(range(len(self.dxl_ids)))
+        for i, e in errors.items():
+            logprint(f"{e}, starting offline")
+            self.health.set_offline(i, time.monotonic())
+
+    def _setup_motors(self, indices):
+        # caller holds self.lock. Batched read-compare-write setup, then the
+        # register-by-register path for whatever that couldn't confirm.
+        # -> {index: DynamixelError} for motors that couldn't be set up
+        errors = {}
+        for i in self._configure(indices):
+            dxl_id = self.dxl_ids[i]
+            try:
+                self._setup_motor(dxl_id)
+            except DynamixelError as e:
+                errors[i] = e
+                continue
+            self._setup_registers.update(self._read_block([dxl_id], ADDR_TORQUE_ENABLE, SETUP_READ_LENGTH))
+        return errors
+
+    def _configure(self, indices):
+        # caller holds self.lock. One sync read of operating mode and one of
+        # torque enable .. goal position for every motor, sync writes for
+        # only the registers that differ (so the EEPROM operating mode is only
+        # written when it actually changes, and torque isn't toggled on a
+        # motor that is already set up), then a read to confirm. The indirect
+        # addresses for the hardware status poll are checked the same way.
+        # -> indices that didn't answer or didn't take the values
+        ids = [self.dxl_ids[i] for i in indices]
+        modes = self._read_block(ids, ADDR_OPERATING_MODE, 1)
+        registers = self._read_block(ids, ADDR_TORQUE_ENABLE, SETUP_READ_LENGTH)
+        gains_offset = ADDR_POSITION_D_GAIN - ADDR_TORQUE_ENABLE
+        answered = [dxl_id for dxl_id in ids if dxl_id in modes and dxl_id in registers]
+        indirect = self._read_block(answered, ADDR_INDIRECT_ADDRESS, len(HARDWARE_INDIRECT))
+        mode_ids, gain_ids, indirect_ids, off_ids, on_ids = [], [], [], [], []
+        for dxl_id in answered:
+            torque = registers[dxl_id][0] == TORQUE_ENABLE
+            want_torque = dxl_id in self.motor_with_torque
+            mode_ok = modes[dxl_id][0] == self.control_mode
+            indirect_ok = indirect.get(dxl_id) == HARDWARE_INDIRECT
+            if not mode_ok:
+                mode_ids.append(dxl_id)
+            if struct.unpack_from("<3h", registers[dxl_id], gains_offset) != POSITION_GAINS:
+                gain_ids.append(dxl_id)
+            if not indirect_ok:
+                indirect_ids.append(dxl_id)
+            if torque and (not mode_ok or not indirect_ok or not want_torque):
+                off_ids.append(dxl_id)
+            if want_torque and (not torque or not mode_ok or not indirect_ok):
+                on_ids.append(dxl_id)
+        self._sync_write(off_ids, ADDR_TORQUE_ENABLE, [(0, np.uint8, TORQUE_DISABLE)])
+        self._sync_write(mode_ids, ADDR_OPERATING_MODE, [(0, np.uint8, self.control_mode)])
+        self._sync_write(gain_ids, ADDR_POSITION_D_GAIN, [(2 * k, np.int16, gain) for k, gain in enumerate(POSITION_GAINS)])
+        self._sync_write(indirect_ids, ADDR_INDIRECT_ADDRESS,
+                         [(2 * k, np.uint16, addr) for k, addr in enumerate(HARDWARE_STATUS_ADDRS)])
+        self._sync_write(on_ids, ADDR_TORQUE_ENABLE, [(0, np.uint8, TORQUE_ENABLE)])
+        written = [dxl_id for dxl_id in answered if dxl_id in set(off_ids + mode_ids + gain_ids + indirect_ids + on_ids)]
+        if written:
+            # Confirm just what was written: operating mode, torque enable .. gains, indirect addresses
+            modes.update(self._read_block(mode_ids, ADDR_OPERATING_MODE, 1))
+            check = self._read_block(written, ADDR_TORQUE_ENABLE, gains_offset + 6)
+            for dxl_id in written:
+                if dxl_id in check:
+                    registers[dxl_id] = check[dxl_id] + registers[dxl_id][gains_offset + 6:]
+                else:
+                    del registers[dxl_id]
+            indirect.update(self._read_block(indirect_ids, ADDR_INDIRECT_ADDRESS, len(HARDWARE_INDIRECT)))
+        for dxl_id in answered:
+            # Not part of the setup check: a motor without it is just not polled
+            if indirect.get(dxl_id) == HARDWARE_INDIRECT:
+                self._hardware_mapped.add(dxl_id)
+            else:
+                self._hardware_mapped.discard(dxl_id)
+        logprint(f"Setup: {len(answered)}/{len(ids)} motors answered, wrote operating mode to {mode_ids},"
+                 f" gains to {gain_ids}, indirect addresses to {indirect_ids}, torque to {off_ids + on_ids}")
+        failed = []
+        for i, dxl_id in zip(indices, ids):
+            block = registers.get(dxl_id)
+            if (dxl_id not in modes or block is None or modes[dxl_id][0] != self.control_mode
+                    or struct.unpack_from("<3h", block, gains_offset) != POSITION_GAINS
+                    or (block[0] == TORQUE_ENABLE) != (dxl_id in self.motor_with_torque)):
+                failed.append(i)
+            else:
+                self._setup_registers[dxl_id] = block
+        return failed
+
+    def _read_block(self, dxl_ids, addr, length):
+        # caller holds self.lock. One sync read -> {dxl_id: bytes} for the
+        # motors that answered (none after one that times out)
+        if not dxl_ids:
+            return {}
+        reader = GroupSyncRead(self.portHandler, self.packetHandler, addr, length)
+        for dxl_id in dxl_ids:
+            reader.addParam(dxl_id)
+        if reader.txPacket() != COMM_SUCCESS:
+            return {}
+        blocks = {}
+        for dxl_id in dxl_ids:
+            data, dxl_comm_result, dxl_error = self.packetHandler.readRx(self.portHandler, dxl_id, length)
+            if dxl_comm_result == COMM_RX_TIMEOUT:
+                break
+            if dxl_comm_result == COMM_SUCCESS and len(data) == length:
+                blocks[dxl_id] = bytes(data)
+        return blocks
+
+    def _sync_write(self, dxl_ids, addr, fields):
+        # caller holds self.lock. fields: [(offset, dtype, value)], the same
+        # value for every motor
+        if not dxl_ids:
+            return
+        length = max(offset + np.dtype(dtype).itemsize for offset, dtype, _ in fields)
+        frame = SyncWriteFrame(dxl_ids, addr, length)
+        for offset, dtype, value in fields:
+            frame.field(offset, dtype)[:] = value
+        self._send_frame(frame)
+
+    def _setup_motor(self, dxl_id):
+        # caller holds self.lock. One write per register, with retries
+        self._write(dxl_id, ADDR_TORQUE_ENABLE, np.int8(TORQUE_DISABLE))
+        #self._write(dxl_id, ADDR_OPERATING_MODE, np.int8(CURRENT_BASE_POSITION_CONTROL_MODE))
+        #self._write(dxl_id, ADDR_OPERATING_MODE, np.int8(PWM_CONTROL_MODE))
+        self._write(dxl_id, ADDR_OPERATING_MODE, np.int8(self.control_mode))
+        self._write(dxl_id, ADDR_POSITION_D_GAIN, np.int16(POSITION_GAINS[0]))
+        self._write(dxl_id, ADDR_POSITION_I_GAIN, np.int16(POSITION_GAINS[1]))
+        self._write(dxl_id, ADDR_POSITION_P_GAIN, np.int16(POSITION_GAINS[2]))
+        for k, addr in enumerate(HARDWARE_STATUS_ADDRS):
+            self._write(dxl_id, ADDR_INDIRECT_ADDRESS + 2 * k, np.uint16(addr))
+        self._hardware_mapped.add(dxl_id)
+        if dxl_id in self.motor_with_torque:
+            self._write(dxl_id, ADDR_TORQUE_ENABLE, np.int8(TORQUE_ENABLE))
 
     def cleanup(self):
+        self.stop_acquisition()
         with self.lock:
             for dxl_id in self.dxl_ids:
-                self.writeTxRx(dxl_id, ADDR_TORQUE_ENABLE, np.int8(TORQUE_DISABLE))
+                try:
+                    self._write(dxl_id, ADDR_TORQUE_ENABLE, np.int8(TORQUE_DISABLE))
+                except DynamixelError as e:
+                    logprint(f"{e}, torque left as is")
             self.portHandler.closePort()
 
+    def motor_health(self):
+        # Link health, plus the last hardware status poll of each motor
+        summary = self.health.summary(time.monotonic())
+        hardware = self.hardware
+        for i in np.flatnonzero(hardware.checked):
+            summary[self.dxl_ids[i]].update(self._hardware_summary(i))
+        return summary
+
+    def _hardware_summary(self, i):
+        error = int(self.hardware.error[i])
+        return {"hardware_errors": decode_hardware_error(error) if error else [],
+                "voltage": float(self.hardware.voltage[i]), "temperature": float(self.hardware.temperature[i])}
+
+    def add_hardware_listener(self, fn):
+        # fn({"id", "raised", "cleared", "hardware_errors", "voltage",
+        # "temperature"}) whenever a motor's hardware error bits change, on the
+        # thread that polled them (the acquisition thread once it runs)
+        self.hardware_listeners.append(fn)
+
+    def start_acquisition(self, period=0.0):
+        # Opt-in: one thread owns the bus reads, consumers use latest_frame()
+        if self.acquisition is None:
+            self.acquisition = Acquisition(self, period)
+            self.acquisition.start()
+        return self.acquisition
+
+    def stop_acquisition(self):
+        if self.acquisition is not None:
+            self.acquisition.stop()
+            self.acquisition = None
+
+    def latest_frame(self, out=None):
+        # Latest acquired frame without touching the bus or self.lock
+        return self.acquisition.frames.latest(out)
+
     def fetch_present_status(self):
-        with self.lock:
-            dxl_comm_result = self.groupSyncRead.txRxPacket()
-            if dxl_comm_result != COMM_SUCCESS:
-                print(f"[ERROR] GroupSyncRead failed: {self.packetHandler.getTxRxResult(dxl_comm_result)}")
+        # One bus transaction for every online motor. A bad reply only
+        # invalidates its own motor (present_valid[i]) and keeps its last
+        # value; motors that keep failing drop out of the read until they
+        # answer a ping again (see health.py).
+        with self._locked("fetch_present_status"):
+            n = len(self.dxl_ids)
+            valid = self.present_valid[:n]
+            valid[:] = False
+            self._attempted[:] = False
+            if self._active_index.size:
+                if self.read_mode == READ_MODE_FAST:
+                    status = self._fast_sync_read(valid)
+                    if not valid.any():
+                        # A missing motor truncates the whole fast packet; a
+                        # sync read tells which one it is
+                        self._attempted[:] = False
+                        status = self._sync_read(valid)
+                elif self.read_mode == READ_MODE_BULK:
+                    status = self._bulk_read(valid)
+                else:
+                    status = self._sync_read(valid)
+                np.copyto(self.present_currents[:n], status["current"], where=valid)
+                np.copyto(self.present_velocities[:n], status["velocity"], where=valid)
+                np.copyto(self.present_positions[:n], status["position"], where=valid)
+            if self.metrics is not None:
+                self.metrics.record_reads(self.dxl_ids, valid)
+            if self._first_frame_pending and self._active_index.size and valid[self._active_index].all():
+                self._report_first_frame()
+            now = time.monotonic()
+            if self.health.update(now, valid, self._attempted):
+                logprint(f"Motor ID {[self.dxl_ids[i] for i in np.flatnonzero(~self.health.active)]} offline")
+                self._rebuild_reads()
+            i = self.health.next_due(now)
+            if i is not None:
+                self._probe(i)
+            idle = self.health.offline_count == n and self.health.next_probe.min() - now
+        if self._hardware_mapped:
+            self._poll_hardware()
+        if idle and idle > 0:
+            # Nothing left to read: wait for the next probe rather than spin
+            time.sleep(min(idle, self.health.backoff_min))
+        return bool(valid.all())
+
+    def _poll_hardware(self):
+        # Error status, voltage and temperature of every online motor in one
+        # sync read of their indirect data, as its own transaction so it
+        # shows up separately in the metrics. Alerts are edge-triggered: one
+        # when a motor's error bits change, not one per poll. due() counts
+        # frames and reads alert bits other threads set, so it goes under the lock too.
+        with self._locked("hardware_status"):
+            if not self.hardware.due():
                 return
+            index = [i for i in self._active_index if self.dxl_ids[i] in self._hardware_mapped]
+            blocks = self._read_block([self.dxl_ids[i] for i in index], ADDR_INDIRECT_DATA, HARDWARE_STATUS_DTYPE.itemsize)
+            index = [i for i in index if self.dxl_ids[i] in blocks]
+            status = np.frombuffer(b"".join(blocks[self.dxl_ids[i]] for i in index), HARDWARE_STATUS_DTYPE)
+            changed = self.hardware.update(index, status["error"], status["voltage"], status["temperature"])
+        for i, old, new in changed:
+            alert = dict(self._hardware_summary(i), id=self.dxl_ids[i],
+                         raised=decode_hardware_error(new & ~old) if new & ~old else [],
+                         cleared=decode_hardware_error(old & ~new) if old & ~new else [])
+            if alert["raised"]:
+                logprint(f"Motor ID {alert['id']} hardware error: {alert['raised']}"
+                         f" ({alert['voltage']:.1f} V, {alert['temperature']:.0f} C)")
+            if alert["cleared"]:
+                logprint(f"Motor ID {alert['id']} hardware error cleared: {alert['cleared']}")
+            for fn in self.hardware_listeners:
+                try:
+                    fn(alert)
+                except Exception as e:
+                    # a listener's bug must not stop the acquisition thread
+                    logprint(f"Hardware listener {fn!r} failed: {e}")
+
+    def _report_first_frame(self):
+        self._first_frame_pending = False
+        self.startup["first frame"] = time.monotonic() - self._created
+        steps = ", ".join(f"{name} {seconds * 1000:.0f} ms" for name, seconds in self.startup.items())
+        age = process_age()
+        since = f"{age * 1000:.0f} ms after process start" if age is not None else "ready"
+        logprint(f"First valid frame {since} ({steps})")
+
+    def _probe(self, i):
+        # caller holds self.lock. Ping an offline motor; if it answers, set it
+        # up again (a brown-out resets its RAM) and put it back in the read.
+        dxl_id = self.dxl_ids[i]
+        model_number, dxl_comm_result, dxl_error = self.packetHandler.ping(self.portHandler, dxl_id)
+        if dxl_comm_result == COMM_SUCCESS and self._setup_motors([i]):
+            dxl_comm_result = COMM_TX_FAIL
+        now = time.monotonic()
+        if dxl_comm_result != COMM_SUCCESS:
+            self.health.probe_failed(i, now)
+            return
+        self.health.recovered(i, now)
+        if not self._goals_seeded[i]:
+            self._seed_goals(i)
+        self._rebuild_reads()
+        logprint(f"Motor ID {dxl_id} back online")
+
+    def _rebuild_reads(self):
+        # Group read over the motors health.active says are online
+        self._active_index = np.flatnonzero(self.health.active)
+        active_ids = [self.dxl_ids[i] for i in self._active_index]
+        if self.read_mode == READ_MODE_BULK:
+            self.groupBulkRead.clearParam()
+            for dxl_id in active_ids:
+                addr, length = self.bulk_ranges[dxl_id]
+                self.groupBulkRead.addParam(dxl_id, addr, length)
+            return
+        if self.read_mode == READ_MODE_FAST:
+            self._fast_ids = np.array(active_ids, np.uint8)
+            self._fast_read_packet = build_packet(BROADCAST_ID, INST_FAST_SYNC_READ,
+                                                  struct.pack("<HH", ADDR_PRESENT_CURRENT, PRESENT_STATUS_LENGTH) + bytes(active_ids))
+        # sync read also backs up a failed fast read
+        self.groupSyncRead.clearParam()
+        for dxl_id in active_ids:
+            self.groupSyncRead.addParam(dxl_id)
+
+    def _tx_failed(self, name, dxl_comm_result):
+        # The port itself refused the packet (motors going quiet is health.py's
+        # job); this runs every frame while it lasts, so log once per ERROR_LOG_SECONDS
+        self._tx_failures += 1
+        now = time.monotonic()
+        if now - self._tx_failure_logged_at >= ERROR_LOG_SECONDS:
+            logprint(f"{name} failed ({self._tx_failures}x): {self.packetHandler.getTxRxResult(dxl_comm_result)}")
+            self._tx_failure_logged_at = now
+            self._tx_failures = 0
+
+    def _sync_read(self, valid):
+        dxl_comm_result = self.groupSyncRead.txPacket()
+        if dxl_comm_result != COMM_SUCCESS:
+            self._tx_failed("GroupSyncRead", dxl_comm_result)
+            return self._status
+        for i in self._active_index:
+            dxl_id = self.dxl_ids[i]
+            self._attempted[i] = True
+            data, dxl_comm_result, dxl_error = self.packetHandler.readRx(self.portHandler, dxl_id, PRESENT_STATUS_LENGTH)
+            if dxl_comm_result == COMM_RX_TIMEOUT:
+                # the chain stalls behind a missing reply, later motors won't answer either
+                break
+            if dxl_comm_result == COMM_SUCCESS and len(data) == PRESENT_STATUS_LENGTH:
+                self._status_buf[i * PRESENT_STATUS_LENGTH:(i + 1) * PRESENT_STATUS_LENGTH] = data
+                valid[i] = True
+                if dxl_error & ERRBIT_ALERT and not self.hardware.error[i]:
+                    self.hardware.alerted[i] = True
+        return self._status
 
-            for i, dxl_id in enumerate(self.dxl_ids):
-                if self.groupSyncRead.isAvailable(dxl_id, ADDR_PRESENT_CURRENT, 10):
-                    self.present_currents[i] = np.array(
-                        self.groupSyncRead.getData(dxl_id, ADDR_PRESENT_CURRENT, 2)
-                    ).astype(np.int16)
-                    self.present_positions[i] = np.array(
-                        self.groupSyncRead.getData(dxl_id, ADDR_PRESENT_POSITION, 4)
-                    ).astype(np.int32)
+    def _bulk_read(self, valid):
+        dxl_comm_result = self.groupBulkRead.txPacket()
+        if dxl_comm_result != COMM_SUCCESS:
+            self._tx_failed("GroupBulkRead", dxl_comm_result)
+            return self._status
+        for i in self._active_index:
+            dxl_id = self.dxl_ids[i]
+            self._attempted[i] = True
+            addr, length = self.bulk_ranges[dxl_id]
+            data, dxl_comm_result, dxl_error = self.packetHandler.readRx(self.portHandler, dxl_id, length)
+            if dxl_comm_result == COMM_RX_TIMEOUT:
+                break
+            if dxl_comm_result == COMM_SUCCESS and len(data) == length:
+                self.bulk_data[dxl_id] = bytes(data)
+                offset = ADDR_PRESENT_CURRENT - addr
+                self._status_buf[i * PRESENT_STATUS_LENGTH:(i + 1) * PRESENT_STATUS_LENGTH] = data[offset:offset + PRESENT_STATUS_LENGTH]
+                valid[i] = True
+                if dxl_error & ERRBIT_ALERT and not self.hardware.error[i]:
+                    self.hardware.alerted[i] = True
+        return self._status
 
+    def _fast_sync_read(self, valid):
+        # Every motor appends its [error, id, data, crc] block to one status
+        # packet, which maps straight onto FAST_STATUS_DTYPE. A missing motor
+        # truncates the whole packet, so every motor in it is blamed.
+        index = self._active_index
+        k = len(index)
+        self._attempted[index] = True
+        self.portHandler.clearPort()
+        self.portHandler.writePort(self._fast_read_packet)
+        packet = self._rx_status_packet(8 + k * FAST_STATUS_DTYPE.itemsize)
+        if packet is None:
+            return self._status
+        body = unstuff(packet[8:-2]) + packet[-2:]
+        if len(body) != k * FAST_STATUS_DTYPE.itemsize:
+            return self._status
+        frame = np.frombuffer(body, FAST_STATUS_DTYPE)
+        ok = (frame["id"] == self._fast_ids) & ((frame["error"] & 0x7F) == 0)
+        alert = frame["error"] >= ERRBIT_ALERT
+        if alert.any():
+            self.hardware.alerted[index] |= alert & (self.hardware.error[index] == 0)
+        if k == len(self.dxl_ids):
+            np.copyto(valid, ok)
+            return frame
+        valid[index] = ok
+        for name in ("current", "velocity", "position"):
+            self._status[name][index] = frame[name]
+        return self._status
+
+    def _rx_status_packet(self, wait_length):
+        # Reads one (possibly byte-stuffed) status packet, None on timeout or bad CRC
+        port = self.portHandler
+        port.setPacketTimeout(wait_length)
+        rx = bytearray()
+        while True:
+            rx += port.readPort(wait_length - len(rx))
+            start = rx.find(HEADER)
+            if start != 0:
+                del rx[:start if start > 0 else max(0, len(rx) - 3)]
+            if len(rx) >= 7 and rx.startswith(HEADER):
+                wait_length = 7 + (rx[5] | (rx[6] << 8))
+            if len(rx) >= wait_length:
+                break
+            if port.isPacketTimeout():
+                return None
+        packet = bytes(rx[:wait_length])
+        if crc16(packet, 0, 0, wait_length - 2) != (packet[-2] | (packet[-1] << 8)):
+            return None
+        return packet
+
+    def read_bulk_value(self, dxl_id, addr, size, signed=False):
+        # Value of an extra register from the last bulk read (see bulk_ranges)
+        start, length = self.bulk_ranges[dxl_id]
+        data = self.bulk_data.get(dxl_id)
+        if data is None or addr < start or addr + size > start + length:
+            return None
+        return int.from_bytes(data[addr - start:addr - start + size], "little", signed=signed)
+
+    def _send_frame(self, frame):
+        # caller holds self.lock
+        packet = frame.finalize()
+        self.portHandler.clearPort()
+        if self.portHandler.writePort(packet) != len(packet):
+            logprint("%s" % self.packetHandler.getTxRxResult(COMM_TX_FAIL))
+            if self.metrics is not None:
+                self.metrics.error("sync_write")
 
     def set_goal_positions(self, pos):
-        with self.lock:
-            for dxl_id, p in zip(self.dxl_ids, pos):
-                param_goal_position = [DXL_LOBYTE(DXL_LOWORD(p)), DXL_HIBYTE(DXL_LOWORD(p)), DXL_LOBYTE(DXL_HIWORD(p)), DXL_HIBYTE(DXL_HIWORD(p))]
-                if self.pos_writer.addParam(dxl_id, param_goal_position) != True:
-                    logprint("[ID:%03d] pos_writer addparam failed" % dxl_id)
-            dxl_comm_result = self.pos_writer.txPacket()
-            if dxl_comm_result != COMM_SUCCESS:
-                logprint("%s" % self.packetHandler.getTxRxResult(dxl_comm_result))
-            self.pos_writer.clearParam()
+        with self._locked("set_goal_positions"):
+            store_goals(self.goal_position, pos)
+            np.copyto(self.goals["position"], self.goal_position)
+            self._send_frame(self.pos_frame)
 
     def set_goal_positions_currents(self, pos, cur):
-        with self.lock:
-            for dxl_id, p, c in zip(self.dxl_ids, pos, cur):
-                param_goal_position = [DXL_LOBYTE(DXL_LOWORD(p)), DXL_HIBYTE(DXL_LOWORD(p)), DXL_LOBYTE(DXL_HIWORD(p)), DXL_HIBYTE(DXL_HIWORD(p))]
-                param_goal_current = [DXL_LOBYTE(DXL_LOWORD(c)), DXL_HIBYTE(DXL_LOWORD(c))]
-                if self.pos_writer.addParam(dxl_id, param_goal_position) != True:
-                    logprint("[ID:%03d] pos_writer addparam failed" % dxl_id)
-                if self.cur_writer.addParam(dxl_id, param_goal_current) != True:
-                    logprint("[ID:%03d] cur_writer addparam failed" % dxl_id)
-            dxl_comm_result = self.pos_writer.txPacket()
-            if dxl_comm_result != COMM_SUCCESS:
-                logprint("%s" % self.packetHandler.getTxRxResult(dxl_comm_result))
-            self.pos_writer.clearParam()
-            dxl_comm_result = self.cur_writer.txPacket()
-            if dxl_comm_result != COMM_SUCCESS:
-                logprint("%s" % self.packetHandler.getTxRxResult(dxl_comm_result))
-            self.cur_writer.clearParam()
+        self.set_goals(pos=pos, cur=cur)
 
     def set_goal_currents(self, cur):
-        with self.lock:
-            for dxl_id, c in zip(self.dxl_ids, cur):
-                param_goal_current = [DXL_LOBYTE(DXL_LOWORD(c)), DXL_HIBYTE(DXL_LOWORD(c))]
-                if self.cur_writer.addParam(dxl_id, param_goal_current) != True:
-                    logprint("[ID:%03d] cur_writer addparam failed" % dxl_id)
-            dxl_comm_result = self.cur_writer.txPacket()
-            if dxl_comm_result != COMM_SUCCESS:
-                logprint("%s" % self.packetHandler.getTxRxResult(dxl_comm_result))
-            self.cur_writer.clearParam()
+        with self._locked("set_goal_currents"):
+            store_goals(self.goal_current, cur)
+            np.copyto(self.goals["current"], self.goal_current)
+            self._send_frame(self.cur_frame)
 
     def set_goal_pwms(self, pwm):
-        with self.lock:
-            for dxl_id, c in zip(self.dxl_ids, pwm):
-                param_goal_pwm = [DXL_LOBYTE(DXL_LOWORD(c)), DXL_HIBYTE(DXL_LOWORD(c))]
-                if self.pwm_writer.addParam(dxl_id, param_goal_pwm) != True:
-                    logprint("[ID:%03d] pwm_writer addparam failed" % dxl_id)
-            dxl_comm_result = self.pwm_writer.txPacket()
-            if dxl_comm_result != COMM_SUCCESS:
-                logprint("%s" % self.packetHandler.getTxRxResult(dxl_comm_result))
-            self.pwm_writer.clearParam()
+        with self._locked("set_goal_pwms"):
+            store_goals(self.goal_pwm, pwm)
+            np.copyto(self.goals["pwm"], self.goal_pwm)
+            self._send_frame(self.pwm_frame)
+
+    def set_goals(self, pos=None, cur=None, pwm=None):
+        # One packet over the Goal PWM..Goal Position span. Omitted goals
+        # resend the last value written (or read back at startup).
+        with self._locked("set_goals"):
+            for name, values in (("position", pos), ("current", cur), ("pwm", pwm)):
+                if values is not None:
+                    store_goals(self.goals[name], values)
+            np.copyto(self.goal_position, self.goals["position"])
+            np.copyto(self.goal_current, self.goals["current"])
+            np.copyto(self.goal_pwm, self.goals["pwm"])
+            self._send_frame(self.goal_frame)
+
+    def _load_goal_registers(self):
+        # Seed the combined goal frame with what the motors held at setup,
+        # so the registers between Goal PWM and Goal Position (goal velocity,
+        # profile acceleration/velocity) are written back unchanged.
+        # A motor that was offline gets seeded when it comes back.
+        self._goals_seeded = np.zeros((len(self.dxl_ids)), bool)
+        for i in range(len(self.dxl_ids)):
+            self._seed_goals(i)
+
+    def _seed_goals(self, i):
+        block = self._setup_registers.get(self.dxl_ids[i])
+        if block is None:
+            return
+        self.goal_frame.data[i] = np.frombuffer(block, np.uint8, GOAL_SPAN_LENGTH, ADDR_GOAL_PWM - ADDR_TORQUE_ENABLE)
+        self.goal_position[i] = self.goals["position"][i]
+        self.goal_current[i] = self.goals["current"][i]
+        self.goal_pwm[i] = self.goals["pwm"][i]
+        self._goals_seeded[i] = True
 
     def disable_torque(self, ids):
-        with self.lock:
+        with self._locked("disable_torque"):
             for dxl_id in ids:
                 self.packetHandler.write1ByteTxRx(
                     self.portHandler, dxl_id, 64, 0
@@ -201,22 +764,23 @@ def check_hardware_error(packetHandler, portHandler, dxl_id):
     print(f"[INFO] Hardware Error Status for ID {dxl_id}: {data} -> {error_list}")
 
 
-# Initialize port and packet handlers (adjust device name and baudrate)
-portHandler = PortHandler("/dev/ttyUSB0")
-packetHandler = PacketHandler(PROTOCOL_VERSION)
+if __name__ == "__main__":
+    # Initialize port and packet handlers (adjust device name and baudrate)
+    portHandler = make_port_handler(os.environ.get("KIRIGIRISU_DEVICE", DEFAULT_DEVICE), [10])
+    packetHandler = PacketHandler(PROTOCOL_VERSION)
 
-if not portHandler.openPort():
-    print("Failed to open port")
-    exit()
+    if not portHandler.openPort():
+        print("Failed to open port")
+        exit()
 
-if not portHandler.setBaudRate(BAUDRATE):
-    print("Failed to set baudrate")
-    exit()
+    if not portHandler.setBaudRate(BAUDRATE):
+        print("Failed to set baudrate")
+        exit()
 
-# Replace with your actual motor ID
-motor_id = 10
+    # Replace with your actual motor ID
+    motor_id = 10
 
-check_hardware_error(packetHandler, portHandler, motor_id)
+    check_hardware_error(packetHandler, portHandler, motor_id)
 
-# Close the port after you're done
-portHandler.closePort()
+    # Close the port after you're done
+    portHandler.closePort()
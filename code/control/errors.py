@@ -0,0 +1,7 @@
+class DynamixelError(Exception):
+    # A transaction that failed for good; dxl_id is None for port-level errors
+    def __init__(self, message, dxl_id=None, comm_result=None, error=None):
+        super().__init__(message if dxl_id is None else f"[ID:{dxl_id:03d}] {message}")
+        self.dxl_id = dxl_id
+        self.comm_result = comm_result
+        self.error = error
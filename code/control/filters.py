@@ -0,0 +1,197 @@
+import math
+import os
+
+import numpy as np
+
+# Per-motor signal filters for the acquisition loop, one vectorized step per
+# frame over all motors. Each filter keeps its state in arrays and tracks its
+# own time step per motor, so a motor that missed reads is simply not updated
+# (and restarts from its next raw sample after RESET_SECONDS of silence).
+#
+#   KIRIGIRISU_FILTER_POSITION=oneeuro:1.0,0.005   min cutoff Hz, beta (1/tick), derivative cutoff Hz (1.0)
+#   KIRIGIRISU_FILTER_POSITION=lowpass:10          cutoff Hz
+#   KIRIGIRISU_FILTER_CURRENT=lowpass:5
+#   KIRIGIRISU_FILTER_VELOCITY=lowpass:20          smooths the finite-difference velocity
+#
+# Unset means no filter: the filtered values are the raw ones. Filtering
+# costs latency. latency() is the lag (s) of a first-order stage behind a
+# ramp at `speed` ticks/s, which is exactly its time constant. One-Euro
+# opens its cutoff up with speed, so it lags most when the arm moves slowly
+# and least when it moves fast. See benchFilters.py to measure it and the
+# jitter left at rest on the sim bus or a recorded log.
+
+RESET_SECONDS = 0.5
+FILTER_SPECS = {
+    "position": os.environ.get("KIRIGIRISU_FILTER_POSITION", ""),
+    "current": os.environ.get("KIRIGIRISU_FILTER_CURRENT", ""),
+    "velocity": os.environ.get("KIRIGIRISU_FILTER_VELOCITY", ""),
+}
+
+
+def time_constant(cutoff):
+    return 1.0 / (2 * math.pi * cutoff)
+
+
+class LowPass:
+    # First-order low-pass (exponential smoothing) at `cutoff` Hz:
+    # alpha = dt / (dt + tau) from each motor's own dt
+    name = "lowpass"
+
+    def __init__(self, n, cutoff):
+        if cutoff <= 0:
+            raise ValueError(f"cutoff must be above 0 Hz, got {cutoff}")
+        self.cutoff = cutoff
+        self.tau = time_constant(cutoff)
+        self.value = np.zeros((n))
+        self._alpha = np.zeros((n))
+        self._delta = np.zeros((n))
+
+    def reset(self, x, mask):
+        np.copyto(self.value, x, where=mask)
+
+    def step(self, x, dt, mask):
+        alpha = self._alpha
+        np.add(dt, self.tau, out=alpha)
+        np.divide(dt, alpha, out=alpha)
+        np.subtract(x, self.value, out=self._delta)
+        self._delta *= alpha
+        np.add(self.value, self._delta, out=self.value, where=mask)
+        return self.value
+
+    def latency(self, speed=0.0):
+        return self.tau
+
+    def settings(self):
+        return {"type": self.name, "cutoff": self.cutoff}
+
+
+class OneEuro:
+    # Casiez et al., "1€ Filter" (CHI 2012): a low-pass whose cutoff rises
+    # with the (smoothed) speed, min_cutoff + beta * |dx/dt|
+    name = "oneeuro"
+
+    def __init__(self, n, min_cutoff=1.0, beta=0.0, d_cutoff=1.0):
+        if min_cutoff <= 0 or beta < 0:
+            raise ValueError(f"min cutoff must be above 0 Hz and beta at least 0, got {min_cutoff}, {beta}")
+        self.min_cutoff = min_cutoff
+        self.beta = beta
+        self.d_cutoff = d_cutoff
+        self.value = np.zeros((n))
+        self.speed = LowPass(n, d_cutoff) # ticks/s
+        self._prev = np.zeros((n)) # raw sample the speed is differenced against
+        self._dx = np.zeros((n))
+        self._alpha = np.zeros((n))
+        self._delta = np.zeros((n))
+
+    def reset(self, x, mask):
+        np.copyto(self.value, x, where=mask)
+        np.copyto(self._prev, x, where=mask)
+        np.copyto(self.speed.value, 0.0, where=mask)
+
+    def step(self, x, dt, mask):
+        dx = self._dx
+        np.subtract(x, self._prev, out=dx)
+        np.divide(dx, dt, out=dx, where=dt > 0)
+        np.copyto(self._prev, x, where=mask)
+        self.speed.step(dx, dt, mask)
+        # tau = 1 / (2 pi cutoff), cutoff = min_cutoff + beta * |speed|
+        alpha = self._alpha
+        np.abs(self.speed.value, out=alpha)
+        alpha *= self.beta
+        alpha += self.min_cutoff
+        alpha *= 2 * math.pi
+        np.reciprocal(alpha, out=alpha)
+        alpha += dt
+        np.divide(dt, alpha, out=alpha)
+        np.subtract(x, self.value, out=self._delta)
+        self._delta *= alpha
+        np.add(self.value, self._delta, out=self.value, where=mask)
+        return self.value
+
+    def latency(self, speed=0.0):
+        return time_constant(self.min_cutoff + self.beta * abs(speed))
+
+    def settings(self):
+        return {"type": self.name, "min_cutoff": self.min_cutoff, "beta": self.beta, "d_cutoff": self.d_cutoff}
+
+
+FILTERS = {"lowpass": LowPass, "oneeuro": OneEuro}
+
+
+def make_filter(spec, n):
+    # "lowpass:10", "oneeuro:1.0,0.005[,1.0]" -> filter, or None for ""/"none"
+    if not spec or spec == "none":
+        return None
+    name, _, args = spec.partition(":")
+    if name not in FILTERS:
+        raise ValueError(f"unknown filter {name!r} (one of {sorted(FILTERS)})")
+    try:
+        args = [float(arg) for arg in args.split(",") if arg]
+        if not all(map(math.isfinite, args)):
+            raise ValueError("arguments must be finite")
+        return FILTERS[name](n, *args)
+    except (TypeError, ValueError) as e:
+        raise ValueError(f"bad filter spec {spec!r}: {e}") from None
+
+
+class FilterStage:
+    # Filtered positions/currents (float, held through missed reads) and
+    # velocities (ticks/s, finite difference of raw positions) for n motors
+    def __init__(self, n, position=None, current=None, velocity=None):
+        self.n = n
+        self.position = position
+        self.current = current
+        self.velocity = velocity
+        self.positions = np.zeros((n))
+        self.currents = np.zeros((n))
+        self.velocities = np.zeros((n))
+        self._prev = np.zeros((n)) # raw position at the last valid sample
+        self._last_t = np.full((n), -np.inf)
+        self._dt = np.zeros((n))
+        self._reset = np.zeros((n), bool)
+        self._update = np.zeros((n), bool)
+        self._idle = np.zeros((n), bool)
+        self._diff = np.zeros((n))
+
+    @classmethod
+    def from_specs(cls, n, specs=FILTER_SPECS):
+        return cls(n, *(make_filter(specs.get(name, ""), n) for name in ("position", "current", "velocity")))
+
+    def step(self, timestamp, positions, currents, valid):
+        dt, reset, update = self._dt, self._reset, self._update
+        np.subtract(timestamp, self._last_t, out=dt)
+        # First sample, or back after a long silence: start over from the raw value
+        np.greater(dt, RESET_SECONDS, out=reset)
+        reset &= valid
+        np.logical_not(reset, out=update)
+        update &= valid
+        np.copyto(self._last_t, timestamp, where=valid)
+        np.logical_not(update, out=self._idle)
+        np.copyto(dt, 0.0, where=self._idle) # only motors being updated get a step
+
+        np.subtract(positions, self._prev, out=self._diff)
+        np.divide(self._diff, dt, out=self.velocities, where=dt > 0)
+        np.copyto(self.velocities, 0.0, where=reset)
+        np.copyto(self._prev, positions, where=valid)
+        if self.velocity is not None:
+            self.velocity.reset(self.velocities, reset)
+            np.copyto(self.velocities, self.velocity.step(self.velocities, dt, update), where=valid)
+
+        for f, raw, out in ((self.position, positions, self.positions), (self.current, currents, self.currents)):
+            if f is None:
+                np.copyto(out, raw, where=valid)
+            else:
+                f.reset(raw, reset)
+                np.copyto(out, f.step(raw, dt, update), where=valid)
+
+    def settings(self, speeds=(0.0, 1000.0)):
+        # -> {"position": {"type", ..., "latency_ms": {"<speed>/s": ms}}, ...}, speed in
+        # ticks/s for positions, current units/s for currents
+        result = {}
+        for name in ("position", "current", "velocity"):
+            f = getattr(self, name)
+            if f is None:
+                result[name] = None
+                continue
+            result[name] = dict(f.settings(), latency_ms={f"{speed:g}/s": f.latency(speed) * 1000 for speed in speeds})
+        return result
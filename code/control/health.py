@@ -0,0 +1,135 @@
+import os
+
+import numpy as np
+
+# Per-motor link health for DynamixelPort. A motor that misses OFFLINE_AFTER
+# reads in a row is taken out of the group read, so the rest of the chain
+# keeps its full rate instead of sitting through its timeout every frame. It
+# is then pinged after BACKOFF_MIN seconds, doubling up to BACKOFF_MAX while
+# it stays silent. Once it answers, the port re-applies its setup (a
+# brown-out resets torque and gains) and puts it back in the read.
+
+OFFLINE_AFTER = 3
+BACKOFF_MIN = 0.1
+BACKOFF_MAX = 5.0
+# Frames between two hardware status polls (error status, input voltage,
+# temperature); a status packet with the alert bit set brings the next one forward
+HARDWARE_EVERY = int(os.environ.get("KIRIGIRISU_HARDWARE_EVERY", "100"))
+
+ONLINE = 0
+FAILING = 1 # missed its last read(s), still polled
+OFFLINE = 2 # out of the read, probed on backoff
+STATE_NAMES = ("online", "failing", "offline")
+
+
+class MotorHealth:
+    def __init__(self, dxl_ids, offline_after=OFFLINE_AFTER, backoff_min=BACKOFF_MIN, backoff_max=BACKOFF_MAX):
+        n = len(dxl_ids)
+        self.dxl_ids = list(dxl_ids)
+        self.offline_after = offline_after
+        self.backoff_min = backoff_min
+        self.backoff_max = backoff_max
+        self.state = np.zeros((n), np.int8)
+        self.active = np.ones((n), bool) # included in the group read
+        self.failures = np.zeros((n), np.int32) # consecutive
+        self.total_failures = np.zeros((n), np.int64)
+        self.recoveries = np.zeros((n), np.int32)
+        self.last_ok = np.full((n), -np.inf) # time.monotonic() of the last good reply
+        self.backoff = np.full((n), backoff_min)
+        self.next_probe = np.zeros((n))
+        self.offline_count = 0
+        self._failing = False
+
+    def update(self, now, valid, attempted):
+        # After a group read. `attempted`: motors whose reply was actually
+        # waited for (a stalled chain doesn't blame the motors behind the
+        # culprit). -> True if a motor went offline.
+        np.copyto(self.last_ok, now, where=valid)
+        failed = attempted & ~valid
+        if not self._failing and not failed.any():
+            return False
+        self.failures[valid] = 0
+        self.state[valid] = ONLINE
+        self.failures[failed] += 1
+        self.total_failures[failed] += 1
+        self.state[failed] = FAILING
+        self._failing = bool(self.failures[self.active].any())
+        dead = failed & (self.failures >= self.offline_after)
+        if not dead.any():
+            return False
+        for i in np.flatnonzero(dead):
+            self.set_offline(i, now)
+        return True
+
+    def set_offline(self, i, now):
+        if self.active[i]:
+            self.offline_count += 1
+        self.state[i] = OFFLINE
+        self.active[i] = False
+        self.backoff[i] = self.backoff_min
+        self.next_probe[i] = now + self.backoff_min
+
+    def next_due(self, now):
+        # Offline motor whose probe is due (the most overdue one), or None
+        if not self.offline_count:
+            return None
+        due = np.where(self.active, np.inf, self.next_probe)
+        i = int(np.argmin(due))
+        return i if due[i] <= now else None
+
+    def probe_failed(self, i, now):
+        self.total_failures[i] += 1
+        self.backoff[i] = min(self.backoff[i] * 2, self.backoff_max)
+        self.next_probe[i] = now + self.backoff[i]
+
+    def recovered(self, i, now):
+        if not self.active[i]:
+            self.offline_count -= 1
+        self.state[i] = ONLINE
+        self.active[i] = True
+        self.failures[i] = 0
+        self.recoveries[i] += 1
+        self.last_ok[i] = now
+
+    def summary(self, now):
+        # -> {dxl_id: {"state", "failures", "recoveries", "age"}}, age in
+        # seconds since the last good reply (None if it never answered)
+        return {
+            dxl_id: {
+                "state": STATE_NAMES[self.state[i]],
+                "failures": int(self.total_failures[i]),
+                "recoveries": int(self.recoveries[i]),
+                "age": float(now - self.last_ok[i]) if np.isfinite(self.last_ok[i]) else None,
+            }
+            for i, dxl_id in enumerate(self.dxl_ids)
+        }
+
+
+class HardwareStatus:
+    # Last polled Hardware Error Status (70), Present Input Voltage (144, 0.1 V)
+    # and Present Temperature (146, degC) per motor
+    def __init__(self, dxl_ids, every=HARDWARE_EVERY):
+        n = len(dxl_ids)
+        self.dxl_ids = list(dxl_ids)
+        self.every = every
+        self.error = np.zeros((n), np.uint8)
+        self.voltage = np.full((n), np.nan)
+        self.temperature = np.full((n), np.nan)
+        self.checked = np.zeros((n), bool) # polled at least once
+        self.frames = 0 # since the last poll
+        self.alerted = np.zeros((n), bool) # alert bit seen since the last poll
+
+    def due(self):
+        self.frames += 1
+        return self.frames >= self.every or bool(self.alerted.any())
+
+    def update(self, index, errors, voltages, temperatures):
+        # -> [(i, old error, new error)] for the motors whose error bits changed
+        self.frames = 0
+        self.alerted[:] = False
+        changed = [(int(i), int(self.error[i]), int(error)) for i, error in zip(index, errors) if error != self.error[i]]
+        self.error[index] = errors
+        self.voltage[index] = voltages / 10.0
+        self.temperature[index] = temperatures
+        self.checked[index] = True
+        return changed
@@ -0,0 +1,167 @@
+import json
+import os
+
+import numpy as np
+
+TICKS_PER_REV = 4096
+VELOCITY_UNIT = 0.229 * TICKS_PER_REV / 60 # ticks/s per Present Velocity unit (0.229 rev/min)
+CURRENT_UNIT = 0.001 # A per Present Current unit (XC330: 1 mA)
+# N*m per A at the horn. XC330-T181 datasheet stall torque over stall current
+# (0.6 N*m / 1.8 A at 5 V); current to torque is only roughly linear
+TORQUE_CONSTANT = float(os.environ.get("KIRIGIRISU_TORQUE_CONSTANT", str(0.6 / 1.8)))
+
+STATIC_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "static")
+CALIBRATION_PATH = os.path.join(STATIC_DIR, "calibration.json")
+# URDF joint limits exported by the ROS 2 bridge, so the web UI can map
+# encoder ticks to joint angles without xacro/urdf_parser_py
+JOINT_LIMITS_PATH = os.path.join(STATIC_DIR, "joint_limits.json")
+
+MOTOR_TO_JOINT = {
+    0: 'left_rev6',
+    1: 'left_rev7',
+    2: ['left_left_pris1', 'left_right_pris2'],
+    10: 'right_rev6',
+    11: 'right_rev7',
+    12: ['right_left_pris1', 'right_right_pris2'],
+    # add more as needed
+}
+# Optional per-joint transformations: {joint_name: (scale, offset)}
+    # (-1.0, 0.0),  # invert
+    # (-1.0, 0.1),  # invert + offset
+JOINT_TRANSFORMS = {
+    "right_rev6": (-1, 0),
+    "left_rev6": (-1,0),
+    "left_right_pris2": (-1, 0),
+    "right_left_pris1": (-1, -0.05),
+    "right_right_pris2": (1, 0.05),
+    # Add others as needed
+}
+
+
+def load_joint_limits(path=JOINT_LIMITS_PATH):
+    with open(path) as f:
+        return {name: tuple(limits) for name, limits in json.load(f)["joint_limits"].items()}
+
+
+def save_joint_limits(joint_limits, path=JOINT_LIMITS_PATH, **extra):
+    data = dict(extra, joint_limits={name: list(limits) for name, limits in joint_limits.items()})
+    temp_path = path + ".tmp"
+    with open(temp_path, "w") as f:
+        json.dump(data, f, indent=2)
+    os.replace(temp_path, path)
+
+
+class JointMapping:
+    # Encoder ticks -> joint positions, compiled once from the calibration
+    # ranges, URDF limits, MOTOR_TO_JOINT and JOINT_TRANSFORMS into
+    #   joint = clip(unwrap(ticks[index]), raw_min, raw_max) * gain + offset
+    # so a frame is a handful of vectorized NumPy ops. A motor that drives
+    # two joints (grippers) just appears twice in `index`.
+    # Not thread-safe: map*() share per-instance scratch buffers, so each
+    # thread needs its own mapping, or callers hold a lock.
+    def __init__(self, motor_ids, calibration, joint_limits,
+                 motor_to_joint=MOTOR_TO_JOINT, joint_transforms=JOINT_TRANSFORMS):
+        self.motor_ids = list(motor_ids)
+        self.joint_names = []
+        self.skipped = [] # joints without a mapping, calibration or URDF limit
+        index, raw_min, raw_max, gain, offset = [], [], [], [], []
+        for i, motor_id in enumerate(self.motor_ids):
+            joint_names_for_motor = motor_to_joint.get(motor_id)
+            if joint_names_for_motor is None:
+                self.skipped.append(f"motor {motor_id}")
+                continue
+            if isinstance(joint_names_for_motor, str):
+                joint_names_for_motor = [joint_names_for_motor]
+            limits = calibration.get(str(motor_id), calibration.get(motor_id))
+            for joint_name in joint_names_for_motor:
+                if limits is None or joint_name not in joint_limits:
+                    self.skipped.append(joint_name)
+                    continue
+                lo, hi = limits["min"], limits["max"]
+                joint_min, joint_max = joint_limits[joint_name]
+                scale, shift = joint_transforms.get(joint_name, (1.0, 0.0))
+                # A reversed or empty range pins the joint at joint_min, as the
+                # old per-motor clamp did
+                slope = (joint_max - joint_min) / (hi - lo) if hi > lo else 0.0
+                self.joint_names.append(joint_name)
+                index.append(i)
+                raw_min.append(lo)
+                raw_max.append(hi)
+                gain.append(scale * slope)
+                offset.append(scale * (joint_min - lo * slope) + shift)
+        self.index = np.array(index, np.intp)
+        self.raw_min = np.array(raw_min, np.float64)
+        self.raw_max = np.array(raw_max, np.float64)
+        self.gain = np.array(gain, np.float64)
+        self.offset = np.array(offset, np.float64)
+        # Present velocity/current -> joint velocity/effort, the derivatives of
+        # the same linear map: gain is joint units per tick, and by virtual
+        # work effort = motor torque / (joint units per motor radian)
+        self.velocity_gain = self.gain * VELOCITY_UNIT
+        per_radian = self.gain * (TICKS_PER_REV / (2 * np.pi))
+        self.effort_gain = np.divide(CURRENT_UNIT * TORQUE_CONSTANT, per_radian,
+                                     out=np.zeros(len(index)), where=per_radian != 0)
+        self.center = (self.raw_min + self.raw_max) / 2
+        # Multi-turn: a calibrated range may run past 4096 (motor 0 spans
+        # 3992-4747), but the servo's turn count restarts on power-up. Shift
+        # each reading by whole turns to land closest to its calibrated range.
+        self.unwrap = (self.raw_max - self.raw_min) < TICKS_PER_REV
+        self._raw = np.zeros(len(index), np.int32)
+        self._ticks = np.zeros(len(index), np.float64)
+        self._turns = np.zeros(len(index), np.float64)
+        self._gathered = {}
+        self._values = np.zeros(len(index), np.float64)
+
+    @classmethod
+    def from_files(cls, motor_ids, calibration_path=CALIBRATION_PATH, joint_limits_path=JOINT_LIMITS_PATH, **kwargs):
+        with open(calibration_path) as f:
+            calibration = json.load(f)
+        return cls(motor_ids, calibration, load_joint_limits(joint_limits_path), **kwargs)
+
+    def map(self, positions, out=None):
+        # positions: raw ticks in motor_ids order -> joint positions (rad / m)
+        if out is None:
+            out = np.empty(len(self.joint_names), np.float64)
+        positions = np.asarray(positions)
+        if self._raw.dtype != positions.dtype:
+            self._raw = np.zeros(len(self.index), positions.dtype)
+        ticks, turns = self._ticks, self._turns
+        np.take(positions, self.index, out=self._raw)
+        np.copyto(ticks, self._raw)
+        np.subtract(self.center, ticks, out=turns)
+        turns /= TICKS_PER_REV
+        np.rint(turns, out=turns)
+        turns *= TICKS_PER_REV
+        np.add(ticks, turns, out=ticks, where=self.unwrap)
+        np.clip(ticks, self.raw_min, self.raw_max, out=ticks)
+        np.multiply(ticks, self.gain, out=out)
+        out += self.offset
+        return out
+
+    def _gather(self, values):
+        # values[index] as float64, into buffers kept per input dtype
+        values = np.asarray(values)
+        raw = self._gathered.get(values.dtype)
+        if raw is None:
+            raw = self._gathered[values.dtype] = np.zeros(len(self.index), values.dtype)
+        np.take(values, self.index, out=raw)
+        np.copyto(self._values, raw)
+        return self._values
+
+    def map_velocities(self, velocities, out=None):
+        # Present Velocity units in motor_ids order -> joint velocities (rad/s, m/s)
+        if out is None:
+            out = np.empty(len(self.joint_names), np.float64)
+        np.multiply(self._gather(velocities), self.velocity_gain, out=out)
+        return out
+
+    def map_efforts(self, currents, out=None):
+        # Present Current units in motor_ids order -> joint efforts (N*m, N)
+        if out is None:
+            out = np.empty(len(self.joint_names), np.float64)
+        np.multiply(self._gather(currents), self.effort_gain, out=out)
+        return out
+
+    def joint_mask(self, motor_mask):
+        # Per-motor flags (valid/stale) -> per-joint flags
+        return np.take(motor_mask, self.index)
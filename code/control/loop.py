@@ -0,0 +1,145 @@
+import os
+import sys
+import threading
+import time
+
+from .metrics import Histogram
+
+# Fixed-rate loops against absolute deadlines. Each wakeup is scheduled from
+# the previous deadline, not from when the step finished, so a slow step
+# doesn't drag the rate down; a step that overruns by more than a whole
+# period skips the missed deadlines (counted) instead of bursting to catch up.
+# Optionally SCHED_FIFO and/or pinned to CPUs, when the process is allowed to:
+#   KIRIGIRISU_RT_PRIORITY=50 KIRIGIRISU_RT_CPUS=3 python web.py
+# (needs CAP_SYS_NICE or an rtprio limit, e.g. in /etc/security/limits.conf)
+# A step that raises is counted and logged (at most every ERROR_LOG_SECONDS)
+# and the loop carries on after ERROR_BACKOFF; only stop() or a step
+# returning False ends it.
+
+RT_PRIORITY = int(os.environ.get("KIRIGIRISU_RT_PRIORITY", "0"))
+RT_CPUS = [int(cpu) for cpu in os.environ.get("KIRIGIRISU_RT_CPUS", "").split(",") if cpu]
+ERROR_BACKOFF = 0.1
+ERROR_LOG_SECONDS = 5.0
+
+
+def set_realtime(priority=0, cpus=None):
+    # Applies to the calling thread only. -> what took effect, e.g.
+    # {"priority": 50, "cpus": [3]}; anything not permitted is left out.
+    applied = {}
+    if priority and hasattr(os, "sched_setscheduler"):
+        try:
+            os.sched_setscheduler(0, os.SCHED_FIFO, os.sched_param(priority))
+            applied["priority"] = priority
+        except (PermissionError, OSError):
+            pass
+    if cpus and hasattr(os, "sched_setaffinity"):
+        try:
+            os.sched_setaffinity(0, cpus)
+            applied["cpus"] = sorted(cpus)
+        except (PermissionError, OSError):
+            pass
+    return applied
+
+
+class LoopStats:
+    def __init__(self):
+        self.steps = 0
+        self.overruns = 0 # steps that finished past the next deadline
+        self.skipped = 0 # deadlines dropped after an overrun of a whole period or more
+        self.rate = 0.0 # smoothed steps/s
+        self.lateness = Histogram() # wakeup time - deadline
+        self.duration = Histogram() # time spent in step()
+        self.errors = 0 # steps that raised
+        self.last_error = None
+        self._last_start = None
+        self._error_logged_at = -float("inf")
+        self._errors_logged = 0
+
+    def record(self, start, end):
+        if self._last_start is not None and start > self._last_start:
+            self.rate += 0.05 * (1.0 / (start - self._last_start) - self.rate)
+        self._last_start = start
+        self.steps += 1
+        self.duration.record(end - start)
+
+    def error(self, name, e):
+        # Counts a failed step; logs the first one and then a summary at most
+        # every ERROR_LOG_SECONDS, so a dead port doesn't flood the log
+        self.errors += 1
+        self.last_error = f"{type(e).__name__}: {e}"
+        now = time.monotonic()
+        if now - self._error_logged_at >= ERROR_LOG_SECONDS:
+            since = self.errors - self._errors_logged
+            print(f"[{name}] step failed ({since} since last report): {self.last_error}", file=sys.stderr)
+            self._error_logged_at = now
+            self._errors_logged = self.errors
+
+    def summary(self):
+        return {
+            "steps": self.steps,
+            "rate": self.rate,
+            "overruns": self.overruns,
+            "skipped": self.skipped,
+            "errors": self.errors,
+            "last_error": self.last_error,
+            "lateness_ms": self.lateness.summary(),
+            "step_ms": self.duration.summary(),
+        }
+
+
+class LoopRunner(threading.Thread):
+    # Calls step() every `period` seconds, or back to back when period is 0.
+    # Pass `step` or subclass and override step(); returning False ends the loop.
+    # start() runs it on its own thread, run() on the caller's.
+    def __init__(self, step=None, period=0.0, name="loop", priority=0, cpus=None):
+        super().__init__(name=name, daemon=True)
+        self._step = step
+        self.period = period
+        self.priority = priority
+        self.cpus = cpus
+        self.realtime = {}
+        self.stats = LoopStats()
+        self._stop_event = threading.Event()
+
+    def step(self):
+        return self._step()
+
+    @property
+    def stopped(self):
+        return self._stop_event.is_set()
+
+    def stop(self):
+        self._stop_event.set()
+        if self.is_alive() and threading.current_thread() is not self:
+            self.join()
+
+    def run(self):
+        self.realtime = set_realtime(self.priority, self.cpus)
+        stats = self.stats
+        period = self.period
+        deadline = time.monotonic()
+        while not self._stop_event.is_set():
+            start = time.monotonic()
+            try:
+                if self.step() is False:
+                    break
+            except Exception as e:
+                stats.error(self.name, e)
+                if self._stop_event.wait(ERROR_BACKOFF):
+                    break
+                deadline = time.monotonic()
+                continue
+            end = time.monotonic()
+            stats.record(start, end)
+            if not period:
+                continue
+            deadline += period
+            if end > deadline:
+                stats.overruns += 1
+                behind = int((end - deadline) / period)
+                if behind:
+                    stats.skipped += behind
+                    deadline += behind * period
+                continue
+            time.sleep(deadline - end)
+            stats.lateness.record(time.monotonic() - deadline)
@@ -0,0 +1,151 @@
+import threading
+import time
+
+# Per-transaction timing for DynamixelPort. Each operation gets two
+# fixed-size log-linear histograms (HDR-style: SUB_BUCKETS buckets per power
+# of two, ~3% resolution from 1 us to over an hour): time spent waiting for
+# DynamixelPort.lock and time spent on the bus once it was held. Per-motor
+# failed reads and per-op error counts sit next to them. Ports only create a
+# BusMetrics when metrics are enabled, so the disabled cost is one None check.
+
+SUB_BUCKET_BITS = 5
+SUB_BUCKETS = 1 << SUB_BUCKET_BITS
+MAGNITUDES = 32
+
+
+class Histogram:
+    def __init__(self):
+        self.counts = [0] * (SUB_BUCKETS * MAGNITUDES)
+        self.count = 0
+        self.total = 0 # us
+        self.max = 0
+
+    @staticmethod
+    def index(us):
+        if us < SUB_BUCKETS:
+            return us
+        shift = us.bit_length() - SUB_BUCKET_BITS - 1
+        return min((shift + 1) * SUB_BUCKETS + (us >> shift) - SUB_BUCKETS, SUB_BUCKETS * MAGNITUDES - 1)
+
+    @staticmethod
+    def lower_bound(index):
+        # smallest value (us) that lands in bucket `index`
+        if index < SUB_BUCKETS:
+            return index
+        shift = index // SUB_BUCKETS - 1
+        return (SUB_BUCKETS + index % SUB_BUCKETS) << shift
+
+    def record(self, seconds):
+        us = int(seconds * 1e6)
+        self.counts[self.index(us)] += 1
+        self.count += 1
+        self.total += us
+        if us > self.max:
+            self.max = us
+
+    def percentile(self, q):
+        # us, upper edge of the bucket holding the q-th percentile
+        if not self.count:
+            return 0
+        rank = q / 100 * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if count and seen >= rank:
+                return min(self.lower_bound(index + 1) - 1, self.max)
+        return self.max
+
+    def summary(self):
+        # milliseconds
+        if not self.count:
+            return {"count": 0}
+        return {
+            "count": self.count,
+            "mean": self.total / self.count / 1000,
+            "p50": self.percentile(50) / 1000,
+            "p90": self.percentile(90) / 1000,
+            "p99": self.percentile(99) / 1000,
+            "max": self.max / 1000,
+        }
+
+
+class OpStats:
+    def __init__(self):
+        self.lock_wait = Histogram()
+        self.bus = Histogram()
+        self.errors = 0
+        self.wire_time = None # s, bytes on the wire at the bus baud rate, if known
+
+
+class _Transaction:
+    # `with metrics.transaction(op, lock):` acquires `lock` and times the wait
+    # and the held section separately
+    __slots__ = ("stats", "lock", "t0", "t1")
+
+    def __init__(self, stats, lock):
+        self.stats = stats
+        self.lock = lock
+
+    def __enter__(self):
+        self.t0 = time.perf_counter()
+        self.lock.acquire()
+        self.t1 = time.perf_counter()
+
+    def __exit__(self, *exc):
+        t2 = time.perf_counter()
+        self.lock.release()
+        self.stats.lock_wait.record(self.t1 - self.t0)
+        self.stats.bus.record(t2 - self.t1)
+
+
+class BusMetrics:
+    def __init__(self):
+        self.ops = {}
+        self.failed_reads = {} # dxl_id -> count
+        self.children = {} # name -> BusMetrics of a sub-port (one per bus of a MultiBusPort)
+        self.skew = None # Histogram of the spread between the buses' read midpoints, MultiBusPort only
+        self.started = time.time()
+        self._lock = threading.Lock() # only for creating ops / snapshots
+
+    def op(self, name):
+        stats = self.ops.get(name)
+        if stats is None:
+            with self._lock:
+                stats = self.ops.setdefault(name, OpStats())
+        return stats
+
+    def transaction(self, name, lock):
+        return _Transaction(self.op(name), lock)
+
+    def error(self, name):
+        self.op(name).errors += 1
+
+    def record_skew(self, seconds):
+        if self.skew is None:
+            self.skew = Histogram()
+        self.skew.record(seconds)
+
+    def record_reads(self, dxl_ids, valid):
+        if valid.all():
+            return
+        for dxl_id, ok in zip(dxl_ids, valid):
+            if not ok:
+                self.failed_reads[dxl_id] = self.failed_reads.get(dxl_id, 0) + 1
+
+    def snapshot(self):
+        with self._lock:
+            ops = dict(self.ops)
+        result = {"since": self.started, "ops": {}, "failed_reads": dict(self.failed_reads)}
+        for name, stats in ops.items():
+            result["ops"][name] = {
+                "lock_wait_ms": stats.lock_wait.summary(),
+                "bus_ms": stats.bus.summary(),
+                "errors": stats.errors,
+            }
+            if stats.wire_time is not None:
+                result["ops"][name]["wire_ms"] = stats.wire_time * 1000
+        if self.skew is not None:
+            result["skew_ms"] = self.skew.summary()
+        if self.children:
+            result["buses"] = {name: child.snapshot() for name, child in self.children.items()}
+        return result
@@ -0,0 +1,238 @@
+import threading
+import time
+
+import numpy as np
+
+from .acquisition import Acquisition
+from .metrics import BusMetrics
+from .sim_bus import SIM_PREFIX
+
+# One logical port over several serial adapters (e.g. one U2D2 per arm).
+# Every bus is read concurrently, on its own thread; the SDK's blocking serial
+# I/O releases the GIL, so a frame costs the slowest bus rather than the sum.
+# present_* stay in the caller's dxl_ids order, so MOTOR_IDS / MOTOR_TO_JOINT
+# don't care which adapter a motor sits on.
+#   KIRIGIRISU_DEVICE="/dev/ttyUSB0@0,1,2;/dev/ttyUSB1@10,11,12"
+#   KIRIGIRISU_DEVICE="sim:0,1,2;sim:10,11,12"
+
+BUS_SEPARATOR = ";"
+
+
+def parse_bus_spec(device):
+    # -> [(device, [ids])]
+    buses = []
+    for part in device.split(BUS_SEPARATOR):
+        part = part.strip()
+        if not part:
+            continue
+        if "@" in part:
+            part, ids = part.rsplit("@", 1)
+        elif part.startswith(SIM_PREFIX) and part != SIM_PREFIX:
+            ids = part[len(SIM_PREFIX):]
+        else:
+            raise ValueError(f"bus '{part}' needs its motor ids, e.g. {part}@0,1,2")
+        buses.append((part, [int(x) for x in ids.split(",") if x]))
+    return buses
+
+
+class _BusReader(threading.Thread):
+    # Parked until kicked, then runs one fetch_present_status() on its bus
+    def __init__(self, port):
+        super().__init__(name=f"dxl-bus-{port.device}", daemon=True)
+        self.port = port
+        self.result = False
+        self.error = None
+        self.started_at = 0.0
+        self.finished_at = 0.0
+        self._go = threading.Event()
+        self._done = threading.Event()
+        self._closing = False
+
+    def read(self):
+        self.started_at = time.monotonic()
+        try:
+            self.result = self.port.fetch_present_status()
+            self.error = None
+        except Exception as e:
+            self.result = False
+            self.error = e
+        self.finished_at = time.monotonic()
+
+    def kick(self):
+        self._done.clear()
+        self._go.set()
+
+    def join_read(self):
+        self._done.wait()
+
+    def close(self):
+        self._closing = True
+        self._go.set()
+
+    def run(self):
+        while True:
+            self._go.wait()
+            self._go.clear()
+            if self._closing:
+                return
+            self.read()
+            self._done.set()
+
+
+class MultiBusPort:
+    def __init__(self, buses, dxl_ids, motor_with_torque, **kwargs):
+        # buses: [(device, [ids on that bus])]; kwargs go to each DynamixelPort
+        from .dynamixel_port import DynamixelPort
+
+        self.lock = threading.Lock()
+        self.device = BUS_SEPARATOR.join(f"{device}@{','.join(map(str, ids))}" for device, ids in buses)
+        self.dxl_ids = list(dxl_ids)
+        self.motor_with_torque = motor_with_torque
+        self.portHandler = self.packetHandler = None # one per bus, see self.ports
+        position = {dxl_id: i for i, dxl_id in enumerate(self.dxl_ids)}
+        unplaced = set(self.dxl_ids) - {dxl_id for _, ids in buses for dxl_id in ids}
+        if unplaced:
+            raise ValueError(f"motor ids {sorted(unplaced)} are not on any bus")
+        self.ports = []
+        self._index = [] # per bus: positions of its motors in dxl_ids
+        self._owner = {} # dxl_id -> port
+        try:
+            for device, ids in buses:
+                ids = [dxl_id for dxl_id in ids if dxl_id in position]
+                if not ids:
+                    continue
+                port = DynamixelPort(device, ids, [i for i in motor_with_torque if i in ids], **kwargs)
+                self.ports.append(port)
+                self._index.append(np.array([position[i] for i in ids], np.intp))
+                self._owner.update((dxl_id, port) for dxl_id in ids)
+        except Exception:
+            # A later bus failed: release the ones already set up
+            for port in self.ports:
+                port.cleanup()
+            raise
+        n = max(16, len(self.dxl_ids))
+        self.present_currents = np.zeros((n), np.int16)
+        self.present_positions = np.zeros((n), np.int32)
+        self.present_velocities = np.zeros((n), np.int32)
+        self.present_valid = np.zeros((n), bool)
+        self.timestamp = 0.0 # mean of the per-bus read midpoints of the last frame
+        self.skew = 0.0 # spread of those midpoints, seconds
+        self.acquisition = None
+        self.metrics = None
+        # The first bus is read on the calling thread, the rest on readers
+        self._readers = [_BusReader(port) for port in self.ports]
+        for reader in self._readers[1:]:
+            reader.start()
+
+    @classmethod
+    def from_device(cls, device, dxl_ids, motor_with_torque, **kwargs):
+        return cls(parse_bus_spec(device), dxl_ids, motor_with_torque, **kwargs)
+
+    def enable_metrics(self):
+        # Merged-frame timing here, per-bus timing under "buses"
+        if self.metrics is None:
+            metrics = BusMetrics()
+            for port in self.ports:
+                metrics.children[port.device] = port.enable_metrics()
+            self.metrics = metrics
+        return self.metrics
+
+    def disable_metrics(self):
+        self.metrics = None
+        for port in self.ports:
+            port.disable_metrics()
+
+    def fetch_present_status(self):
+        metrics = self.metrics
+        with (self.lock if metrics is None else metrics.transaction("fetch_present_status", self.lock)):
+            readers = self._readers
+            for reader in readers[1:]:
+                reader.kick()
+            readers[0].read()
+            for reader in readers[1:]:
+                reader.join_read()
+            midpoints = []
+            for reader, index in zip(readers, self._index):
+                port = reader.port
+                k = len(index)
+                self.present_positions[index] = port.present_positions[:k]
+                self.present_currents[index] = port.present_currents[:k]
+                self.present_velocities[index] = port.present_velocities[:k]
+                self.present_valid[index] = port.present_valid[:k]
+                midpoints.append((reader.started_at + reader.finished_at) / 2)
+            self.timestamp = sum(midpoints) / len(midpoints)
+            self.skew = max(midpoints) - min(midpoints)
+            if metrics is not None:
+                metrics.record_reads(self.dxl_ids, self.present_valid[:len(self.dxl_ids)])
+                metrics.record_skew(self.skew)
+            for reader in readers:
+                if reader.error is not None:
+                    raise reader.error
+            return bool(self.present_valid[:len(self.dxl_ids)].all())
+
+    def _split(self, values):
+        # A shorter list than dxl_ids only sets the motors it covers
+        values = np.asarray(values)
+        return [(port, values[index[index < len(values)]]) for port, index in zip(self.ports, self._index)]
+
+    def writeTxRx(self, dxl_id, addr, value):
+        self._owner[dxl_id].writeTxRx(dxl_id, addr, value)
+
+    def set_goal_positions(self, pos):
+        for port, values in self._split(pos):
+            port.set_goal_positions(values)
+
+    def set_goal_currents(self, cur):
+        for port, values in self._split(cur):
+            port.set_goal_currents(values)
+
+    def set_goal_pwms(self, pwm):
+        for port, values in self._split(pwm):
+            port.set_goal_pwms(values)
+
+    def set_goal_positions_currents(self, pos, cur):
+        self.set_goals(pos=pos, cur=cur)
+
+    def set_goals(self, pos=None, cur=None, pwm=None):
+        split = [None if values is None else self._split(values) for values in (pos, cur, pwm)]
+        for i, port in enumerate(self.ports):
+            pos, cur, pwm = (None if parts is None else parts[i][1] for parts in split)
+            port.set_goals(pos=pos, cur=cur, pwm=pwm)
+
+    def disable_torque(self, ids):
+        for port in self.ports:
+            owned = [dxl_id for dxl_id in ids if self._owner.get(dxl_id) is port]
+            if owned:
+                port.disable_torque(owned)
+
+    def start_acquisition(self, period=0.0):
+        if self.acquisition is None:
+            self.acquisition = Acquisition(self, period)
+            self.acquisition.start()
+        return self.acquisition
+
+    def stop_acquisition(self):
+        if self.acquisition is not None:
+            self.acquisition.stop()
+            self.acquisition = None
+
+    def latest_frame(self, out=None):
+        return self.acquisition.frames.latest(out)
+
+    def motor_health(self):
+        health = {}
+        for port in self.ports:
+            health.update(port.motor_health())
+        return health
+
+    def add_hardware_listener(self, fn):
+        # Called from each bus's reader thread
+        for port in self.ports:
+            port.add_hardware_listener(fn)
+
+    def cleanup(self):
+        self.stop_acquisition()
+        for reader in self._readers[1:]:
+            reader.close()
+        for port in self.ports:
+            port.cleanup()
@@ -0,0 +1,145 @@
+# Dynamixel Protocol 2.0 framing helpers shared by the simulated bus and the
+# hand-built packets in dynamixel_port (no dynamixel_sdk dependency here).
+import numpy as np
+
+BROADCAST_ID = 0xFE
+HEADER = b"\xff\xff\xfd\x00"
+
+INST_PING = 0x01
+INST_READ = 0x02
+INST_WRITE = 0x03
+INST_REG_WRITE = 0x04
+INST_ACTION = 0x05
+INST_FACTORY_RESET = 0x06
+INST_REBOOT = 0x08
+INST_CLEAR = 0x10
+INST_STATUS = 0x55
+INST_SYNC_READ = 0x82
+INST_SYNC_WRITE = 0x83
+INST_FAST_SYNC_READ = 0x8A
+INST_BULK_READ = 0x92
+INST_BULK_WRITE = 0x93
+INST_FAST_BULK_READ = 0x9A
+
+ERRNUM_RESULT_FAIL = 1
+ERRNUM_INSTRUCTION = 2
+ERRNUM_CRC = 3
+ERRNUM_DATA_RANGE = 4
+ERRNUM_DATA_LENGTH = 5
+ERRNUM_DATA_LIMIT = 6
+ERRNUM_ACCESS = 7
+ERRBIT_ALERT = 0x80
+
+# Same table as Protocol2PacketHandler.updateCRC (CRC-16, poly 0x8005, MSB first)
+def _make_crc_table():
+    table = []
+    for i in range(256):
+        crc = i << 8
+        for _ in range(8):
+            crc = ((crc << 1) ^ 0x8005) if crc & 0x8000 else (crc << 1)
+        table.append(crc & 0xFFFF)
+    return tuple(table)
+
+CRC_TABLE = _make_crc_table()
+
+def crc16(data, crc=0, start=0, end=None):
+    table = CRC_TABLE
+    if end is None:
+        end = len(data)
+    for i in range(start, end):
+        crc = ((crc << 8) ^ table[((crc >> 8) ^ data[i]) & 0xFF]) & 0xFFFF
+    return crc
+
+def stuff(body):
+    # body is everything from the instruction byte up to (not including) the CRC
+    return bytes(body).replace(b"\xff\xff\xfd", b"\xff\xff\xfd\xfd")
+
+def unstuff(body):
+    return bytes(body).replace(b"\xff\xff\xfd\xfd", b"\xff\xff\xfd")
+
+def build_packet(dxl_id, instruction, params=b""):
+    body = stuff(bytes((instruction,)) + bytes(params))
+    length = len(body) + 2
+    packet = bytearray(HEADER)
+    packet += bytes((dxl_id, length & 0xFF, length >> 8))
+    packet += body
+    crc = crc16(packet)
+    packet += bytes((crc & 0xFF, crc >> 8))
+    return bytes(packet)
+
+def build_status(dxl_id, error=0, params=b""):
+    return build_packet(dxl_id, INST_STATUS, bytes((error,)) + bytes(params))
+
+def parse_packets(buffer):
+    # Pops every complete packet off the front of `buffer` (a bytearray) and
+    # returns them as (id, instruction, params, crc_ok) with stuffing removed.
+    packets = []
+    while True:
+        start = buffer.find(b"\xff\xff\xfd")
+        if start < 0:
+            del buffer[:max(0, len(buffer) - 2)]
+            return packets
+        if start:
+            del buffer[:start]
+        if len(buffer) < 10:
+            return packets
+        if buffer[3] == 0xFD:
+            # stuffed 0xFD, not a header
+            del buffer[:3]
+            continue
+        length = buffer[5] | (buffer[6] << 8)
+        total = 7 + length
+        if len(buffer) < total:
+            return packets
+        crc = buffer[total - 2] | (buffer[total - 1] << 8)
+        crc_ok = crc16(buffer, 0, 0, total - 2) == crc
+        body = unstuff(buffer[7:total - 2])
+        packets.append((buffer[4], body[0], body[1:], crc_ok))
+        del buffer[:total]
+
+def store_goals(out, values):
+    # Goals into a register view. A shorter list sets the first motors and
+    # the rest resend their last goal; floats are rounded, and everything is
+    # clipped to the register's range rather than wrapping around.
+    values = np.asarray(values)[:len(out)]
+    if values.dtype.kind == "f":
+        if not np.isfinite(values).all():
+            raise ValueError(f"goal values must be finite: {values}")
+        values = np.rint(values).astype(np.int64)
+    elif values.dtype.kind not in "iu":
+        raise TypeError(f"goal values must be numbers, got {values.dtype}")
+    info = np.iinfo(out.dtype)
+    np.clip(values, info.min, info.max, out=out[:len(values)], casting="same_kind")
+
+
+class SyncWriteFrame:
+    # Pre-built Sync Write instruction for a fixed set of IDs. Register values
+    # are packed in place through little-endian NumPy views (field()), so a
+    # control cycle only rewrites the data bytes and the CRC.
+    def __init__(self, dxl_ids, start_address, data_length):
+        self.dxl_ids = list(dxl_ids)
+        self.data_length = data_length
+        n = len(self.dxl_ids)
+        length = 7 + n * (data_length + 1) # instruction, address, data length, params, crc
+        self.packet = bytearray(7 + length)
+        self.packet[0:8] = HEADER + bytes((BROADCAST_ID, length & 0xFF, length >> 8, INST_SYNC_WRITE))
+        self.packet[8:12] = start_address.to_bytes(2, "little") + data_length.to_bytes(2, "little")
+        self._params = np.frombuffer(self.packet, np.uint8, n * (data_length + 1), 12).reshape(n, data_length + 1)
+        self._params[:, 0] = self.dxl_ids
+        self.data = self._params[:, 1:]
+
+    def field(self, offset, dtype):
+        # Per-motor view of the register at start_address + offset
+        dtype = np.dtype(dtype).newbyteorder("<")
+        return self.data[:, offset:offset + dtype.itemsize].view(dtype)[:, 0]
+
+    def finalize(self):
+        # Returns the packet ready for writePort(); only the rare value that
+        # needs byte stuffing costs a new buffer.
+        end = len(self.packet) - 2
+        if self.packet.find(b"\xff\xff\xfd", 8, end) >= 0:
+            return build_packet(BROADCAST_ID, INST_SYNC_WRITE, self.packet[8:end])
+        crc = crc16(self.packet, 0, 0, end)
+        self.packet[end] = crc & 0xFF
+        self.packet[end + 1] = crc >> 8
+        return self.packet
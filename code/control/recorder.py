@@ -0,0 +1,148 @@
+import json
+import mmap
+import struct
+import time
+
+import numpy as np
+
+# Append-only session log of raw bus frames.
+#
+#   0   magic "KIRILOG1"
+#   8   u32 format version
+#   12  u32 header size (frames start here, multiple of 4096)
+#   16  u64 frame count, bumped after each frame is fully written
+#   24  u32 metadata length, then JSON metadata (motor ids, calibration, dtype)
+#
+# Frames are fixed-size records of frame_dtype(n). The file grows in chunks
+# and is mmapped, so appending is a few in-place copies; open_log() maps a
+# finished (or still growing) log as a read-only structured array. Version 1
+# logs (no present velocity) still open.
+
+MAGIC = b"KIRILOG1"
+FORMAT_VERSION = 2
+PAGE = 4096
+_PREFIX = struct.Struct("<8sIIQI")
+_COUNT_OFFSET = 16
+GROW_FRAMES = 1 << 16
+
+
+def frame_dtype(n, version=FORMAT_VERSION):
+    fields = [
+        ("timestamp", "<f8"), # time.monotonic() when the bus read finished
+        ("seq", "<u8"),
+        ("positions", "<i4", (n,)),
+        ("currents", "<i2", (n,)),
+        ("valid", "u1", (n,)),
+    ]
+    if version >= 2:
+        fields.append(("velocities", "<i4", (n,))) # Present Velocity register
+    return np.dtype(fields)
+
+
+class Recorder:
+    def __init__(self, path, motor_ids, calibration=None, **metadata):
+        self.path = path
+        self.motor_ids = list(motor_ids)
+        self.dtype = frame_dtype(len(self.motor_ids))
+        self.count = 0
+        metadata = dict(metadata, motor_ids=self.motor_ids, calibration=calibration,
+                        dtype=self.dtype.descr, created=time.time(), monotonic_origin=time.monotonic())
+        meta = json.dumps(metadata).encode()
+        self.header_size = -(-(_PREFIX.size + len(meta)) // PAGE) * PAGE
+        self._file = open(path, "w+b")
+        self._file.write(_PREFIX.pack(MAGIC, FORMAT_VERSION, self.header_size, 0, len(meta)) + meta)
+        self._mm = None
+        self._capacity = 0
+        self._grow()
+
+    def _grow(self):
+        # Only allocation on the write path, once every GROW_FRAMES frames
+        self._frames = self._timestamps = self._seqs = self._positions = self._currents = self._valid = None
+        self._velocities = None
+        if self._mm is not None:
+            self._mm.close()
+        self._capacity += GROW_FRAMES
+        self._file.truncate(self.header_size + self._capacity * self.dtype.itemsize)
+        self._mm = mmap.mmap(self._file.fileno(), 0)
+        frames = np.frombuffer(self._mm, self.dtype, self._capacity, self.header_size)
+        self._frames = frames
+        self._timestamps = frames["timestamp"]
+        self._seqs = frames["seq"]
+        self._positions = frames["positions"]
+        self._currents = frames["currents"]
+        self._valid = frames["valid"]
+        self._velocities = frames["velocities"]
+
+    def append(self, timestamp, seq, positions, currents, valid, velocities=0):
+        i = self.count
+        if i == self._capacity:
+            self._grow()
+        self._timestamps[i] = timestamp
+        self._seqs[i] = seq
+        self._positions[i] = positions
+        self._currents[i] = currents
+        self._valid[i] = valid
+        self._velocities[i] = velocities
+        self.count = i + 1
+        struct.pack_into("<Q", self._mm, _COUNT_OFFSET, self.count)
+
+    def append_frame(self, frame):
+        # acquisition.Frame
+        self.append(frame.timestamp, frame.seq, frame.positions, frame.currents, frame.valid, frame.present_velocities)
+
+    def record(self, port, seconds=None):
+        # Back-to-back fetch_present_status() into the log, until `seconds`
+        # pass or KeyboardInterrupt
+        n = len(self.motor_ids)
+        deadline = None if seconds is None else time.monotonic() + seconds
+        seq = 0
+        try:
+            while deadline is None or time.monotonic() < deadline:
+                port.fetch_present_status()
+                seq += 1
+                self.append(time.monotonic(), seq, port.present_positions[:n],
+                            port.present_currents[:n], port.present_valid[:n], port.present_velocities[:n])
+        except KeyboardInterrupt:
+            pass
+        return self.count
+
+    def close(self):
+        if self._mm is None:
+            return
+        self._frames = self._timestamps = self._seqs = self._positions = self._currents = self._valid = None
+        self._velocities = None
+        self._mm.flush()
+        self._mm.close()
+        self._mm = None
+        self._file.truncate(self.header_size + self.count * self.dtype.itemsize)
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def read_header(path):
+    with open(path, "rb") as f:
+        prefix = f.read(_PREFIX.size)
+        magic, version, header_size, count, meta_length = _PREFIX.unpack(prefix)
+        if magic != MAGIC:
+            raise ValueError(f"{path}: not a kirigirisu log")
+        if not 1 <= version <= FORMAT_VERSION:
+            raise ValueError(f"{path}: unsupported log version {version}")
+        metadata = json.loads(f.read(meta_length))
+    metadata.update(header_size=header_size, count=count, version=version)
+    return metadata
+
+
+def open_log(path):
+    # -> (metadata, frames); frames is a zero-copy read-only np.memmap of the
+    # frames written so far
+    metadata = read_header(path)
+    dtype = frame_dtype(len(metadata["motor_ids"]), metadata["version"])
+    if metadata["count"] == 0:
+        return metadata, np.zeros(0, dtype)
+    frames = np.memmap(path, dtype, "r", metadata["header_size"], (metadata["count"],))
+    return metadata, frames
@@ -0,0 +1,168 @@
+import bisect
+import threading
+import time
+
+import numpy as np
+
+from .acquisition import Acquisition
+from .metrics import BusMetrics
+from .recorder import open_log
+
+# Plays a recorder.py log back through the DynamixelPort read interface
+# (fetch_present_status / present_* / acquisition), so bridgeNode.py and
+# web.py run unchanged against recorded motion:
+#   KIRIGIRISU_DEVICE=replay:demo.kirilog          1x, stops at the end
+#   KIRIGIRISU_DEVICE=replay:demo.kirilog,4x,loop  4x, wraps around
+#   KIRIGIRISU_DEVICE=replay:demo.kirilog,max      as fast as it can be read
+
+REPLAY_PREFIX = "replay:"
+END_OF_LOG_SLEEP = 0.1
+
+
+class ReplayPort:
+    def __init__(self, path, dxl_ids=None, speed=1.0, loop=False):
+        self.lock = threading.Lock()
+        self.metadata, self.frames = open_log(path)
+        if len(self.frames) == 0:
+            raise ValueError(f"{path}: log has no frames")
+        log_ids = self.metadata["motor_ids"]
+        self.device = REPLAY_PREFIX + path
+        self.dxl_ids = list(log_ids if dxl_ids is None else dxl_ids)
+        self.motor_with_torque = []
+        self.portHandler = self.packetHandler = None # no bus behind a replay
+        self.speed = speed # 0 = as fast as possible
+        self.loop = loop
+        # Requested IDs -> log columns; IDs that weren't recorded stay invalid
+        self._columns = np.array([log_ids.index(i) if i in log_ids else 0 for i in self.dxl_ids], np.intp)
+        self._recorded = np.array([i in log_ids for i in self.dxl_ids], bool)
+        self.timestamps = self.frames["timestamp"]
+        n = max(16, len(self.dxl_ids))
+        self.present_currents = np.zeros((n), np.int16)
+        self.present_positions = np.zeros((n), np.int32)
+        self.present_velocities = np.zeros((n), np.int32) # stay 0 on a version 1 log
+        self.present_valid = np.zeros((n), bool)
+        self.acquisition = None
+        self.metrics = None
+        self.index = 0 # next frame to deliver
+        self.skipped = 0 # frames dropped to keep up with real time
+        self.finished = False
+        self._restart_clock()
+
+    @classmethod
+    def from_device(cls, device, dxl_ids=None):
+        path, *options = device[len(REPLAY_PREFIX):].split(",")
+        speed, loop = 1.0, False
+        for option in options:
+            if option == "loop":
+                loop = True
+            elif option == "max":
+                speed = 0.0
+            else:
+                speed = float(option.rstrip("x"))
+        return cls(path, dxl_ids, speed, loop)
+
+    def _restart_clock(self):
+        # Frame i is due at wall_origin + (timestamps[i] - log_origin) / speed;
+        # scheduling against this fixed origin keeps sleeps from accumulating drift
+        self._wall_origin = time.monotonic()
+        self._log_origin = float(self.timestamps[self.index])
+
+    def seek(self, timestamp):
+        # Next fetch delivers the first frame at or after `timestamp` (log
+        # clock). bisect rather than np.searchsorted: the timestamp column is
+        # strided and searchsorted would copy all of it, bisect touches
+        # O(log n) frames of the mapped file.
+        with self.lock:
+            self.index = min(bisect.bisect_left(self.timestamps, timestamp), len(self.frames) - 1)
+            self.finished = False
+            self._restart_clock()
+
+    def seek_relative(self, seconds):
+        self.seek(float(self.timestamps[0]) + seconds)
+
+    def enable_metrics(self):
+        # "bus" time here includes the replay's own pacing sleeps
+        if self.metrics is None:
+            self.metrics = BusMetrics()
+        return self.metrics
+
+    def disable_metrics(self):
+        self.metrics = None
+
+    def fetch_present_status(self):
+        metrics = self.metrics
+        with (self.lock if metrics is None else metrics.transaction("fetch_present_status", self.lock)):
+            n = len(self.dxl_ids)
+            valid = self.present_valid[:n]
+            if self.index >= len(self.frames):
+                if not self.loop:
+                    self.finished = True
+                    valid[:] = False
+                    time.sleep(END_OF_LOG_SLEEP) # don't let a polling loop spin
+                    return False
+                self.index = 0
+                self._restart_clock()
+            if self.speed:
+                now = time.monotonic()
+                due = self._wall_origin + (float(self.timestamps[self.index]) - self._log_origin) / self.speed
+                if due > now:
+                    time.sleep(due - now)
+                else:
+                    # Behind schedule: jump to the newest frame that is due
+                    log_now = self._log_origin + (now - self._wall_origin) * self.speed
+                    latest = bisect.bisect_right(self.timestamps, log_now, self.index) - 1
+                    if latest > self.index:
+                        self.skipped += latest - self.index
+                        self.index = latest
+            frame = self.frames[self.index]
+            self.index += 1
+            np.take(frame["positions"], self._columns, out=self.present_positions[:n])
+            np.take(frame["currents"], self._columns, out=self.present_currents[:n])
+            if "velocities" in frame.dtype.names:
+                np.take(frame["velocities"], self._columns, out=self.present_velocities[:n])
+            np.take(frame["valid"].view(bool), self._columns, out=valid)
+            valid &= self._recorded
+            return bool(valid.all())
+
+    def start_acquisition(self, period=0.0):
+        if self.acquisition is None:
+            self.acquisition = Acquisition(self, period)
+            self.acquisition.start()
+        return self.acquisition
+
+    def stop_acquisition(self):
+        if self.acquisition is not None:
+            self.acquisition.stop()
+            self.acquisition = None
+
+    def latest_frame(self, out=None):
+        return self.acquisition.frames.latest(out)
+
+    def motor_health(self):
+        # No live link behind a recording
+        return {}
+
+    def add_hardware_listener(self, fn):
+        pass
+
+    # Nothing to drive on a recording
+    def disable_torque(self, ids):
+        pass
+
+    def set_goal_positions(self, pos):
+        pass
+
+    def set_goal_currents(self, cur):
+        pass
+
+    def set_goal_pwms(self, pwm):
+        pass
+
+    def set_goal_positions_currents(self, pos, cur):
+        pass
+
+    def set_goals(self, pos=None, cur=None, pwm=None):
+        pass
+
+    def cleanup(self):
+        self.stop_acquisition()
@@ -0,0 +1,529 @@
+import json
+import os
+import socket
+import struct
+import tempfile
+import time
+import zlib
+from multiprocessing import resource_tracker, shared_memory
+
+import numpy as np
+
+from .acquisition import Frame
+from .errors import DynamixelError
+from .protocol2 import store_goals
+
+# One process owns the bus (daemon.py) and publishes every acquisition frame
+# into a shared memory ring; any number of clients read it through the
+# DynamixelPort read interface without touching the bus:
+#   python daemon.py --device /dev/ttyUSB0
+#   KIRIGIRISU_DEVICE=shm: python web.py
+#   KIRIGIRISU_DEVICE=shm: ros2 run kirigirisu bridgeNode
+# ("shm:<name>" for a daemon started with --name <name>)
+#
+# Shared memory /dev/shm/<name>:
+#   header   HEADER_DTYPE, head = seq of the newest complete frame
+#   slots    SLOTS x slot_dtype(n), frame seq lives in slot seq % SLOTS
+#   status   STATUS_SIZE bytes of JSON (health, loop stats, metrics), ~2 Hz
+#
+# Seqlock: the daemon marks a slot odd (2 * seq - 1) before filling it,
+# stores a CRC-32 of the slot's data, marks it even (2 * seq), then bumps
+# head. A reader copies the whole slot in one go and keeps the copy only if
+# the slot still holds 2 * seq afterwards and the copy's data matches its
+# CRC. The CRC check doesn't depend on the order in which another core
+# sees the stores, so a torn copy is caught on weakly ordered CPUs (ARM) as
+# well as on x86. The status block is validated the same way. The daemon
+# never waits for readers.
+#
+# Goal commands go the other way as datagrams on <tmp>/<name>.sock, all
+# little endian:
+#   0   u8  op
+#   1   u8  flags
+#   2   u8  motor count k
+#   3   k x u8 IDs, then
+#       OP_GOALS    k x i32 positions, k x i16 currents, k x i16 pwms (the flagged ones, in this order)
+#       OP_TORQUE   nothing, flags 1 = enable / 0 = disable
+#       OP_WRITE    (k = 1) u16 address, u8 size, i32 value
+#       OP_METRICS  nothing (k = 0), flags 1 = enable / 0 = disable
+# The socket's queue is the command queue: the daemon drains it and merges
+# queued goals into one bus write; a client whose queue is full drops the
+# command (counted) rather than block its control loop.
+
+SHM_PREFIX = "shm:"
+DEFAULT_NAME = "kirigirisu"
+MAGIC = b"KIRI"
+VERSION = 4
+SLOTS = 64
+STATUS_SIZE = 1 << 16
+STATUS_PERIOD = 0.5
+STALE_SECONDS = 1.0 # no frame from the daemon for this long: every motor reads invalid
+POLL_SECONDS = 0.0005
+FETCH_TIMEOUT = 0.5
+
+OP_GOALS = 1
+OP_TORQUE = 2
+OP_WRITE = 3
+OP_METRICS = 4
+FLAG_POSITION = 0x01
+FLAG_CURRENT = 0x02
+FLAG_PWM = 0x04
+COMMAND_HEADER = struct.Struct("<BBB")
+WRITE_ARGS = struct.Struct("<HBi")
+MAX_COMMAND = 4096
+
+HEADER_DTYPE = np.dtype([
+    ("magic", "S4"), ("version", "<u2"), ("n", "<u2"), ("slots", "<u4"), ("pid", "<u4"),
+    ("head", "<u8"), ("heartbeat", "<f8"), # time.monotonic() of the last publish
+    ("status_seq", "<u8"), ("status_length", "<u4"), ("status_crc", "<u4"),
+    ("ids", "u1", (256,)),
+], align=True)
+SLOTS_OFFSET = -(-HEADER_DTYPE.itemsize // 64) * 64
+
+
+def slot_dtype(n):
+    return np.dtype([
+        ("seq", "<u8"), ("crc", "<u4"), ("timestamp", "<f8"), # crc: zlib.crc32 of everything from timestamp on
+        ("positions", "<i4", (n,)), ("currents", "<i2", (n,)), ("velocities", "<f8", (n,)),
+        ("valid", "?", (n,)), ("age", "<f8", (n,)),
+        ("filtered_positions", "<f8", (n,)), ("filtered_currents", "<f8", (n,)),
+        ("present_velocities", "<i4", (n,)),
+    ], align=True)
+
+
+def socket_path(name):
+    return os.path.join(tempfile.gettempdir(), name + ".sock")
+
+
+def _attach(name):
+    try:
+        return shared_memory.SharedMemory(name, track=False)
+    except TypeError:
+        # Before 3.13 attaching registers the segment with this process's
+        # resource tracker, which would unlink it when the client exits
+        shm = shared_memory.SharedMemory(name)
+        resource_tracker.unregister(shm._name, "shared_memory")
+        return shm
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _copy(src, columns, dst):
+    if columns is None:
+        np.copyto(dst, src)
+    else:
+        np.take(src, columns, out=dst)
+
+
+class SharedFrames:
+    # The ring; create() in the daemon, attach() in clients
+    def __init__(self, shm):
+        self.shm = shm
+        self.header = np.ndarray((), HEADER_DTYPE, shm.buf)
+        if bytes(self.header["magic"]) != MAGIC or int(self.header["version"]) != VERSION:
+            raise ValueError(f"shared memory {shm.name!r} isn't a kirigirisu frame ring")
+        self.n = int(self.header["n"])
+        self.slot_count = int(self.header["slots"])
+        self.dxl_ids = self.header["ids"][:self.n].tolist()
+        self._head = self.header["head"]
+        self._heartbeat = self.header["heartbeat"]
+        self._status_seq = self.header["status_seq"]
+        self._status_length = self.header["status_length"]
+        self._status_crc = self.header["status_crc"]
+        self._slot_dtype = slot_dtype(self.n)
+        self._data_offset = self._slot_dtype.fields["timestamp"][1]
+        slots = np.ndarray((self.slot_count), self._slot_dtype, shm.buf, SLOTS_OFFSET)
+        self._slot_bytes = np.ndarray((self.slot_count, self._slot_dtype.itemsize), np.uint8, shm.buf, SLOTS_OFFSET)
+        self._seq = slots["seq"]
+        self._crc = slots["crc"]
+        self._timestamp = slots["timestamp"]
+        self._positions = slots["positions"]
+        self._currents = slots["currents"]
+        self._velocities = slots["velocities"]
+        self._valid = slots["valid"]
+        self._age = slots["age"]
+        self._filtered_positions = slots["filtered_positions"]
+        self._filtered_currents = slots["filtered_currents"]
+        self._present_velocities = slots["present_velocities"]
+        self._status = np.ndarray((STATUS_SIZE), np.uint8, shm.buf, SLOTS_OFFSET + slots.nbytes)
+        self._status_cache = (0, {})
+
+    @classmethod
+    def create(cls, name, dxl_ids, slots=SLOTS):
+        size = SLOTS_OFFSET + slots * slot_dtype(len(dxl_ids)).itemsize + STATUS_SIZE
+        try:
+            shm = shared_memory.SharedMemory(name, create=True, size=size)
+        except FileExistsError:
+            # Left behind by a daemon that was killed, unless it is still running
+            stale = _attach(name)
+            pid = int(np.ndarray((), HEADER_DTYPE, stale.buf)["pid"]) if stale.size >= HEADER_DTYPE.itemsize else 0
+            if pid and _alive(pid):
+                stale.close()
+                raise FileExistsError(f"shared memory {name!r} is in use by pid {pid}")
+            stale.unlink()
+            stale.close()
+            shm = shared_memory.SharedMemory(name, create=True, size=size)
+        header = np.ndarray((), HEADER_DTYPE, shm.buf)
+        header["n"] = len(dxl_ids)
+        header["slots"] = slots
+        header["pid"] = os.getpid()
+        header["ids"][:len(dxl_ids)] = dxl_ids
+        header["version"] = VERSION
+        header["magic"] = MAGIC
+        del header
+        return cls(shm)
+
+    @classmethod
+    def attach(cls, name):
+        return cls(_attach(name))
+
+    @property
+    def pid(self):
+        return int(self.header["pid"])
+
+    @property
+    def seq(self):
+        return int(self._head)
+
+    def stale(self, now=None):
+        return (time.monotonic() if now is None else now) - float(self._heartbeat) > STALE_SECONDS
+
+    def heartbeat(self):
+        self._heartbeat[()] = time.monotonic()
+
+    def publish(self, frame):
+        seq = int(self._head) + 1
+        i = seq % self.slot_count
+        self._seq[i] = 2 * seq - 1 # torn while being written
+        self._timestamp[i] = frame.timestamp
+        self._positions[i] = frame.positions
+        self._currents[i] = frame.currents
+        self._velocities[i] = frame.velocities
+        self._valid[i] = frame.valid
+        self._age[i] = frame.age
+        self._filtered_positions[i] = frame.filtered_positions
+        self._filtered_currents[i] = frame.filtered_currents
+        self._present_velocities[i] = frame.present_velocities
+        self._crc[i] = zlib.crc32(self._slot_bytes[i, self._data_offset:])
+        self._seq[i] = 2 * seq
+        self._head[()] = seq
+        self._heartbeat[()] = time.monotonic()
+
+    def read(self, seq, out, columns=None):
+        # Frame `seq` into out (the motors at `columns`, or all of them).
+        # False if it has already been overwritten.
+        i = seq % self.slot_count
+        stamp = 2 * seq
+        if self._seq[i] != stamp:
+            return False
+        raw = self._slot_bytes[i].copy() # per call, readers may be on several threads
+        if self._seq[i] != stamp:
+            return False
+        slot = raw.view(self._slot_dtype)[0]
+        if slot["seq"] != stamp or zlib.crc32(raw[self._data_offset:]) != slot["crc"]:
+            return False
+        out.timestamp = float(slot["timestamp"])
+        for name in ("positions", "currents", "velocities", "valid", "age",
+                     "filtered_positions", "filtered_currents", "present_velocities"):
+            _copy(slot[name], columns, getattr(out, name))
+        out.seq = seq
+        return True
+
+    def latest(self, out, columns=None):
+        while True:
+            seq = int(self._head)
+            if seq == 0:
+                return out
+            if self.read(seq, out, columns):
+                return out
+
+    def wait(self, after_seq, timeout=None):
+        # Polls, there's nothing to block on across processes
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while int(self._head) <= after_seq:
+            if deadline is not None and time.monotonic() >= deadline:
+                return False
+            time.sleep(POLL_SECONDS)
+        return True
+
+    def publish_status(self, status):
+        data = json.dumps(status, separators=(",", ":")).encode()
+        if len(data) > STATUS_SIZE:
+            return False
+        seq = int(self._status_seq) + 1
+        self._status_seq[()] = 2 * seq - 1
+        self._status[:len(data)] = np.frombuffer(data, np.uint8)
+        self._status_length[()] = len(data)
+        self._status_crc[()] = zlib.crc32(data)
+        self._status_seq[()] = 2 * seq
+        return True
+
+    def read_status(self):
+        # Parsed once per status update, then served from the cache until the
+        # daemon publishes the next one (treat the result as read-only)
+        while True:
+            seq = int(self._status_seq)
+            if seq == 0:
+                return {}
+            cached_seq, cached = self._status_cache
+            if seq == cached_seq:
+                return cached
+            if not seq & 1:
+                crc = int(self._status_crc)
+                data = self._status[:int(self._status_length)].tobytes()
+                if int(self._status_seq) == seq and zlib.crc32(data) == crc:
+                    status = json.loads(data)
+                    self._status_cache = (seq, status)
+                    return status
+            time.sleep(POLL_SECONDS)
+
+    def close(self):
+        # The views must go before the mapping can
+        self.header = self._head = self._heartbeat = self._status_seq = self._status_length = None
+        self._status_crc = self._slot_bytes = self._crc = None
+        self._seq = self._timestamp = self._positions = self._currents = None
+        self._velocities = self._valid = self._age = self._status = None
+        self._filtered_positions = self._filtered_currents = self._present_velocities = None
+        self.shm.close()
+
+    def unlink(self):
+        self.shm.unlink()
+
+
+def encode_command(op, ids=(), flags=0, positions=None, currents=None, pwms=None, write=None):
+    k = len(ids)
+    parts = [COMMAND_HEADER.pack(op, flags, k), bytes(ids)]
+    for values, dtype in ((positions, "<i4"), (currents, "<i2"), (pwms, "<i2")):
+        if values is not None:
+            packed = np.zeros(k, dtype)
+            store_goals(packed, values)
+            parts.append(packed.tobytes())
+    if write is not None:
+        parts.append(WRITE_ARGS.pack(*write))
+    return b"".join(parts)
+
+
+def parse_command(packet):
+    # -> (op, flags, ids, payload) where payload is {"position": array, ...}
+    # for OP_GOALS, (address, size, value) for OP_WRITE, else None.
+    # Raises ValueError on a malformed packet.
+    if len(packet) < COMMAND_HEADER.size:
+        raise ValueError("short command")
+    op, flags, k = COMMAND_HEADER.unpack_from(packet)
+    offset = COMMAND_HEADER.size + k
+    ids = list(packet[COMMAND_HEADER.size:offset])
+    payload = None
+    if op == OP_GOALS:
+        payload = {}
+        for name, flag, dtype in (("position", FLAG_POSITION, "<i4"), ("current", FLAG_CURRENT, "<i2"), ("pwm", FLAG_PWM, "<i2")):
+            if flags & flag:
+                payload[name] = np.frombuffer(packet, dtype, k, offset)
+                offset += payload[name].nbytes
+    elif op == OP_WRITE:
+        if k != 1:
+            raise ValueError("write takes one motor")
+        payload = WRITE_ARGS.unpack_from(packet, offset)
+        offset += WRITE_ARGS.size
+    elif op not in (OP_TORQUE, OP_METRICS):
+        raise ValueError(f"unknown op {op}")
+    if offset != len(packet):
+        raise ValueError("command length doesn't match")
+    return op, flags, ids, payload
+
+
+class _DaemonStats:
+    # Stands in for the daemon's LoopStats, read from its status
+    def __init__(self, port):
+        self.port = port
+
+    @property
+    def rate(self):
+        return self.summary().get("rate", 0.0)
+
+    def summary(self):
+        acquisition = self.port.status().get("acquisition") or {}
+        return {key: value for key, value in acquisition.items() if key not in ("realtime", "filters")}
+
+
+class _DaemonFilters:
+    def __init__(self, port):
+        self.port = port
+
+    def settings(self):
+        return (self.port.status().get("acquisition") or {}).get("filters", {})
+
+
+class _DaemonMetrics:
+    def __init__(self, snapshot):
+        self._snapshot = snapshot
+
+    def snapshot(self):
+        return self._snapshot
+
+
+class SharedAcquisition:
+    # What clients get for port.acquisition: the daemon's acquisition loop,
+    # seen through the ring
+    def __init__(self, port):
+        self.port = port
+        self.frames = port.frames
+        self.stats = _DaemonStats(port)
+        self.filters = _DaemonFilters(port)
+
+    @property
+    def rate(self):
+        return self.stats.rate
+
+    @property
+    def realtime(self):
+        return (self.port.status().get("acquisition") or {}).get("realtime", {})
+
+    def wait(self, after_seq, timeout=None):
+        return self.frames.wait(after_seq, timeout)
+
+    def stop(self):
+        pass
+
+
+class SharedPort:
+    def __init__(self, name=DEFAULT_NAME, dxl_ids=None):
+        try:
+            self.frames = SharedFrames.attach(name)
+        except FileNotFoundError as e:
+            raise DynamixelError(f"hardware daemon not running (no shared memory {name!r})") from e
+        self.name = name
+        self.device = SHM_PREFIX + name
+        daemon_ids = self.frames.dxl_ids
+        self.dxl_ids = list(daemon_ids if dxl_ids is None else dxl_ids)
+        missing = [dxl_id for dxl_id in self.dxl_ids if dxl_id not in daemon_ids]
+        if missing:
+            raise ValueError(f"daemon {name!r} doesn't drive motors {missing} (it has {daemon_ids})")
+        self.motor_with_torque = []
+        self.portHandler = self.packetHandler = None # the daemon owns the bus
+        self._columns = None if self.dxl_ids == daemon_ids else np.array([daemon_ids.index(i) for i in self.dxl_ids], np.intp)
+        n = max(16, len(self.dxl_ids))
+        self.present_currents = np.zeros((n), np.int16)
+        self.present_positions = np.zeros((n), np.int32)
+        self.present_velocities = np.zeros((n), np.int32)
+        self.present_valid = np.zeros((n), bool)
+        self._frame = Frame(len(self.dxl_ids))
+        self.acquisition = None
+        self.dropped_commands = 0 # command queue full
+        self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self._sock.setblocking(False)
+        self._address = socket_path(name)
+
+    @classmethod
+    def from_device(cls, device, dxl_ids=None):
+        return cls(device[len(SHM_PREFIX):] or DEFAULT_NAME, dxl_ids)
+
+    def status(self):
+        return self.frames.read_status()
+
+    def _send(self, packet):
+        try:
+            self._sock.sendto(packet, self._address)
+        except BlockingIOError:
+            self.dropped_commands += 1
+        except (FileNotFoundError, ConnectionRefusedError) as e:
+            # No socket, or nobody on it: the daemon exited or is restarting
+            raise DynamixelError(f"hardware daemon not running at {self._address} ({e.strerror})") from e
+
+    def fetch_present_status(self):
+        # Waits for the daemon's next frame
+        n = len(self.dxl_ids)
+        frame = self._frame
+        valid = self.present_valid[:n]
+        if not self.frames.wait(frame.seq, FETCH_TIMEOUT):
+            valid[:] = False
+            return False
+        self.frames.latest(frame, self._columns)
+        np.copyto(self.present_positions[:n], frame.positions)
+        np.copyto(self.present_currents[:n], frame.currents)
+        np.copyto(self.present_velocities[:n], frame.present_velocities)
+        np.copyto(valid, frame.valid)
+        return bool(valid.all())
+
+    def start_acquisition(self, period=0.0):
+        # The daemon's loop is already running; period is its business
+        if self.acquisition is None:
+            self.acquisition = SharedAcquisition(self)
+        return self.acquisition
+
+    def stop_acquisition(self):
+        self.acquisition = None
+
+    def latest_frame(self, out=None):
+        if out is None:
+            out = Frame(len(self.dxl_ids))
+        self.frames.latest(out, self._columns)
+        if self.frames.stale():
+            out.valid[:] = False
+        return out
+
+    @property
+    def metrics(self):
+        snapshot = self.status().get("metrics")
+        return None if snapshot is None else _DaemonMetrics(snapshot)
+
+    def _set_metrics(self, enabled):
+        self._send(encode_command(OP_METRICS, flags=int(enabled)))
+        deadline = time.monotonic() + 2 * STATUS_PERIOD
+        while (self.metrics is not None) != enabled and time.monotonic() < deadline:
+            time.sleep(0.01)
+        return self.metrics
+
+    def enable_metrics(self):
+        return self._set_metrics(True)
+
+    def disable_metrics(self):
+        self._set_metrics(False)
+
+    def motor_health(self):
+        health = self.status().get("health") or {}
+        return {dxl_id: health[str(dxl_id)] for dxl_id in self.dxl_ids if str(dxl_id) in health}
+
+    def add_hardware_listener(self, fn):
+        # Alerts are raised (and logged) in the daemon, which polls the
+        # hardware status; clients see the errors in motor_health()
+        pass
+
+    def writeTxRx(self, dxl_id, addr, value):
+        value = np.asarray(value)
+        self._send(encode_command(OP_WRITE, [dxl_id], write=(addr, value.itemsize, int(value))))
+
+    def disable_torque(self, ids):
+        self._send(encode_command(OP_TORQUE, list(ids), 0))
+
+    def enable_torque(self, ids):
+        self._send(encode_command(OP_TORQUE, list(ids), 1))
+
+    def set_goal_positions(self, pos):
+        self.set_goals(pos=pos)
+
+    def set_goal_currents(self, cur):
+        self.set_goals(cur=cur)
+
+    def set_goal_pwms(self, pwm):
+        self.set_goals(pwm=pwm)
+
+    def set_goal_positions_currents(self, pos, cur):
+        self.set_goals(pos=pos, cur=cur)
+
+    def set_goals(self, pos=None, cur=None, pwm=None):
+        flags = (FLAG_POSITION if pos is not None else 0) | (FLAG_CURRENT if cur is not None else 0) | (FLAG_PWM if pwm is not None else 0)
+        # A shorter list than dxl_ids only sets the motors it covers
+        k = min([len(self.dxl_ids)] + [len(values) for values in (pos, cur, pwm) if values is not None])
+        self._send(encode_command(OP_GOALS, self.dxl_ids[:k], flags, pos, cur, pwm))
+
+    def cleanup(self):
+        # Torque etc. stay as the daemon has them
+        self.stop_acquisition()
+        self._sock.close()
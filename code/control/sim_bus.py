@@ -0,0 +1,406 @@
+# In-process virtual Dynamixel bus. SimPortHandler is a drop-in replacement
+# for dynamixel_sdk.PortHandler: instruction packets written to it are decoded
+# by simulated XC330 servos and their status packets become readable after
+# the wire time at the port baud rate plus each servo's return delay.
+import math
+import random
+import struct
+import threading
+import time
+from collections import deque
+
+from dynamixel_sdk import PortHandler
+
+from .protocol2 import *
+
+SIM_PREFIX = "sim:"
+DEFAULT_IDS = [0, 1, 2, 10, 11, 12] # both arms, for a bare "sim:" with no ids to go on
+
+# Baud Rate (8) register value -> bps
+BAUD_TABLE = {0: 9600, 1: 57600, 2: 115200, 3: 1000000, 4: 2000000, 5: 3000000, 6: 4000000, 7: 4500000}
+
+CONTROL_TABLE_SIZE = 256
+TX_BUFFER_SIZE = 4096 # bytes the serial driver accepts before write() blocks
+EEPROM_END = 64
+INDIRECT_ADDR_START = 168
+INDIRECT_DATA_START = 224
+INDIRECT_COUNT = 20
+
+XC330_T181_MODEL = 1210
+FAST_READ_MIN_FIRMWARE = 45 # Fast Sync/Bulk Read appeared in X-series firmware v45
+TICKS_PER_REV = 4096
+VELOCITY_UNIT_RPM = 0.229
+
+# (address, size, default) for the registers the simulator cares about
+XC330_DEFAULTS = (
+    (0, 2, XC330_T181_MODEL),  # Model Number
+    (6, 1, 52),                # Firmware Version
+    (8, 1, 1),                 # Baud Rate (57600)
+    (9, 1, 250),               # Return Delay Time (2 us units)
+    (11, 1, 3),                # Operating Mode
+    (12, 1, 255),              # Secondary ID
+    (13, 1, 2),                # Protocol Type
+    (31, 1, 70),               # Temperature Limit
+    (32, 2, 140),              # Max Voltage Limit
+    (34, 2, 35),               # Min Voltage Limit
+    (36, 2, 885),              # PWM Limit
+    (38, 2, 910),              # Current Limit
+    (44, 4, 445),              # Velocity Limit
+    (48, 4, 4095),             # Max Position Limit
+    (68, 1, 2),                # Status Return Level
+    (76, 2, 1600),             # Velocity I Gain
+    (78, 2, 180),              # Velocity P Gain
+    (84, 2, 400),              # Position P Gain
+    (100, 2, 885),             # Goal PWM
+    (102, 2, 910),             # Goal Current
+    (144, 2, 120),             # Present Input Voltage
+    (146, 1, 32),              # Present Temperature
+)
+
+def _writable(addr):
+    return 7 <= addr < 120 or INDIRECT_ADDR_START <= addr < INDIRECT_DATA_START + INDIRECT_COUNT
+
+
+class SimServo:
+    def __init__(self, dxl_id, model_number=XC330_T181_MODEL, firmware=52, baudrate=57600,
+                 home=2048.0, amplitude=400.0, period=5.0):
+        self.ctrl = bytearray(CONTROL_TABLE_SIZE)
+        for addr, size, value in XC330_DEFAULTS:
+            self.ctrl[addr:addr + size] = value.to_bytes(size, "little")
+        self.ctrl[0:2] = model_number.to_bytes(2, "little")
+        self.ctrl[6] = firmware
+        self.ctrl[7] = dxl_id
+        self.ctrl[8] = {v: k for k, v in BAUD_TABLE.items()}[baudrate]
+        for i in range(INDIRECT_COUNT):
+            self.set(INDIRECT_ADDR_START + 2 * i, 2, INDIRECT_DATA_START + i)
+        # Torque-off motion: a slow sine around `home`, standing in for an
+        # operator moving the leader arm by hand.
+        self.home = home
+        self.amplitude = amplitude
+        self.period = period
+        self.phase = random.uniform(0, 2 * math.pi)
+        self.eeprom_writes = 0
+        self.offline = False # unplugged / browned out: hears nothing, answers nothing
+        self._t = time.monotonic()
+        self._pos = home
+        self._registered = None
+
+    @property
+    def dxl_id(self):
+        return self.ctrl[7]
+
+    @property
+    def baudrate(self):
+        return BAUD_TABLE.get(self.ctrl[8], 57600)
+
+    @property
+    def return_delay(self):
+        return self.ctrl[9] * 2e-6
+
+    def set_offline(self, offline):
+        # Coming back behaves like a power cycle: the RAM area is reset
+        if self.offline and not offline:
+            self.ctrl[EEPROM_END:INDIRECT_ADDR_START] = bytes(INDIRECT_ADDR_START - EEPROM_END)
+            for addr, size, value in XC330_DEFAULTS:
+                if addr >= EEPROM_END:
+                    self.set(addr, size, value)
+        self.offline = offline
+
+    def get(self, addr, size, signed=False):
+        return int.from_bytes(self.ctrl[addr:addr + size], "little", signed=signed)
+
+    def set(self, addr, size, value):
+        self.ctrl[addr:addr + size] = (value & ((1 << (8 * size)) - 1)).to_bytes(size, "little")
+
+    def _resolve(self, addr):
+        if INDIRECT_DATA_START <= addr < INDIRECT_DATA_START + INDIRECT_COUNT:
+            return self.get(INDIRECT_ADDR_START + 2 * (addr - INDIRECT_DATA_START), 2)
+        return addr
+
+    def read(self, addr, length):
+        if addr + length > CONTROL_TABLE_SIZE:
+            return ERRNUM_DATA_RANGE, b""
+        self.advance(time.monotonic())
+        return 0, bytes(self.ctrl[self._resolve(a)] for a in range(addr, addr + length))
+
+    def write(self, addr, data):
+        if addr + len(data) > CONTROL_TABLE_SIZE:
+            return ERRNUM_DATA_RANGE
+        targets = [self._resolve(a) for a in range(addr, addr + len(data))]
+        for a in targets:
+            if not _writable(a):
+                return ERRNUM_ACCESS
+            locked = a < EEPROM_END or INDIRECT_ADDR_START <= a < INDIRECT_DATA_START
+            if locked and self.ctrl[64]:
+                return ERRNUM_ACCESS
+        self.advance(time.monotonic())
+        for a, value in zip(targets, data):
+            self.ctrl[a] = value
+        if any(a < EEPROM_END for a in targets):
+            self.eeprom_writes += 1
+        return 0
+
+    def advance(self, now):
+        dt = now - self._t
+        if dt <= 0:
+            return
+        self._t = now
+        prev = self._pos
+        mode = self.ctrl[11]
+        current = random.randint(-3, 3)
+        if not self.ctrl[64]:
+            self._pos = self.home + self.amplitude * math.sin(2 * math.pi * now / self.period + self.phase)
+        elif mode in (3, 4, 5):
+            error = self.get(116, 4, signed=True) - self._pos
+            self._pos += error * (1.0 - math.exp(-dt / 0.05))
+            current += int(max(-self.get(38, 2), min(self.get(38, 2), error)))
+        elif mode == 16:
+            self._pos += self.get(100, 2, signed=True) / 885.0 * 3000.0 * dt
+        elif mode == 0:
+            current = self.get(102, 2, signed=True)
+            self._pos += current / 910.0 * 3000.0 * dt
+        velocity = (self._pos - prev) / dt * 60.0 / TICKS_PER_REV / VELOCITY_UNIT_RPM
+        self.set(120, 2, int(now * 1000) % 32768)
+        self.ctrl[122] = int(abs(velocity) > 1)
+        self.set(126, 2, current)
+        self.set(128, 4, int(round(velocity)))
+        self.set(132, 4, int(round(self._pos)))
+
+    def error_byte(self, errnum=0):
+        return errnum | (ERRBIT_ALERT if self.ctrl[70] else 0)
+
+    def status(self, errnum=0, params=b""):
+        return build_status(self.dxl_id, self.error_byte(errnum), params)
+
+    def handle(self, instruction, params):
+        # Unicast instruction -> (status packet or None)
+        level = self.ctrl[68]
+        if instruction == INST_PING:
+            return self.status(0, self.ctrl[0:2] + self.ctrl[6:7])
+        if instruction == INST_READ:
+            addr, length = struct.unpack_from("<HH", params)
+            errnum, data = self.read(addr, length)
+            return self.status(errnum, data) if level >= 1 else None
+        if instruction == INST_WRITE:
+            errnum = self.write(params[0] | (params[1] << 8), params[2:])
+        elif instruction == INST_REG_WRITE:
+            self._registered = (params[0] | (params[1] << 8), bytes(params[2:]))
+            self.ctrl[69] = 1
+            errnum = 0
+        elif instruction == INST_ACTION:
+            errnum = self.action()
+        elif instruction == INST_REBOOT:
+            self.ctrl[64] = 0
+            self.ctrl[70] = 0
+            errnum = 0
+        elif instruction == INST_CLEAR:
+            self._pos = self._pos % TICKS_PER_REV
+            errnum = 0
+        else:
+            errnum = ERRNUM_INSTRUCTION
+        return self.status(errnum) if level >= 2 else None
+
+    def action(self):
+        if self._registered is None:
+            return 0
+        addr, data = self._registered
+        self._registered = None
+        self.ctrl[69] = 0
+        return self.write(addr, data)
+
+
+class VirtualBus:
+    # Decodes instruction packets and schedules the status packets that the
+    # addressed servos put back on the wire.
+    def __init__(self, servos=()):
+        self.servos = list(servos)
+
+    @classmethod
+    def with_ids(cls, dxl_ids, **servo_kwargs):
+        return cls([SimServo(dxl_id, **servo_kwargs) for dxl_id in dxl_ids])
+
+    def servo(self, dxl_id, baudrate):
+        for servo in self.servos:
+            if servo.dxl_id == dxl_id and servo.baudrate == baudrate and not servo.offline:
+                return servo
+        return None
+
+    def listening(self, baudrate):
+        return [s for s in self.servos if s.baudrate == baudrate and not s.offline]
+
+    def handle(self, dxl_id, instruction, params, baudrate):
+        # Returns [(return_delay, status_bytes), ...] in wire order. Chained
+        # replies (sync/bulk read) each wait for the previous status packet.
+        if dxl_id != BROADCAST_ID:
+            servo = self.servo(dxl_id, baudrate)
+            if servo is None:
+                return []
+            reply = servo.handle(instruction, params)
+            return [(servo.return_delay, reply)] if reply else []
+
+        if instruction == INST_PING:
+            return [(s.return_delay, s.handle(INST_PING, b""))
+                    for s in sorted(self.listening(baudrate), key=lambda s: s.dxl_id)]
+        if instruction == INST_SYNC_READ:
+            addr, length = struct.unpack_from("<HH", params)
+            return self._chain([(i, addr, length) for i in params[4:]], baudrate)
+        if instruction == INST_FAST_SYNC_READ:
+            addr, length = struct.unpack_from("<HH", params)
+            return self._fast_chain(params[4:], addr, length, baudrate)
+        if instruction == INST_BULK_READ:
+            items = [struct.unpack_from("<BHH", params, i) for i in range(0, len(params), 5)]
+            return self._chain(items, baudrate)
+        if instruction == INST_SYNC_WRITE:
+            addr, length = struct.unpack_from("<HH", params)
+            for i in range(4, len(params), length + 1):
+                servo = self.servo(params[i], baudrate)
+                if servo is not None:
+                    servo.write(addr, params[i + 1:i + 1 + length])
+            return []
+        if instruction == INST_BULK_WRITE:
+            i = 0
+            while i + 5 <= len(params):
+                target, addr, length = struct.unpack_from("<BHH", params, i)
+                servo = self.servo(target, baudrate)
+                if servo is not None:
+                    servo.write(addr, params[i + 5:i + 5 + length])
+                i += 5 + length
+            return []
+        if instruction == INST_ACTION:
+            for servo in self.listening(baudrate):
+                servo.action()
+            return []
+        if instruction in (INST_WRITE, INST_REG_WRITE, INST_REBOOT, INST_CLEAR):
+            for servo in self.listening(baudrate):
+                servo.handle(instruction, params)
+            return []
+        return []
+
+    def _chain(self, items, baudrate):
+        replies = []
+        for dxl_id, addr, length in items:
+            servo = self.servo(dxl_id, baudrate)
+            if servo is None:
+                # later servos keep waiting for the missing status packet
+                break
+            errnum, data = servo.read(addr, length)
+            replies.append((servo.return_delay, servo.status(errnum, data)))
+        return replies
+
+
+    def _fast_chain(self, dxl_ids, addr, length, baudrate):
+        # One status packet: every servo appends [error, id, data, crc] right
+        # after the previous one without its own return delay. Each crc covers
+        # the packet so far, so the last one is the regular packet CRC.
+        packet = bytearray(HEADER) + bytes((BROADCAST_ID, 0, 0, INST_STATUS))
+        total = 1 + len(dxl_ids) * (length + 4)
+        packet[5:7] = total.to_bytes(2, "little")
+        delay = None
+        for dxl_id in dxl_ids:
+            servo = self.servo(dxl_id, baudrate)
+            if servo is None or servo.ctrl[6] < FAST_READ_MIN_FIRMWARE:
+                # truncated packet, the host sees a timeout / bad CRC
+                break
+            if delay is None:
+                delay = servo.return_delay
+            errnum, data = servo.read(addr, length)
+            packet += bytes((servo.error_byte(errnum), dxl_id)) + data
+            packet += crc16(packet).to_bytes(2, "little")
+        else:
+            body = stuff(packet[8:-2])
+            if len(body) != len(packet) - 10:
+                packet[5:7] = (len(body) + 3).to_bytes(2, "little")
+                packet[8:] = body
+                packet += crc16(packet).to_bytes(2, "little")
+        return [(delay, bytes(packet))] if delay is not None else []
+
+
+class SimPortHandler(PortHandler):
+    # usb_latency models the U2D2's FTDI latency timer (1 ms when configured
+    # with `setserial /dev/ttyUSB0 low_latency`).
+    def __init__(self, port_name, bus=None, usb_latency=0.001):
+        super().__init__(port_name)
+        self.bus = bus if bus is not None else VirtualBus()
+        self.usb_latency = usb_latency
+        self._rx_lock = threading.Lock()
+        self._rx = deque()  # [arrival_of_first_byte, byte_time, data, offset]
+        self._tx = bytearray()
+        self._tx_free_at = 0.0
+        self.bytes_written = 0
+        self.bytes_read = 0
+
+    @classmethod
+    def from_device(cls, device, default_ids=()):
+        # "sim:" or "sim:0,1,2,10,11,12"
+        spec = device[len(SIM_PREFIX):].strip("/")
+        dxl_ids = [int(x) for x in spec.split(",") if x] if spec else list(default_ids)
+        return cls(device, VirtualBus.with_ids(dxl_ids))
+
+    def setupPort(self, cflag_baud):
+        self.is_open = True
+        self.tx_time_per_byte = (1000.0 / self.baudrate) * 10.0
+        with self._rx_lock:
+            self._rx.clear()
+        return True
+
+    def closePort(self):
+        self.is_open = False
+
+    def clearPort(self):
+        pass
+
+    def getBytesAvailable(self):
+        now = time.monotonic()
+        with self._rx_lock:
+            return sum(self._arrived(chunk, now) - chunk[3] for chunk in self._rx)
+
+    @staticmethod
+    def _arrived(chunk, now):
+        start, byte_time, data, _ = chunk
+        if now < start:
+            return 0
+        return min(len(data), int((now - start) / byte_time) + 1)
+
+    def readPort(self, length):
+        out = bytearray()
+        with self._rx_lock:
+            now = time.monotonic()
+            while self._rx and len(out) < length:
+                chunk = self._rx[0]
+                end = min(self._arrived(chunk, now), chunk[3] + length - len(out))
+                out += chunk[2][chunk[3]:end]
+                chunk[3] = end
+                if end < len(chunk[2]):
+                    break
+                self._rx.popleft()
+            wait = self._rx[0][0] - now if not out and self._rx else 0.0
+        if wait > 0:
+            # behave like a short blocking read instead of a hot spin
+            time.sleep(min(wait, 0.001))
+        self.bytes_read += len(out)
+        return bytes(out)
+
+    def writePort(self, packet):
+        now = time.monotonic()
+        data = bytes(packet)
+        byte_time = 10.0 / self.baudrate
+        self.bytes_written += len(data)
+        self._tx += data
+        # back-to-back writes queue behind each other on the TX line, and like
+        # the tty driver, writePort blocks once TX_BUFFER_SIZE bytes are queued
+        backlog = self._tx_free_at - now - TX_BUFFER_SIZE * byte_time
+        if backlog > 0:
+            time.sleep(backlog)
+            now = time.monotonic()
+        cursor = max(now, self._tx_free_at) + len(data) * byte_time
+        self._tx_free_at = cursor
+        replies = []
+        for dxl_id, instruction, params, crc_ok in parse_packets(self._tx):
+            if crc_ok:
+                replies += self.bus.handle(dxl_id, instruction, params, self.baudrate)
+        with self._rx_lock:
+            for delay, reply in replies:
+                cursor += delay
+                self._rx.append([cursor + self.usb_latency, byte_time, reply, 0])
+                cursor += len(reply) * byte_time
+        return len(data)
@@ -0,0 +1,204 @@
+import asyncio
+import json
+import threading
+import time
+from collections import deque
+
+from .loop import LoopRunner
+
+# Server-sent events fan-out for the web UI. One thread samples the latest
+# acquisition frame at a fixed rate and serializes it once; every client gets
+# a latest-only slot, so a slow client just skips frames instead of holding
+# up the others. Named events (calibration state, ...) are queued per client
+# and the last one of each name is replayed to new clients.
+
+KEEPALIVE_SECONDS = 15.0
+MAX_PENDING_EVENTS = 32
+
+
+def sse_message(event, data):
+    return f"event: {event}\ndata: {json.dumps(data, separators=(',', ':'))}\n\n".encode()
+
+
+def encoders_message(frame):
+    return sse_message("encoders", {
+        "seq": frame.seq,
+        "pos": frame.positions.tolist(),
+        "filtered": frame.filtered_positions.round().astype(int).tolist(), # see filters.py
+        "valid": frame.valid.tolist(),
+        # ms since each motor last answered (as of now), null if it never did
+        "age": [round(age * 1000) if age != float("inf") else None
+                for age in frame.ages(time.monotonic()).tolist()],
+    })
+
+
+class Subscriber:
+    def __init__(self):
+        self.frame = None # latest encoded frame not yet sent
+        self.events = deque(maxlen=MAX_PENDING_EVENTS)
+        self.dropped = 0 # frames overwritten before this client read them
+        self._wake = threading.Condition()
+
+    def put_frame(self, message):
+        with self._wake:
+            if self.frame is not None:
+                self.dropped += 1
+            self.frame = message
+            self._wake.notify()
+
+    def put_event(self, message):
+        with self._wake:
+            self.events.append(message)
+            self._wake.notify()
+
+    def get(self, timeout=None):
+        # -> list of encoded messages, empty on timeout
+        with self._wake:
+            self._wake.wait_for(lambda: self.frame is not None or self.events, timeout)
+            messages = list(self.events)
+            self.events.clear()
+            if self.frame is not None:
+                messages.append(self.frame)
+                self.frame = None
+        return messages
+
+
+class FrameBroadcaster(LoopRunner):
+    # latest_frame: callable returning an acquisition Frame (seq, positions, ...)
+    def __init__(self, latest_frame, dxl_ids, rate=60.0):
+        super().__init__(period=1.0 / rate, name="sse-broadcaster")
+        self.latest_frame = latest_frame
+        self.dxl_ids = list(dxl_ids)
+        self.rate = rate
+        self._last_seq = -1
+        self._subscribers = set()
+        self._sticky = {} # event name -> last encoded message
+        self._lock = threading.Lock()
+
+    def subscribe(self):
+        subscriber = Subscriber()
+        subscriber.put_event(sse_message("hello", {"ids": self.dxl_ids, "rate": self.rate}))
+        with self._lock:
+            for message in self._sticky.values():
+                subscriber.put_event(message)
+            self._subscribers.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self._lock:
+            self._subscribers.discard(subscriber)
+
+    def subscriber_count(self):
+        return len(self._subscribers)
+
+    def publish_event(self, event, data):
+        message = sse_message(event, data)
+        with self._lock:
+            self._sticky[event] = message
+            subscribers = list(self._subscribers)
+        for subscriber in subscribers:
+            subscriber.put_event(message)
+
+    def stream(self, subscriber):
+        # Generator for a streaming HTTP response body
+        try:
+            while not self._stop_event.is_set():
+                messages = subscriber.get(KEEPALIVE_SECONDS)
+                if not messages:
+                    yield b": keepalive\n\n"
+                    continue
+                yield b"".join(messages)
+        finally:
+            self.unsubscribe(subscriber)
+
+    def step(self):
+        with self._lock:
+            subscribers = list(self._subscribers)
+        if not subscribers:
+            return
+        frame = self.latest_frame()
+        if frame.seq == self._last_seq:
+            return
+        self._last_seq = frame.seq
+        message = encoders_message(frame)
+        for subscriber in subscribers:
+            subscriber.put_frame(message)
+
+
+class AsyncSubscriber:
+    # Subscriber for the asyncio server (asyncWeb.py), same latest-only slot
+    def __init__(self):
+        self.frame = None
+        self.events = deque(maxlen=MAX_PENDING_EVENTS)
+        self.dropped = 0
+        self._wake = asyncio.Event()
+
+    def put_frame(self, message):
+        if self.frame is not None:
+            self.dropped += 1
+        self.frame = message
+        self._wake.set()
+
+    def put_event(self, message):
+        self.events.append(message)
+        self._wake.set()
+
+    async def get(self, timeout=None):
+        try:
+            await asyncio.wait_for(self._wake.wait(), timeout)
+        except asyncio.TimeoutError:
+            return []
+        self._wake.clear()
+        messages = list(self.events)
+        self.events.clear()
+        if self.frame is not None:
+            messages.append(self.frame)
+            self.frame = None
+        return messages
+
+
+class AsyncFrameBroadcaster:
+    # FrameBroadcaster as one task on the event loop. next_frame: coroutine
+    # function (after_seq) -> Frame, e.g. AsyncDynamixelPort.next_frame
+    def __init__(self, next_frame, dxl_ids, rate=60.0):
+        self.next_frame = next_frame
+        self.dxl_ids = list(dxl_ids)
+        self.rate = rate
+        self._subscribers = set()
+        self._sticky = {}
+
+    def subscribe(self):
+        subscriber = AsyncSubscriber()
+        subscriber.put_event(sse_message("hello", {"ids": self.dxl_ids, "rate": self.rate}))
+        for message in self._sticky.values():
+            subscriber.put_event(message)
+        self._subscribers.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        self._subscribers.discard(subscriber)
+
+    def subscriber_count(self):
+        return len(self._subscribers)
+
+    def publish_event(self, event, data):
+        message = sse_message(event, data)
+        self._sticky[event] = message
+        for subscriber in self._subscribers:
+            subscriber.put_event(message)
+
+    async def run(self):
+        # At most `rate` frames/s, against absolute deadlines like LoopRunner
+        loop = asyncio.get_running_loop()
+        period = 1.0 / self.rate
+        seq = 0
+        deadline = loop.time()
+        while True:
+            frame = await self.next_frame(seq)
+            seq = frame.seq
+            if self._subscribers:
+                message = encoders_message(frame)
+                for subscriber in self._subscribers:
+                    subscriber.put_frame(message)
+            deadline = max(deadline + period, loop.time())
+            await asyncio.sleep(deadline - loop.time())
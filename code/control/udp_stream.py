@@ -0,0 +1,204 @@
+import socket
+import struct
+import time
+from collections import deque
+
+import numpy as np
+
+# Leader -> follower joint streaming over UDP (default BIMANUAL_PORT).
+#
+#   0   "KG"
+#   2   u8  version
+#   3   u8  flags (FLAG_CURRENTS)
+#   4   u16 motor count n
+#   6   u32 sequence number (wraps)
+#   10  i64 sender time.time_ns()
+#   18  n x i32 positions, then n x i16 currents if FLAG_CURRENTS
+#
+# Latest wins: the receiver drains its socket and keeps only the newest
+# packet, dropping anything older than what it already applied or delayed by
+# more than max_age. The delay is judged on the receive side only: transit
+# (arrival - sender timestamp) minus the smallest transit over the last
+# BASELINE_WINDOW seconds, so any fixed offset between the two clocks cancels
+# out. The raw one-way latency (`latency`) needs the clocks in sync
+# (chrony/PTP) and is only a diagnostic. After RESYNC_SECONDS without a
+# packet, a sequence number that went backwards is taken as a restarted
+# sender rather than as out of order.
+
+MAGIC = b"KG"
+VERSION = 1
+FLAG_CURRENTS = 0x01
+HEADER = struct.Struct("<2sBBHIq")
+SEQ_MASK = 0xFFFFFFFF
+BASELINE_WINDOW = 10.0
+RESYNC_SECONDS = 1.0
+
+
+def packet_size(n, currents=False):
+    return HEADER.size + 4 * n + (2 * n if currents else 0)
+
+
+def seq_newer(a, b):
+    # a newer than b, with 32-bit wraparound
+    return 0 < ((a - b) & SEQ_MASK) < 0x80000000
+
+
+class LatencyStats:
+    # Last `size` one-way latencies plus RFC 3550 interarrival jitter
+    def __init__(self, size=4096):
+        self.samples = np.zeros(size, np.float64)
+        self.count = 0
+        self.jitter = 0.0
+        self._last_transit = None
+
+    def add(self, latency):
+        self.samples[self.count % len(self.samples)] = latency
+        self.count += 1
+        if self._last_transit is not None:
+            self.jitter += (abs(latency - self._last_transit) - self.jitter) / 16
+        self._last_transit = latency
+
+    def summary(self):
+        # -> {"p50": s, "p99": s, "max": s, "jitter": s} over the window
+        window = self.samples[:min(self.count, len(self.samples))]
+        if not len(window):
+            return {"p50": 0.0, "p99": 0.0, "max": 0.0, "jitter": 0.0}
+        p50, p99 = np.percentile(window, (50, 99))
+        return {"p50": p50, "p99": p99, "max": window.max(), "jitter": self.jitter}
+
+
+class JointStreamSender:
+    def __init__(self, host, port, n, currents=False):
+        self.address = (host, port)
+        self.n = n
+        self.seq = 0
+        self.buffer = bytearray(packet_size(n, currents))
+        self._flags = FLAG_CURRENTS if currents else 0
+        self.positions = np.frombuffer(self.buffer, "<i4", n, HEADER.size)
+        self.currents = np.frombuffer(self.buffer, "<i2", n, HEADER.size + 4 * n) if currents else None
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.setsockopt(socket.IPPROTO_IP, socket.IP_TOS, 0xB8) # DSCP EF, for networks that honor it
+
+    def send(self, positions, currents=None):
+        self.seq = (self.seq + 1) & SEQ_MASK
+        HEADER.pack_into(self.buffer, 0, MAGIC, VERSION, self._flags, self.n, self.seq, time.time_ns())
+        np.copyto(self.positions, positions[:self.n], casting="unsafe")
+        if self.currents is not None and currents is not None:
+            np.copyto(self.currents, currents[:self.n], casting="unsafe")
+        self.sock.sendto(self.buffer, self.address)
+
+    def close(self):
+        self.sock.close()
+
+
+class TransitBaseline:
+    # Sliding-window minimum of transit times (ns), as a monotonic deque
+    def __init__(self, window=BASELINE_WINDOW):
+        self.window = window
+        self._minima = deque() # (arrival s, transit ns), transit increasing
+
+    def add(self, now, transit):
+        # -> transit - the window's minimum, in seconds
+        minima = self._minima
+        while minima and minima[-1][1] >= transit:
+            minima.pop()
+        minima.append((now, transit))
+        while minima[0][0] < now - self.window:
+            minima.popleft()
+        return (transit - minima[0][1]) / 1e9
+
+    def clear(self):
+        self._minima.clear()
+
+
+class JointStreamReceiver:
+    def __init__(self, host, port, n, max_age=0.1):
+        self.n = n
+        self.max_age = max_age # seconds of delay beyond the fastest recent packet; later ones are dropped
+        self.seq = None
+        self.sent_ns = 0
+        self.delay = 0.0 # of the last packet, see TransitBaseline
+        self.has_currents = False
+        self.positions = np.zeros(n, np.int32)
+        self.currents = np.zeros(n, np.int16)
+        self.latency = LatencyStats()
+        self.received = 0
+        self.lost = 0 # sequence gaps
+        self.superseded = 0 # arrived in time but a newer one came with it
+        self.out_of_order = 0
+        self.stale = 0
+        self.malformed = 0
+        self.restarts = 0 # sender came back with a new sequence
+        self._baseline = TransitBaseline()
+        self._last_arrival = None
+        self._buffer = bytearray(packet_size(n, True))
+        self._latest = bytearray(len(self._buffer))
+        self._positions = np.frombuffer(self._latest, "<i4", n, HEADER.size)
+        self._currents = np.frombuffer(self._latest, "<i2", n, HEADER.size + 4 * n)
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.sock.bind((host, port))
+
+    def _drain(self, timeout):
+        # Newest packet ahead of self.seq into self._latest ->
+        # (seq, sent_ns, flags, skipped) or None; `skipped` counts the newer
+        # packets it superseded, so they aren't reported as lost
+        newest, skipped = None, 0
+        self.sock.settimeout(timeout)
+        while True:
+            try:
+                size = self.sock.recv_into(self._buffer)
+            except (BlockingIOError, socket.timeout):
+                return None if newest is None else newest + (skipped,)
+            self.sock.settimeout(0)
+            if size < HEADER.size:
+                self.malformed += 1
+                continue
+            magic, version, flags, n, seq, sent_ns = HEADER.unpack_from(self._buffer)
+            if magic != MAGIC or version != VERSION or n != self.n or size != packet_size(n, flags & FLAG_CURRENTS):
+                self.malformed += 1
+                continue
+            self.received += 1
+            if self.seq is not None and not seq_newer(seq, self.seq):
+                self.out_of_order += 1
+                continue
+            if newest is not None:
+                skipped += 1
+                if not seq_newer(seq, newest[0]):
+                    continue
+            self._latest[:size] = self._buffer[:size]
+            newest = (seq, sent_ns, flags)
+
+    def receive(self, timeout=None):
+        # Blocks up to `timeout` for a packet newer than the last one applied;
+        # returns True and updates positions/currents if one arrived.
+        if self.seq is not None and time.monotonic() - self._last_arrival > RESYNC_SECONDS:
+            # Quiet for a while: accept whatever sequence comes next
+            self.seq = None
+            self._baseline.clear()
+            self.restarts += 1
+        packet = self._drain(timeout)
+        if packet is None:
+            return False
+        seq, sent_ns, flags, skipped = packet
+        now = time.monotonic()
+        transit = time.time_ns() - sent_ns
+        self._last_arrival = now
+        self.superseded += skipped
+        if self.seq is not None:
+            self.lost += max(((seq - self.seq) & SEQ_MASK) - 1 - skipped, 0)
+        self.seq = seq
+        self.latency.add(transit / 1e9)
+        self.delay = self._baseline.add(now, transit)
+        if self.delay > self.max_age:
+            self.stale += 1
+            return False
+        self.sent_ns = sent_ns
+        self.has_currents = bool(flags & FLAG_CURRENTS)
+        np.copyto(self.positions, self._positions)
+        if self.has_currents:
+            np.copyto(self.currents, self._currents)
+        return True
+
+    def close(self):
+        self.sock.close()
@@ -0,0 +1,90 @@
+import hashlib
+import json
+import os
+import re
+
+from .joint_mapping import JOINT_LIMITS_PATH, load_joint_limits, save_joint_limits
+
+# Joint limits from the openarm xacro, cached in static/joint_limits.json and
+# keyed by a content hash of the xacro file and everything it includes, so a
+# warm start never imports xacro or urdf_parser_py.
+
+URDF_PACKAGE = "openarm_bimanual_description"
+URDF_XACRO = "urdf/openarm_bimanual.urdf.xacro"
+
+_INCLUDE_RE = re.compile(r"""<xacro:include\s[^>]*filename\s*=\s*["']([^"']+)["']""")
+_FIND_RE = re.compile(r"\$\(find\s+([^)\s]+)\)")
+
+
+def package_share(package):
+    # ament_index is all FindPackageShare does, minus importing launch_ros
+    from ament_index_python.packages import get_package_share_directory
+    return get_package_share_directory(package)
+
+
+def default_model_path():
+    return os.path.join(package_share(URDF_PACKAGE), URDF_XACRO)
+
+
+def _resolve_include(filename, parent_dir):
+    try:
+        filename = _FIND_RE.sub(lambda m: package_share(m.group(1)), filename)
+    except Exception:
+        return None
+    if "$(" in filename:
+        return None # depends on xacro args, only its text is hashed
+    return os.path.normpath(os.path.join(parent_dir, filename))
+
+
+def xacro_source_hash(path):
+    digest = hashlib.sha256()
+    pending, seen = [os.path.abspath(path)], set()
+    while pending:
+        current = pending.pop()
+        if current in seen:
+            continue
+        seen.add(current)
+        digest.update(current.encode())
+        try:
+            with open(current, "rb") as f:
+                data = f.read()
+        except OSError:
+            digest.update(b"<missing>")
+            continue
+        digest.update(data)
+        for filename in _INCLUDE_RE.findall(data.decode("utf-8", "replace")):
+            digest.update(filename.encode())
+            resolved = _resolve_include(filename, os.path.dirname(current))
+            if resolved is not None:
+                pending.append(resolved)
+    return digest.hexdigest()
+
+
+def parse_joint_limits(model_path):
+    import xacro
+    from urdf_parser_py.urdf import URDF
+
+    doc = xacro.process_file(model_path)
+    robot = URDF.from_xml_string(doc.toxml())
+    return {
+        joint.name: (joint.limit.lower, joint.limit.upper)
+        for joint in robot.joints
+        if joint.limit is not None
+    }
+
+
+def load_urdf_joint_limits(model_path=None, cache_path=JOINT_LIMITS_PATH):
+    # -> (joint_limits, cache_hit)
+    if model_path is None:
+        model_path = default_model_path()
+    source_hash = xacro_source_hash(model_path)
+    try:
+        with open(cache_path) as f:
+            cached_hash = json.load(f).get("source_hash")
+        if cached_hash == source_hash:
+            return load_joint_limits(cache_path), True
+    except (OSError, ValueError):
+        pass
+    joint_limits = parse_joint_limits(model_path)
+    save_joint_limits(joint_limits, cache_path, source_hash=source_hash, source=model_path)
+    return joint_limits, False
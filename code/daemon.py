@@ -0,0 +1,200 @@
+from control.acquisition import Frame
+from control.dynamixel_port import (open_controller, logprint, DynamixelError, DEFAULT_DEVICE, ADDR_TORQUE_ENABLE,
+                                    PWM_CONTROL_MODE, CURRENT_CONTROL_MODE, CURRENT_BASE_POSITION_CONTROL_MODE,
+                                    EXTENDED_POSITION_CONTROL_MODE)
+from control.shared_port import (SharedFrames, parse_command, socket_path, DEFAULT_NAME, MAX_COMMAND, STATUS_PERIOD,
+                                 OP_GOALS, OP_TORQUE, OP_WRITE, OP_METRICS)
+import argparse
+import os
+import signal
+import socket
+import threading
+import time
+
+import numpy as np
+
+# Owns the bus and shares it: every frame goes into shared memory for any
+# number of clients (KIRIGIRISU_DEVICE=shm:), goal commands come back over a
+# datagram socket. See control/shared_port.py.
+#   python daemon.py                                  torque off, e.g. for web.py calibration
+#   python daemon.py --torque 0 1 2 --mode current-position
+
+MOTOR_IDS = None # every motor on the bus (see control/discovery.py), or e.g. [0, 1, 2, 10, 11, 12]
+CONTROL_MODES = {
+    "pwm": PWM_CONTROL_MODE,
+    "current": CURRENT_CONTROL_MODE,
+    "current-position": CURRENT_BASE_POSITION_CONTROL_MODE,
+    "extended-position": EXTENDED_POSITION_CONTROL_MODE,
+}
+
+
+class Daemon:
+    def __init__(self, port, name=DEFAULT_NAME):
+        self.port = port
+        self.name = name
+        self.frames = SharedFrames.create(name, port.dxl_ids)
+        self.address = socket_path(name)
+        if os.path.exists(self.address):
+            os.unlink(self.address) # the shared memory is ours, so this is a dead daemon's
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self.sock.bind(self.address)
+        self.sock.settimeout(0.1)
+        self._column = {dxl_id: i for i, dxl_id in enumerate(port.dxl_ids)}
+        # Goals as last sent, so a client driving some of the motors leaves
+        # the others where they are. Without the port's own copy (several
+        # buses) a goal has to cover every motor before partial ones are taken.
+        n = len(port.dxl_ids)
+        seed = getattr(port, "goals", None)
+        self.goals = {name: np.array(seed[name]) if seed is not None else np.zeros((n), dtype)
+                      for name, dtype in (("position", np.int32), ("current", np.int16), ("pwm", np.int16))}
+        self._goals_known = {name: seed is not None for name in self.goals}
+        self.applied = 0
+        self.rejected = 0
+        self._stop = threading.Event()
+        self._status_due = 0.0
+
+    def stop(self):
+        self._stop.set()
+
+    def status(self, acquisition):
+        metrics = self.port.metrics
+        return {
+            "device": self.port.device,
+            "pid": os.getpid(),
+            "acquisition": dict(acquisition.stats.summary(), realtime=acquisition.realtime,
+                                filters=acquisition.filters.settings()),
+            "health": self.port.motor_health(),
+            "metrics": metrics.snapshot() if metrics is not None else None,
+            "commands": {"applied": self.applied, "rejected": self.rejected},
+        }
+
+    def publish(self, acquisition):
+        frame = Frame(len(self.port.dxl_ids))
+        while not self._stop.is_set():
+            if acquisition.wait(frame.seq, timeout=0.1):
+                self.port.latest_frame(frame)
+                self.frames.publish(frame)
+            else:
+                self.frames.heartbeat()
+            now = time.monotonic()
+            if now >= self._status_due:
+                self._status_due = now + STATUS_PERIOD
+                if not self.frames.publish_status(self.status(acquisition)):
+                    logprint("Status too large for shared memory, not updated")
+
+    def _reject(self, message):
+        self.rejected += 1
+        logprint(f"Command rejected: {message}")
+
+    def _merge_goals(self, ids, payload, pending):
+        columns = [self._column[dxl_id] for dxl_id in ids]
+        for name, values in payload.items():
+            if not self._goals_known[name] and len(set(columns)) != len(self._column):
+                self._reject(f"{name} goals for {ids} before any covering every motor")
+                continue
+            self.goals[name][columns] = values
+            self._goals_known[name] = True
+            pending.add(name)
+
+    def _flush_goals(self, pending):
+        if pending:
+            self.port.set_goals(pos=self.goals["position"] if "position" in pending else None,
+                                cur=self.goals["current"] if "current" in pending else None,
+                                pwm=self.goals["pwm"] if "pwm" in pending else None)
+            pending.clear()
+
+    def _apply(self, op, flags, ids, payload):
+        if op == OP_TORQUE:
+            if flags:
+                for dxl_id in ids:
+                    self.port.writeTxRx(dxl_id, ADDR_TORQUE_ENABLE, np.uint8(1))
+            else:
+                self.port.disable_torque(ids)
+        elif op == OP_WRITE:
+            addr, size, value = payload
+            self.port.writeTxRx(ids[0], addr, np.array(value).astype({1: np.uint8, 2: np.int16, 4: np.int32}[size]))
+        elif op == OP_METRICS:
+            if flags:
+                self.port.enable_metrics()
+            else:
+                self.port.disable_metrics()
+            self._status_due = 0.0
+
+    def handle_commands(self):
+        pending = set() # goals merged but not yet written
+        while not self._stop.is_set():
+            try:
+                packets = [self.sock.recv(MAX_COMMAND)]
+            except socket.timeout:
+                continue
+            while True:
+                try:
+                    packets.append(self.sock.recv(MAX_COMMAND, socket.MSG_DONTWAIT))
+                except (BlockingIOError, socket.timeout):
+                    break
+            for packet in packets:
+                try:
+                    op, flags, ids, payload = parse_command(packet)
+                    unknown = [dxl_id for dxl_id in ids if dxl_id not in self._column]
+                    if unknown:
+                        raise ValueError(f"motors {unknown} aren't on this daemon")
+                except ValueError as e:
+                    self._reject(e)
+                    continue
+                self.applied += 1
+                if op == OP_GOALS:
+                    self._merge_goals(ids, payload, pending)
+                    continue
+                # Anything else goes out in order, after the goals queued before it
+                try:
+                    self._flush_goals(pending)
+                    self._apply(op, flags, ids, payload)
+                except DynamixelError as e:
+                    self._reject(e)
+            try:
+                self._flush_goals(pending)
+            except DynamixelError as e:
+                self._reject(e)
+
+    def run(self):
+        acquisition = self.port.start_acquisition()
+        publisher = threading.Thread(target=self.publish, args=(acquisition,), name="shm-publisher", daemon=True)
+        publisher.start()
+        try:
+            self.handle_commands()
+        finally:
+            self._stop.set()
+            publisher.join()
+
+    def close(self):
+        self.sock.close()
+        if os.path.exists(self.address):
+            os.unlink(self.address)
+        self.frames.close()
+        self.frames.unlink()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--device", default=os.environ.get("KIRIGIRISU_DEVICE", DEFAULT_DEVICE))
+    parser.add_argument("--motors", type=int, nargs="+", default=MOTOR_IDS)
+    parser.add_argument("--torque", type=int, nargs="*", default=[], help="motors to set up with torque on")
+    parser.add_argument("--mode", choices=CONTROL_MODES, default="pwm")
+    parser.add_argument("--name", default=DEFAULT_NAME, help="clients attach with KIRIGIRISU_DEVICE=shm:<name>")
+    args = parser.parse_args()
+
+    controller = open_controller(args.device, args.motors, args.torque, control_mode=CONTROL_MODES[args.mode])
+    daemon = Daemon(controller, args.name)
+    signal.signal(signal.SIGTERM, lambda signum, frame: daemon.stop())
+    print(f"Sharing {controller.dxl_ids} on {args.device} as shm:{args.name}, Ctrl-C to stop")
+    try:
+        daemon.run()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        daemon.close()
+        controller.cleanup()
+
+
+if __name__ == "__main__":
+    main()
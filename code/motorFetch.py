@@ -1,28 +1,29 @@
-from control.dynamixel_port import DynamixelPort
-import time
+from control.dynamixel_port import open_controller, DEFAULT_DEVICE
+from control.loop import LoopRunner
+import os
 import numpy as np
 
 
-MOTOR_IDS = [2, 10] # Starting from the wrist
+MOTOR_IDS = None # every motor on the bus (see control/discovery.py), or e.g. [2, 10]
+DEVICE = os.environ.get("KIRIGIRISU_DEVICE", DEFAULT_DEVICE) # e.g. "sim:2,10" for the virtual bus
 
-controller = DynamixelPort(
-    device="/dev/ttyUSB0",
+controller = open_controller(
+    device=DEVICE,
     dxl_ids=MOTOR_IDS,
-    motor_with_torque=MOTOR_IDS
+    motor_with_torque=[]
 )
 print("get")
 
-controller.disable_torque(MOTOR_IDS)
+def step():
+    controller.fetch_present_status()
+    print("Positions:", controller.present_positions)
+    print("Currents:", controller.present_currents)
 
-try:
-    while True:
-        controller.fetch_present_status()
-        print("Positions:", controller.present_positions)
-        print("Currents:", controller.present_currents)
+    #goal_positions = np.array([2048, 2048])  # midpoint for most Dynamixels
+    #controller.set_goal_positions(goal_positions)
 
-        #goal_positions = np.array([2048, 2048])  # midpoint for most Dynamixels
-        #controller.set_goal_positions(goal_positions)
-        time.sleep(0.1)
+try:
+    LoopRunner(step, period=0.1).run()
 
 except KeyboardInterrupt:
     controller.cleanup()
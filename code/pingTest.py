@@ -1,12 +1,33 @@
-from dynamixel_sdk import *
+from control.dynamixel_port import make_port_handler, DEFAULT_DEVICE, BAUDRATE
+from control.discovery import discover, TOPOLOGY_PATH
+import argparse
+import os
+import time
 
-portHandler = PortHandler("/dev/ttyUSB0")
-packetHandler = PacketHandler(2.0)
-portHandler.openPort()
-portHandler.setBaudRate(57600)
-dxl_model_number, dxl_comm_result, dxl_error = packetHandler.ping(portHandler, 1)
+# Lists the motors on the bus (one broadcast ping, cached in static/topology.json).
+#   python pingTest.py            # cached topology, confirmed with one sync read
+#   python pingTest.py --refresh  # broadcast ping, e.g. after adding a motor
 
-if dxl_comm_result == COMM_SUCCESS:
-    print(f"Ping successful, model number: {dxl_model_number}")
+parser = argparse.ArgumentParser()
+parser.add_argument("--device", default=os.environ.get("KIRIGIRISU_DEVICE", DEFAULT_DEVICE))
+parser.add_argument("--baud", type=int, default=BAUDRATE)
+parser.add_argument("--refresh", action="store_true", help="ignore the cache and broadcast ping")
+args = parser.parse_args()
+
+portHandler = make_port_handler(args.device)
+if not portHandler.openPort() or not portHandler.setBaudRate(args.baud):
+    raise SystemExit(f"Failed to open {args.device} at {args.baud}")
+
+t = time.monotonic()
+topology = discover(portHandler, args.device, args.baud, refresh=args.refresh)
+elapsed = (time.monotonic() - t) * 1000
+portHandler.closePort()
+
+if not topology.motors:
+    print(f"Ping failed: nothing answers on {args.device} at {args.baud}")
 else:
-    print("Ping failed")
+    for dxl_id, (model_number, firmware) in topology.motors.items():
+        print(f"ID {dxl_id:3d}: model number {model_number}, firmware v{firmware}")
+    print(f"{len(topology.motors)} motors ({topology.source}, {elapsed:.0f} ms), saved in {TOPOLOGY_PATH}")
+if topology.changes:
+    print(f"Changed since the last scan: {topology.changes}")
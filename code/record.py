@@ -0,0 +1,44 @@
+from control.dynamixel_port import DynamixelPort, DEFAULT_DEVICE
+from control.calibration_store import CalibrationStore
+from control.recorder import Recorder, open_log
+import argparse
+import os
+import time
+
+import numpy as np
+
+# Records raw bus frames (positions, currents) at full bus rate into a
+# memory-mapped log, torque off so the arm can be moved by hand:
+#   python record.py --out session.kirilog
+# and loads one back for analysis with:
+#   meta, frames = open_log("session.kirilog"); frames["positions"]
+
+MOTOR_IDS = [0, 1, 2, 10, 11, 12] # Starting from the wrist
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--device", default=os.environ.get("KIRIGIRISU_DEVICE", DEFAULT_DEVICE))
+    parser.add_argument("--motors", type=int, nargs="+", default=MOTOR_IDS)
+    parser.add_argument("--out", default=time.strftime("session_%Y%m%d_%H%M%S.kirilog"))
+    parser.add_argument("--seconds", type=float, default=None, help="stop after this long (default: Ctrl-C)")
+    args = parser.parse_args()
+
+    controller = DynamixelPort(device=args.device, dxl_ids=args.motors, motor_with_torque=args.motors)
+    controller.disable_torque(args.motors)
+
+    print(f"Recording {args.motors} to {args.out}, Ctrl-C to stop")
+    start = time.monotonic()
+    with Recorder(args.out, args.motors, CalibrationStore().data, device=args.device) as recorder:
+        count = recorder.record(controller, args.seconds)
+    elapsed = time.monotonic() - start
+    controller.cleanup()
+
+    meta, frames = open_log(args.out)
+    failed = int(np.count_nonzero(frames["valid"] == 0)) if len(frames) else 0
+    print(f"{count} frames in {elapsed:.1f}s ({count / elapsed:.1f} Hz), {failed} failed motor reads, "
+          f"{os.path.getsize(args.out) / 1e6:.1f} MB")
+
+
+if __name__ == "__main__":
+    main()
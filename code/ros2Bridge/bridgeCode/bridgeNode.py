@@ -1,179 +1,265 @@
+import time
+START_TIME = time.monotonic()
+
 import rclpy
 from rclpy.node import Node
 from sensor_msgs.msg import JointState
-import time
+from diagnostic_msgs.msg import DiagnosticArray, DiagnosticStatus, KeyValue
+import array
 import sys
 import os
-import json
-from pathlib import Path
-from urdf_parser_py.urdf import URDF
-
-import launch_ros
-from launch_ros.substitutions import FindPackageShare
-import xacro
 
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../../')))
-from control.dynamixel_port import DynamixelPort
-
-# Control table addresses (for X-series motors like XM430-W210)
-ADDR_PRESENT_POSITION = 132  # 4 bytes
+from control.dynamixel_port import open_controller
+from control.acquisition import Frame
+from control.loop import LoopRunner
+from control.calibration_store import CalibrationStore
+from control.joint_mapping import JointMapping, MOTOR_TO_JOINT, JOINT_TRANSFORMS
+from control.urdf_limits import load_urdf_joint_limits
+import numpy as np
 
+IMPORT_TIME = time.monotonic() - START_TIME
 
 MOTOR_IDS = [0, 1, 2, 10, 11, 12]
-MOTOR_TO_JOINT = {
-    0: 'left_rev6',
-    1: 'left_rev7',
-    2: ['left_left_pris1', 'left_right_pris2'],
-    10: 'right_rev6',
-    11: 'right_rev7',
-    12: ['right_left_pris1', 'right_right_pris2'],
-    # add more as needed
-}
-# Optional per-joint transformations: {joint_name: (scale, offset)}
-    # (-1.0, 0.0),  # invert
-    # (-1.0, 0.1),  # invert + offset
-JOINT_TRANSFORMS = {
-    "right_rev6": (-1, 0),
-    "left_rev6": (-1,0),
-    "left_right_pris2": (-1, 0),
-    "right_left_pris1": (-1, -0.05),
-    "right_right_pris2": (1, 0.05),
-    # Add others as needed
-}
+DEVICE = os.environ.get("KIRIGIRISU_DEVICE", "/dev/ttyUSB0") # e.g. "sim:" for the virtual bus
+PUBLISH_RATE = float(os.environ.get("KIRIGIRISU_PUBLISH_HZ", "50"))
+STALE_SECONDS = 0.25 # joints whose motor hasn't answered for this long are left out of /joint_states
 
 
 class ros2Bridge(Node):
     def __init__(self):
         super().__init__('kirigirisu_ros2_bridge')
-
-        calibration_path = Path(__file__).resolve().parents[2] / "static" / "calibration.json"
-        if not calibration_path.exists():
-            self.get_logger().error(f"Calibration file not found: {calibration_path}")
+        self.startup = {"imports": IMPORT_TIME}
+        self.first_publish = True
+        self.motor = None
+        self.publish_loop = None
+
+        # Reloaded when web.py saves a new calibration, no restart needed
+        self.calibration = CalibrationStore()
+        if self.calibration.data is None:
+            self.get_logger().error(f"Calibration file not found: {self.calibration.path}")
             rclpy.shutdown()
             return
-
-        with open(calibration_path) as f:
-            self.encoder_limits = json.load(f)
+        self.encoder_limits = self.calibration.data
 
         # ROS publisher that sends joint states to /joint_states
         self.joint_pub = self.create_publisher(JointState, '/joint_states', 10)
 
-        # Runs every 20ms (50 Hz)
-        self.timer = self.create_timer(0.02, self.publish_joint_states)
+        self.calibration_timer = self.create_timer(1.0, self.reload_calibration)
 
-        self.motor = DynamixelPort(
-            device="/dev/ttyUSB0",
+        t = time.monotonic()
+        self.motor = open_controller(
+            device=DEVICE,
             dxl_ids=MOTOR_IDS,
             motor_with_torque=MOTOR_IDS
         )
+        self.startup["motors"] = time.monotonic() - t
+
+        # Bus timing on /diagnostics when KIRIGIRISU_METRICS=1; hardware
+        # errors go out as soon as a motor's error status changes either way
+        self.diagnostics_pub = self.create_publisher(DiagnosticArray, '/diagnostics', 10)
+        if self.motor.metrics is not None:
+            self.diagnostics_timer = self.create_timer(1.0, self.publish_diagnostics)
+        self.motor.add_hardware_listener(self.hardware_alert)
 
         self.portHandler = self.motor.portHandler
         self.packetHandler = self.motor.packetHandler
 
         self.motor_to_joint = MOTOR_TO_JOINT
         
-        # Store joint limits from urdf
-        pkg_share = Path(
-            launch_ros.substitutions.FindPackageShare(package="openarm_bimanual_description").find(
-                "openarm_bimanual_description"
-            )
-        )
-        default_model_path = pkg_share / "urdf/openarm_bimanual.urdf.xacro"
-        doc = xacro.process_file(str(default_model_path))
-        robot_description_xml = doc.toxml()
-        robot = URDF.from_xml_string(robot_description_xml)
-
-        self.joint_angle_limits = {
-            joint.name: (joint.limit.lower, joint.limit.upper)
-            for joint in robot.joints
-            if joint.limit is not None
-        }
-
-        for joint in robot.joints:
-            if joint.limit:
-                print(joint.name, joint.limit.lower, joint.limit.upper)
+        # Joint limits from urdf, cached in static/joint_limits.json (also read
+        # by web.py) until the xacro or one of its includes changes
+        t = time.monotonic()
+        self.joint_angle_limits, cache_hit = load_urdf_joint_limits()
+        self.startup["urdf (cached)" if cache_hit else "urdf (parsed)"] = time.monotonic() - t
+        if not cache_hit:
+            for name, (lower, upper) in self.joint_angle_limits.items():
+                self.get_logger().debug(f"{name} {lower} {upper}")
+
+        self.build_mapping()
+        self.fresh = np.zeros(len(MOTOR_IDS), bool)
+        self.ages = np.zeros(len(MOTOR_IDS))
+
+        # The bus is read back to back on its own thread (realtime if
+        # KIRIGIRISU_RT_PRIORITY allows); joint states go out at PUBLISH_RATE
+        # from the newest frame, on a second thread off the executor, so a
+        # slow read or callback no longer lowers the publish rate.
+        self.frame = Frame(len(MOTOR_IDS))
+        self.motor.start_acquisition()
+        self.publish_loop = LoopRunner(self.publish_joint_states, 1.0 / PUBLISH_RATE, name="joint-state-publisher")
+        self.publish_loop.start()
+
+    def build_mapping(self):
+        # Encoder ticks -> joint positions, compiled once per calibration
+        mapping = JointMapping(MOTOR_IDS, self.encoder_limits, self.joint_angle_limits,
+                               self.motor_to_joint, JOINT_TRANSFORMS)
+        if mapping.skipped:
+            self.get_logger().warn(f"No joint mapping for: {mapping.skipped}")
+        # One JointState reused for every full publish: position, velocity and
+        # effort are array('d') fields the mapping writes into through NumPy
+        # views, so a tick allocates nothing. Swapped as one attribute, the
+        # publish thread may be mid-frame.
+        msg = JointState()
+        msg.name = list(mapping.joint_names)
+        views = []
+        for field in ("position", "velocity", "effort"):
+            values = array.array("d", bytes(8 * len(mapping.joint_names)))
+            setattr(msg, field, values)
+            views.append(np.frombuffer(values, np.float64))
+        self.mapping = (mapping, msg, *views)
+
+    def reload_calibration(self):
+        # One stat() per second unless the file was replaced
+        try:
+            if not self.calibration.refresh() or self.calibration.data is None:
+                return
+            self.encoder_limits = self.calibration.data
+            self.build_mapping()
+            self.get_logger().info(f"Calibration reloaded (version {self.calibration.version})")
+        except Exception as e:
+            self.get_logger().error(f"reload_calibration() failed: {e}")
+
+    def publish_diagnostics(self):
+        snapshot = self.motor.metrics.snapshot()
+        msg = DiagnosticArray()
+        msg.header.stamp = self.get_clock().now().to_msg()
+        for op, stats in snapshot["ops"].items():
+            status = DiagnosticStatus(name=f"kirigirisu/bus/{op}", hardware_id=self.motor.device)
+            bus, lock_wait = stats["bus_ms"], stats["lock_wait_ms"]
+            values = {"count": bus["count"], "errors": stats["errors"]}
+            if bus["count"]:
+                values.update({"bus p50 ms": bus["p50"], "bus p99 ms": bus["p99"], "bus max ms": bus["max"],
+                               "lock wait p99 ms": lock_wait["p99"]})
+            if "wire_ms" in stats:
+                values["wire ms"] = stats["wire_ms"]
+            status.values = [KeyValue(key=key, value=f"{value:.3f}" if isinstance(value, float) else str(value))
+                             for key, value in values.items()]
+            status.level = DiagnosticStatus.WARN if stats["errors"] else DiagnosticStatus.OK
+            status.message = f"{stats['errors']} errors" if stats["errors"] else "OK"
+            msg.status.append(status)
+        for name, loop in (("acquisition", self.motor.acquisition), ("publish", self.publish_loop)):
+            stats = loop.stats.summary()
+            status = DiagnosticStatus(name=f"kirigirisu/loop/{name}", hardware_id=self.motor.device)
+            values = {"rate hz": stats["rate"], "overruns": stats["overruns"], "skipped": stats["skipped"],
+                      "errors": stats.get("errors", 0)}
+            if stats.get("last_error"):
+                values["last error"] = stats["last_error"]
+            if stats["step_ms"]["count"]:
+                values.update({"step p99 ms": stats["step_ms"]["p99"], "step max ms": stats["step_ms"]["max"]})
+            if stats["lateness_ms"]["count"]:
+                values["wake late p99 ms"] = stats["lateness_ms"]["p99"]
+            values.update(loop.realtime)
+            status.values = [KeyValue(key=key, value=f"{value:.3f}" if isinstance(value, float) else str(value))
+                             for key, value in values.items()]
+            if values["errors"]:
+                status.level = DiagnosticStatus.ERROR
+                status.message = f"{values['errors']} failed steps"
+            else:
+                status.level = DiagnosticStatus.WARN if stats["skipped"] else DiagnosticStatus.OK
+                status.message = f"{stats['skipped']} deadlines missed" if stats["skipped"] else "OK"
+            msg.status.append(status)
+        for name, settings in self.motor.acquisition.filters.settings().items():
+            status = DiagnosticStatus(name=f"kirigirisu/filter/{name}", hardware_id=self.motor.device)
+            values = {}
+            if settings is not None:
+                values = {key: value for key, value in settings.items() if key != "latency_ms"}
+                values.update({f"latency ms at {speed}": ms for speed, ms in settings["latency_ms"].items()})
+            status.values = [KeyValue(key=key, value=f"{value:.3f}" if isinstance(value, float) else str(value))
+                             for key, value in values.items()]
+            status.level = DiagnosticStatus.OK
+            status.message = "off" if settings is None else settings["type"]
+            msg.status.append(status)
+        for dxl_id, health in self.motor.motor_health().items():
+            msg.status.append(self.motor_status(dxl_id, health))
+        if "skew_ms" in snapshot:
+            # Several buses: how far apart their reads of one frame were
+            skew = snapshot["skew_ms"]
+            status = DiagnosticStatus(name="kirigirisu/bus/skew", hardware_id=self.motor.device)
+            status.values = [KeyValue(key=f"skew {key} ms", value=f"{skew[key]:.3f}") for key in ("p50", "p99", "max")
+                             if skew.get(key) is not None]
+            status.level = DiagnosticStatus.OK
+            status.message = "OK"
+            msg.status.append(status)
+        failed = snapshot["failed_reads"]
+        status = DiagnosticStatus(name="kirigirisu/bus/failed_reads", hardware_id=self.motor.device)
+        status.values = [KeyValue(key=f"motor {dxl_id}", value=str(failed.get(dxl_id, 0))) for dxl_id in MOTOR_IDS]
+        status.level = DiagnosticStatus.WARN if failed else DiagnosticStatus.OK
+        status.message = f"read failures on {sorted(failed)}" if failed else "OK"
+        msg.status.append(status)
+        self.diagnostics_pub.publish(msg)
+
+    def motor_status(self, dxl_id, health):
+        status = DiagnosticStatus(name=f"kirigirisu/motor/{dxl_id}", hardware_id=self.motor.device)
+        status.values = [KeyValue(key=key, value=str(value)) for key, value in health.items()]
+        errors = health.get("hardware_errors")
+        status.level = DiagnosticStatus.OK if health["state"] == "online" and not errors else DiagnosticStatus.ERROR
+        status.message = ", ".join(errors) if errors else health["state"]
+        return status
+
+    def hardware_alert(self, alert):
+        # On the acquisition thread, once per change of a motor's error bits
+        try:
+            dxl_id = alert["id"]
+            if alert["raised"]:
+                self.get_logger().error(f"Motor ID {dxl_id} hardware error: {alert['raised']}"
+                                        f" ({alert['voltage']:.1f} V, {alert['temperature']:.0f} C)")
+            if alert["cleared"]:
+                self.get_logger().info(f"Motor ID {dxl_id} hardware error cleared: {alert['cleared']}")
+            health = self.motor.motor_health().get(dxl_id)
+            if health is None:
+                return
+            msg = DiagnosticArray()
+            msg.header.stamp = self.get_clock().now().to_msg()
+            msg.status.append(self.motor_status(dxl_id, health))
+            self.diagnostics_pub.publish(msg)
+        except Exception as e:
+            self.get_logger().error(f"hardware_alert() failed: {e}")
 
     def publish_joint_states(self):
         try:
-            msg = JointState()
+            # Newest synchronized read of every motor
+            frame = self.motor.latest_frame(self.frame)
+            if frame.seq == 0:
+                return
+            # Filtered ticks (see control/filters.py) hold the last good
+            # reading through a missed read, but stop
+            # publishing a joint once its motor has been silent for a while
+            # Aged to now, so frames that stopped coming in count as stale too
+            np.less_equal(frame.ages(time.monotonic(), out=self.ages), STALE_SECONDS, out=self.fresh)
+            if not self.fresh.all():
+                stale = [motor_id for motor_id, ok in zip(MOTOR_IDS, self.fresh) if not ok]
+                self.get_logger().warn(f"Motor ID {stale} not answering, left out of /joint_states",
+                                       throttle_duration_sec=1.0)
+
+            # Velocity and effort come from the same read as the positions
+            # (Present Velocity and Present Current), no second pass on the bus
+            mapping, msg, joint_positions, joint_velocities, joint_efforts = self.mapping
+            mapping.map(frame.filtered_positions, out=joint_positions)
+            mapping.map_velocities(frame.present_velocities, out=joint_velocities)
+            mapping.map_efforts(frame.currents, out=joint_efforts)
+            if not self.fresh.all():
+                mask = mapping.joint_mask(self.fresh)
+                msg = JointState(name=[name for name, ok in zip(mapping.joint_names, mask) if ok],
+                                 position=joint_positions[mask].tolist(), velocity=joint_velocities[mask].tolist(),
+                                 effort=joint_efforts[mask].tolist())
             msg.header.stamp = self.get_clock().now().to_msg()
-
-            joint_names = []
-            positions_rad = []
-
-            TICKS_PER_REV = 4096.0
-            RAD_PER_TICK = 2 * 3.1415926 / TICKS_PER_REV
-            positions_rad = []
-
-            for motor_id in MOTOR_IDS:
-                try:
-                    dxl_position, dxl_comm_result, dxl_error = self.motor.packetHandler.read4ByteTxRx(
-                        self.motor.portHandler, motor_id, ADDR_PRESENT_POSITION
-                    )
-
-                    if dxl_comm_result != 0:
-                        raise Exception(f"Comm failed: {dxl_comm_result}")
-                    if dxl_error != 0:
-                        raise Exception(f"Dynamixel error: {dxl_error}")
-
-                    if dxl_position > 0x7FFFFFFF:
-                        dxl_position -= 0x100000000
-
-                    joint_names_for_motor = self.motor_to_joint.get(motor_id, [])
-                    if joint_names_for_motor is None:
-                        self.get_logger().warn(f"No joint mapping for motor ID {motor_id}")
-                        continue
-
-                    
-                    if isinstance(joint_names_for_motor, str):
-                        joint_names_for_motor = [joint_names_for_motor]
-
-                    # 1. Get encoder min/max
-                    raw_min = self.encoder_limits[str(motor_id)]["min"]
-                    raw_max = self.encoder_limits[str(motor_id)]["max"]
-
-                    # 2. Normalize
-                    clamped = max(raw_min, min(raw_max, dxl_position))
-                    ratio = (clamped - raw_min) / (raw_max - raw_min)
-
-                    # 3. Map to joint angle
-                    # For every joint controlled by this motor
-                    for joint_name in joint_names_for_motor:
-                        # Get joint angle limits
-                        joint_min, joint_max = self.joint_angle_limits[joint_name]
-
-                        # Map normalized value to joint angle range
-                        # Map normalized value to joint angle range
-                        angle = joint_min + ratio * (joint_max - joint_min)
-
-                        # Apply transform if defined
-                        if joint_name in JOINT_TRANSFORMS:
-                            scale, offset = JOINT_TRANSFORMS[joint_name]
-                            angle = angle * scale + offset
-
-                        joint_names.append(joint_name)
-                        positions_rad.append(angle)
-
-                except Exception as motor_error:
-                    self.get_logger().warn(f"Motor ID {motor_id} read failed: {motor_error}")
-                    # Append zero angles for all joints controlled by this motor
-                    joint_names_for_motor = self.motor_to_joint.get(motor_id, [])
-                    if isinstance(joint_names_for_motor, str):
-                        joint_names_for_motor = [joint_names_for_motor]
-                    for joint_name in joint_names_for_motor:
-                        joint_names.append(joint_name)
-                        positions_rad.append(0.0)
-
-
-            msg.name = joint_names
-            msg.position = positions_rad
             self.joint_pub.publish(msg)
+            if self.first_publish:
+                self.first_publish = False
+                self.startup["first publish"] = time.monotonic() - START_TIME
+                report = ", ".join(f"{name} {seconds * 1000:.0f} ms" for name, seconds in self.startup.items())
+                self.get_logger().info(f"Startup: {report}")
 
         except Exception as e:
             self.get_logger().error(f"publish_joint_states() failed: {e}")
 
 
-
+    def destroy_node(self):
+        if self.publish_loop is not None:
+            self.publish_loop.stop()
+        if self.motor is not None:
+            self.motor.stop_acquisition()
+        super().destroy_node()
 
 
 def main(args=None):
@@ -33,35 +33,35 @@ function toggleCalibration() {
     });
 }
 
-// Polling for backend
+// Calibration state pushed by the backend (or polled as a fallback)
+async function applyCalibrationState(data) {
+  const prevState = isCalibrating;
+  isCalibrating = data.running;
+
+  if (prevState !== isCalibrating) {
+    updateButton();
+
+    if (isCalibrating) {
+      startProgressBar(10);
+    } else {
+      resetProgressBar();
+      if (data.calibration) {
+        console.log("good");
+        updateCalibrationData(data.calibration);
+      } else {
+        console.log("bad");
+        // Fallback: reload from JSON file
+        await reloadCalibration();
+      }
+    }
+  }
+}
+
 function pollCalibrationStatus() {
   setInterval(() => {
     fetch("/status")
       .then(res => res.json())
-      .then(async data => {
-        const prevState = isCalibrating;
-        isCalibrating = data.running;
-        //console.log("[JS] /status → isCalibrating =", isCalibrating);
-
-        if (prevState !== isCalibrating) {
-          updateButton();
-
-          if (isCalibrating) {
-            startProgressBar(10);
-          } else {
-            resetProgressBar();
-            //console.log("polling said false");
-            if (data.calibration) {
-              console.log("good");
-              updateCalibrationData(data.calibration);
-            } else {
-              console.log("bad");
-              // Fallback: reload from JSON file
-              await reloadCalibration();
-            }
-          }
-        }
-      });
+      .then(applyCalibrationState);
   }, 500);
 }
 
@@ -86,21 +86,86 @@ function resetProgressBar() {
   progressBar.style.width = "0%";
 }
 
+// Latest encoder values, e.g. { motor_0: 2048, ... }; also read by model.js
+window.encoderValues = null;
+
+function showEncoderValues(data) {
+  window.encoderValues = data;
+  Object.keys(data).forEach((motorId) => {
+    const el = document.getElementById(motorId);  // e.g., "motor_0", "motor_10"
+    if (el) {
+      el.innerText = data[motorId];
+    }
+  });
+}
+
 function pollEncoderValues() {
   setInterval(() => {
     fetch("/encoder_values")
       .then(res => res.json())
-      .then(data => {
-        Object.keys(data).forEach((motorId) => {
-          const el = document.getElementById(motorId);  // e.g., "motor_0", "motor_10"
-          if (el) {
-            el.innerText = data[motorId];
-          }
-        });
-      });
+      .then(showEncoderValues);
   }, 100);
 }
 
+// Grey out a motor that stopped answering; its value is the last one read
+const STALE_MS = 250;
+
+function markStale(elementId, ageMs) {
+  const el = document.getElementById(elementId);
+  if (!el) return;
+  const stale = ageMs === null || ageMs > STALE_MS;
+  el.classList.toggle("stale", stale);
+  el.title = stale ? (ageMs === null ? "no reply yet" : `no reply for ${(ageMs / 1000).toFixed(1)} s`) : "";
+}
+
+// Hardware error status per motor, e.g. { errors: { 10: ["Overload Error"] }, alert: {...} }.
+// `alert` is set when the event comes from a change, not from (re)connecting.
+function showHardwareState(state) {
+  const lines = [];
+  Object.entries(state.errors).forEach(([id, errors]) => {
+    const el = document.getElementById(`motor_${id}`);
+    if (el) el.classList.toggle("hw-error", errors.length > 0);
+    if (errors.length) lines.push(`Motor ${id}: ${errors.join(", ")}`);
+  });
+  document.getElementById("hardware-alerts").innerText = lines.join("\n");
+  const alert = state.alert;
+  if (alert && alert.raised.length) {
+    console.warn(`Motor ${alert.id} hardware error: ${alert.raised.join(", ")}` +
+                 ` (${alert.voltage.toFixed(1)} V, ${alert.temperature} C)`);
+  }
+}
+
+// One server-sent event stream replaces both polls; the browser reconnects
+// on its own if the connection drops
+function openStream() {
+  const source = new EventSource("/stream");
+  let motorIds = [];
+
+  source.addEventListener("hello", (e) => {
+    motorIds = JSON.parse(e.data).ids;
+  });
+  source.addEventListener("encoders", (e) => {
+    const frame = JSON.parse(e.data);
+    const data = {};
+    motorIds.forEach((id, i) => {
+      // Filtered ticks (KIRIGIRISU_FILTER_POSITION) for display, calibration uses raw ones server-side
+      data[`motor_${id}`] = frame.filtered ? frame.filtered[i] : frame.pos[i];
+      markStale(`motor_${id}`, frame.age[i]);
+    });
+    showEncoderValues(data);
+  });
+  source.addEventListener("calibration", (e) => {
+    applyCalibrationState(JSON.parse(e.data));
+  });
+  source.addEventListener("hardware", (e) => {
+    showHardwareState(JSON.parse(e.data));
+  });
+}
+
 // Loops
-pollCalibrationStatus();
-pollEncoderValues();
+if (window.EventSource) {
+  openStream();
+} else {
+  pollCalibrationStatus();
+  pollEncoderValues();
+}
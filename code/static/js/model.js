@@ -68,7 +68,7 @@ window.addEventListener('resize', () => {
 async function loadCalibrationData() {
     try {
         console.log("here");
-        const res = await fetch(`/static/calibration.json`);
+        const res = await fetch(`/calibration-data`);
         console.log("here2");
         calibrationData = await res.json();
         console.log("Loaded calibration:", calibrationData);
@@ -86,7 +86,7 @@ window.updateCalibrationData = updateCalibrationData;
 
 async function reloadCalibration() {
   try {
-    const res = await fetch('/calibration-data', { cache: "no-store" });
+    const res = await fetch('/calibration-data', { cache: "no-cache" });
     if (!res.ok) throw new Error(`HTTP error ${res.status}`);
     const json = await res.json();
     updateCalibrationData(json);
@@ -96,15 +96,9 @@ async function reloadCalibration() {
 }
 window.reloadCalibration = reloadCalibration;
 
-//Periodically fetch encoder values
-async function fetchEncoderValues() {
-    try {
-        const res = await fetch('/encoder_values');
-        return await res.json();  // { motor_1: ..., motor_2: ..., motor_3: ... }
-    } catch (err) {
-        console.error("Failed to fetch encoder values:", err);
-        return null;
-    }
+//Latest encoder values streamed in by calibrate.js
+function fetchEncoderValues() {
+    return window.encoderValues;  // { motor_1: ..., motor_2: ..., motor_3: ... }
 }
 
 function resetBones() {
@@ -137,7 +131,7 @@ async function animate() {
     requestAnimationFrame(animate);
 
     // Fetch encoder values
-    const data = await fetchEncoderValues();
+    const data = fetchEncoderValues();
     if (!data) return;
 
     // Chicken 1
@@ -0,0 +1,87 @@
+from control.dynamixel_port import open_controller, DEFAULT_DEVICE, BIMANUAL_PORT, CURRENT_BASE_POSITION_CONTROL_MODE
+from control.udp_stream import JointStreamSender, JointStreamReceiver
+import argparse
+import os
+import threading
+import time
+
+# Remote puppeteering over UDP: the leader streams raw encoder ticks, the
+# follower drives the same motor IDs to them in current-based position mode.
+#   leader machine:   python teleop.py leader --host <follower ip>
+#   follower machine: python teleop.py follower
+#   one machine:      python teleop.py loopback   (two simulated chains over localhost)
+
+MOTOR_IDS = [0, 1, 2, 10, 11, 12] # Starting from the wrist
+
+
+def run_leader(controller, sender, currents, stop):
+    n = len(controller.dxl_ids)
+    while not stop.is_set():
+        controller.fetch_present_status()
+        sender.send(controller.present_positions[:n], controller.present_currents[:n] if currents else None)
+
+
+def run_follower(controller, receiver, stop, report_every=1.0):
+    applied = 0
+    next_report = time.monotonic() + report_every
+    while not stop.is_set():
+        if receiver.receive(timeout=0.1):
+            controller.set_goal_positions(receiver.positions)
+            applied += 1
+        now = time.monotonic()
+        if now >= next_report:
+            stats = receiver.latency.summary()
+            # latency needs synced clocks; delay doesn't
+            print(f"{applied / report_every:6.1f} Hz  delay {receiver.delay * 1000:.3f} ms  latency p50 {stats['p50'] * 1000:.3f} ms"
+                  f"  p99 {stats['p99'] * 1000:.3f} ms  max {stats['max'] * 1000:.3f} ms"
+                  f"  jitter {stats['jitter'] * 1000:.3f} ms  lost {receiver.lost}"
+                  f"  stale {receiver.stale}  out-of-order {receiver.out_of_order}")
+            applied = 0
+            next_report = now + report_every
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("mode", choices=["leader", "follower", "loopback"])
+    parser.add_argument("--device", default=os.environ.get("KIRIGIRISU_DEVICE", DEFAULT_DEVICE))
+    parser.add_argument("--host", help="leader: follower address (127.0.0.1), follower: bind address (0.0.0.0)")
+    parser.add_argument("--port", type=int, default=BIMANUAL_PORT)
+    parser.add_argument("--currents", action="store_true", help="also stream present currents")
+    parser.add_argument("--max-age", type=float, default=0.05,
+                        help="follower drops packets delayed by more than this (s) beyond the fastest recent one")
+    args = parser.parse_args()
+
+    stop = threading.Event()
+    controllers = []
+    try:
+        if args.mode in ("leader", "loopback"):
+            device = "sim:" if args.mode == "loopback" else args.device
+            leader = open_controller(device, MOTOR_IDS, [])
+            leader.disable_torque(MOTOR_IDS)
+            controllers.append(leader)
+            sender = JointStreamSender(args.host or "127.0.0.1", args.port, len(MOTOR_IDS), args.currents)
+        if args.mode in ("follower", "loopback"):
+            device = "sim:" if args.mode == "loopback" else args.device
+            follower = open_controller(device, MOTOR_IDS, MOTOR_IDS, control_mode=CURRENT_BASE_POSITION_CONTROL_MODE)
+            controllers.append(follower)
+            bind = args.host or ("0.0.0.0" if args.mode == "follower" else "127.0.0.1")
+            receiver = JointStreamReceiver(bind, args.port, len(MOTOR_IDS), args.max_age)
+        if args.mode == "leader":
+            print(f"Streaming {MOTOR_IDS} to {sender.address[0]}:{args.port}")
+            run_leader(leader, sender, args.currents, stop)
+        elif args.mode == "follower":
+            print(f"Following on port {args.port}")
+            run_follower(follower, receiver, stop)
+        else:
+            threading.Thread(target=run_leader, args=(leader, sender, args.currents, stop), daemon=True).start()
+            run_follower(follower, receiver, stop)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stop.set()
+        for controller in controllers:
+            controller.cleanup()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+import asyncio
+import threading
+
+import numpy as np
+import pytest
+
+from control.async_port import AsyncDynamixelPort
+from control.dynamixel_port import ADDR_GOAL_CURRENT, ADDR_GOAL_POSITION, DynamixelPort
+
+MOTOR_IDS = [0, 1, 2]
+
+
+@pytest.fixture
+def port():
+    port = DynamixelPort("sim:", MOTOR_IDS, [], metrics=False)
+    yield port
+    port.cleanup()
+
+
+def count_calls(port, name, gate=None):
+    # Wraps port.<name>; each call is one bus transaction. With `gate`, the
+    # first call blocks until it is set, to hold a transaction in flight.
+    calls = []
+    fn = getattr(port, name)
+
+    def wrapper(*args):
+        calls.append(args)
+        if gate is not None and len(calls) == 1:
+            gate.wait(5)
+        return fn(*args)
+
+    setattr(port, name, wrapper)
+    return calls
+
+
+def test_concurrent_reads_share_one_transaction(port):
+    calls = count_calls(port, "fetch_present_status")
+
+    async def main():
+        aport = AsyncDynamixelPort(port)
+        frames = await asyncio.gather(*(aport.fetch_present_status() for _ in range(10)))
+        aport._executor.shutdown()
+        return aport, frames
+
+    aport, frames = asyncio.run(main())
+    assert len(calls) == 1
+    assert aport.reads == 1 and aport.coalesced_reads == 9
+    assert all(frame is frames[0] for frame in frames)
+    assert frames[0].valid.all()
+
+
+def test_reads_after_completion_start_a_new_transaction(port):
+    calls = count_calls(port, "fetch_present_status")
+
+    async def main():
+        aport = AsyncDynamixelPort(port)
+        first = await aport.fetch_present_status()
+        second = await aport.fetch_present_status()
+        aport._executor.shutdown()
+        return first, second
+
+    first, second = asyncio.run(main())
+    assert len(calls) == 2
+    assert second.seq == first.seq + 1
+
+
+def test_goals_merge_while_a_write_is_pending(port):
+    calls = count_calls(port, "set_goals")
+
+    async def main():
+        aport = AsyncDynamixelPort(port)
+        # None of these has reached the bus when the next one arrives
+        await asyncio.gather(aport.set_goal_positions([10, 20, 30]),
+                             aport.set_goal_currents([5, 6, 7]),
+                             aport.set_goal_positions([11, 21, 31]))
+        aport._executor.shutdown()
+        return aport
+
+    aport = asyncio.run(main())
+    assert len(calls) == 1
+    pos, cur, pwm = calls[0]
+    assert pos.tolist() == [11, 21, 31] and cur.tolist() == [5, 6, 7] and pwm is None
+    assert aport.writes == 1 and aport.coalesced_writes == 2
+
+
+def test_goals_merge_while_a_write_is_in_flight(port):
+    gate = threading.Event()
+    calls = count_calls(port, "set_goals", gate)
+
+    async def main():
+        aport = AsyncDynamixelPort(port)
+        first = asyncio.ensure_future(aport.set_goal_positions([100, 200, 300]))
+        while not calls: # first write is on the bus
+            await asyncio.sleep(0.001)
+        rest = [asyncio.ensure_future(aport.set_goals(pos=[p, p, p], cur=[p, p, p])) for p in (1, 2, 3)]
+        await asyncio.sleep(0.01)
+        gate.set()
+        await asyncio.gather(first, *rest)
+        aport._executor.shutdown()
+        return aport
+
+    aport = asyncio.run(main())
+    assert len(calls) == 2 # the one in flight, then everything queued behind it
+    assert calls[1][0].tolist() == [3, 3, 3] and calls[1][1].tolist() == [3, 3, 3]
+    assert aport.writes == 2
+    port.fetch_present_status() # the sim applies writes as the bus moves on
+    servos = port.portHandler.bus.servos
+    assert [servo.get(ADDR_GOAL_POSITION, 4, signed=True) for servo in servos] == [3, 3, 3]
+    assert [servo.get(ADDR_GOAL_CURRENT, 2, signed=True) for servo in servos] == [3, 3, 3]
+
+
+def test_reads_wait_for_acquisition_frames(port):
+    calls = count_calls(port, "fetch_present_status")
+
+    async def main():
+        aport = AsyncDynamixelPort(port)
+        aport.start_acquisition()
+        frames = await asyncio.gather(*(aport.fetch_present_status() for _ in range(5)))
+        newer = await aport.next_frame(frames[0].seq)
+        aport.stop_acquisition()
+        aport._executor.shutdown()
+        return aport, frames, newer
+
+    aport, frames, newer = asyncio.run(main())
+    assert len({frame.seq for frame in frames}) == 1 # one frame for all of them
+    assert newer.seq > frames[0].seq
+    assert np.array_equal(frames[0].valid, np.ones(len(MOTOR_IDS), bool))
+    assert aport.reads == 0 # no bus reads of its own
+    assert calls # the acquisition thread's
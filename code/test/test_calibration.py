@@ -0,0 +1,61 @@
+import numpy as np
+
+from control.calibration import RangeEstimator
+
+
+def sweep(estimator, positions, valid=None, t0=0.0, dt=0.01):
+    positions = np.asarray(positions)
+    valid = np.ones(positions.shape[1], bool) if valid is None else valid
+    for k, row in enumerate(positions):
+        estimator.update(row, valid, t0 + k * dt)
+    return t0 + len(positions) * dt
+
+
+def test_exact_limits():
+    estimator = RangeEstimator(2)
+    sweep(estimator, [[1000, 50], [1500, -300], [800, 200]])
+    low, high = estimator.limits()
+    assert low.tolist() == [800, -300]
+    assert high.tolist() == [1500, 200]
+    assert estimator.result([10, 11]) == {10: {"min": 800, "max": 1500}, 11: {"min": -300, "max": 200}}
+
+
+def test_percentile_limits_trim_outliers():
+    estimator = RangeEstimator(1, bin_width=8)
+    positions = np.concatenate([np.arange(1000, 2000), [3500, 200]])[:, None]
+    sweep(estimator, positions)
+    low, high = estimator.limits()
+    assert (low[0], high[0]) == (200, 3500)
+    low, high = estimator.limits(percentile=1.0)
+    # within a bin of the 1st/99th percentile of the 1000-tick sweep
+    assert abs(low[0] - 1010) <= 8
+    assert abs(high[0] - 1990) <= 8
+    assert 200 <= low[0] <= high[0] <= 3500
+
+
+def test_percentile_limits_clip_to_exact_range():
+    estimator = RangeEstimator(1, bin_width=64)
+    sweep(estimator, np.arange(1000, 1101)[:, None])
+    low, high = estimator.limits(percentile=0.5)
+    assert low[0] >= 1000 and high[0] <= 1100
+
+
+def test_invalid_samples_ignored():
+    estimator = RangeEstimator(2)
+    valid = np.array([True, False])
+    sweep(estimator, [[100, 9999], [200, -9999]], valid)
+    assert estimator.samples.tolist() == [2, 0]
+    assert estimator.result([0, 1]) == {0: {"min": 100, "max": 200}}
+
+
+def test_converged_after_settle_time():
+    estimator = RangeEstimator(1, min_span=64, settle_time=1.0)
+    t = sweep(estimator, np.arange(0, 500, 5)[:, None])
+    assert not estimator.converged(t)[0]
+    # no new extreme for settle_time
+    t = sweep(estimator, np.full((200, 1), 250), t0=t)
+    assert estimator.converged(t)[0]
+    # too little motion never converges
+    still = RangeEstimator(1, min_span=64, settle_time=1.0)
+    t = sweep(still, np.full((300, 1), 250))
+    assert not still.converged(t)[0]
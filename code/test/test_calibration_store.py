@@ -0,0 +1,117 @@
+import json
+import os
+
+import pytest
+
+from control.calibration_store import CalibrationStore
+
+CALIBRATION = {"0": {"min": 100, "max": 900}, "1": {"min": -50, "max": 4000}}
+
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / "calibration.json")
+
+
+def write_external(path, data):
+    # Another process saving, e.g. web.py while the bridge runs
+    temp_path = path + ".other"
+    with open(temp_path, "w") as f:
+        json.dump(data, f)
+    os.replace(temp_path, path)
+
+
+def test_missing_file(path):
+    store = CalibrationStore(path)
+    assert store.data is None and store.body is None and store.etag is None
+    assert store.version == 0
+    assert not store.refresh()
+
+
+def test_loads_existing_file(path):
+    write_external(path, CALIBRATION)
+    store = CalibrationStore(path)
+    assert store.data == CALIBRATION
+    assert json.loads(store.body) == CALIBRATION
+    assert store.version == 1
+
+
+def test_save_bumps_version_and_etag(path):
+    store = CalibrationStore(path)
+    version = store.save(CALIBRATION)
+    assert version == store.version == 1
+    first_etag = store.etag
+    with open(path, "rb") as f:
+        assert f.read() == store.body
+    assert json.loads(store.body) == CALIBRATION
+    assert not os.path.exists(path + ".tmp")
+
+    changed = dict(CALIBRATION, **{"1": {"min": 0, "max": 10}})
+    assert store.save(changed) == 2
+    assert store.data == changed
+    assert store.etag != first_etag
+    # Saved content decides the ETag, so an unchanged save keeps clients' 304s
+    store.save(CALIBRATION)
+    assert store.version == 3 and store.etag == first_etag
+    assert not store.refresh() # its own write isn't picked up again
+
+
+def test_etag_is_the_same_across_processes(path):
+    first = CalibrationStore(path)
+    first.save(CALIBRATION)
+    second = CalibrationStore(path)
+    assert second.etag == first.etag and second.body == first.body
+
+
+def test_refresh_picks_up_external_write(path):
+    store = CalibrationStore(path)
+    store.save(CALIBRATION)
+    version, etag = store.version, store.etag
+    assert not store.refresh()
+
+    changed = {"0": {"min": 1, "max": 2}}
+    write_external(path, changed)
+    assert store.refresh()
+    assert store.data == changed
+    assert store.version == version + 1
+    assert store.etag != etag
+    assert not store.refresh()
+
+
+def test_refresh_after_delete(path):
+    store = CalibrationStore(path)
+    store.save(CALIBRATION)
+    os.remove(path)
+    assert store.refresh()
+    assert store.data is None and store.etag is None
+    assert store.version == 2
+    assert not store.refresh()
+
+
+def test_refresh_retries_a_half_written_file(path):
+    store = CalibrationStore(path)
+    store.save(CALIBRATION)
+    with open(path, "w") as f: # a writer that doesn't replace atomically
+        f.write('{"0": {"min": 1,')
+    assert not store.refresh()
+    assert store.data == CALIBRATION and store.version == 1
+    with open(path, "w") as f:
+        json.dump({"0": {"min": 1, "max": 2}}, f)
+    assert store.refresh()
+    assert store.data == {"0": {"min": 1, "max": 2}}
+
+
+def test_failed_save_leaves_the_old_file(path, monkeypatch):
+    store = CalibrationStore(path)
+    store.save(CALIBRATION)
+
+    def fail(src, dst):
+        raise OSError("disk full")
+
+    monkeypatch.setattr(os, "replace", fail)
+    with pytest.raises(OSError):
+        store.save({"0": {"min": 1, "max": 2}})
+    monkeypatch.undo()
+    with open(path) as f:
+        assert json.load(f) == CALIBRATION
+    assert store.data == CALIBRATION and store.version == 1
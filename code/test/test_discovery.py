@@ -0,0 +1,89 @@
+import json
+
+import pytest
+
+from control import discovery
+from control.discovery import discover, load_topology
+from control.dynamixel_port import make_port_handler
+from control.sim_bus import DEFAULT_IDS, XC330_T181_MODEL, SimPortHandler, VirtualBus
+
+BAUDRATE = 57600
+MAX_ID = 20 # keeps the broadcast ping short
+
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / "topology.json")
+
+
+def open_bus(ids):
+    bus = VirtualBus.with_ids(ids)
+    port = SimPortHandler("sim:", bus)
+    assert port.openPort() and port.setBaudRate(BAUDRATE)
+    return bus, port
+
+
+def count_broadcasts(monkeypatch):
+    calls = []
+    broadcast_ping = discovery.broadcast_ping
+
+    def wrapper(*args):
+        calls.append(args)
+        return broadcast_ping(*args)
+
+    monkeypatch.setattr(discovery, "broadcast_ping", wrapper)
+    return calls
+
+
+def test_bare_sim_device_has_the_default_ids():
+    assert [servo.dxl_id for servo in make_port_handler("sim:").bus.servos] == DEFAULT_IDS
+    assert [servo.dxl_id for servo in make_port_handler("sim:", [3]).bus.servos] == [3]
+    assert [servo.dxl_id for servo in make_port_handler("sim:4,5", [3]).bus.servos] == [4, 5]
+
+
+def test_scan_then_cache_hit(path, monkeypatch):
+    calls = count_broadcasts(monkeypatch)
+    bus, port = open_bus([1, 2, 10])
+    first = discover(port, "sim:", BAUDRATE, path, max_id=MAX_ID)
+    assert first.source == "scan" and first.ids == [1, 2, 10] and first.changes is None
+    assert first.motors[10] == (XC330_T181_MODEL, 52)
+    with open(path) as f:
+        assert set(json.load(f)["sim:"]["motors"]) == {"1", "2", "10"}
+
+    second = discover(port, "sim:", BAUDRATE, path, max_id=MAX_ID)
+    assert second.source == "cache" and second.motors == first.motors
+    assert len(calls) == 1 # confirmed with a sync read, no second scan
+
+
+def test_cache_is_per_device_and_baudrate(path):
+    _, port = open_bus([1])
+    discover(port, "sim:", BAUDRATE, path, max_id=MAX_ID)
+    assert load_topology("sim:", BAUDRATE, path).ids == [1]
+    assert load_topology("sim:", 1000000, path) is None
+    assert load_topology("/dev/ttyUSB0", BAUDRATE, path) is None
+
+
+def test_changed_chain_rescans_with_diff(path, monkeypatch):
+    calls = count_broadcasts(monkeypatch)
+    bus, port = open_bus([1, 2, 3])
+    discover(port, "sim:", BAUDRATE, path, max_id=MAX_ID)
+    servos = {servo.dxl_id: servo for servo in bus.servos}
+    servos[2].set_offline(True) # unplugged
+    servos[3].ctrl[6] = 53 # re-flashed
+    servos[1].ctrl[7] = 4 # renumbered: 1 missing, 4 added
+
+    topology = discover(port, "sim:", BAUDRATE, path, max_id=MAX_ID)
+    assert topology.source == "scan" and len(calls) == 2
+    assert topology.changes == {"missing": [1, 2], "added": [4], "changed": [3]}
+    assert load_topology("sim:", BAUDRATE, path).ids == [3, 4]
+
+
+def test_added_motor_needs_refresh(path, monkeypatch):
+    calls = count_broadcasts(monkeypatch)
+    _, port = open_bus([1, 2])
+    discover(port, "sim:", BAUDRATE, path, max_id=MAX_ID)
+    _, port = open_bus([1, 2, 5])
+    assert discover(port, "sim:", BAUDRATE, path, max_id=MAX_ID).ids == [1, 2] # still the cache
+    topology = discover(port, "sim:", BAUDRATE, path, refresh=True, max_id=MAX_ID)
+    assert topology.ids == [1, 2, 5] and topology.changes is None
+    assert len(calls) == 2
@@ -0,0 +1,102 @@
+import math
+import os
+import subprocess
+import sys
+
+import numpy as np
+import pytest
+
+from control.filters import RESET_SECONDS, FilterStage, LowPass, OneEuro, make_filter, time_constant
+
+DT = 0.0001 # small against every time constant here, so the discrete filters track the continuous ones
+
+
+def run(f, xs, dt=DT):
+    # Feeds one motor sample by sample -> filtered values
+    step_dt = np.full(1, dt)
+    mask = np.ones(1, bool)
+    f.reset(np.array([xs[0]], float), mask)
+    return np.array([f.step(np.array([x], float), step_dt, mask)[0] for x in xs])
+
+
+@pytest.mark.parametrize("cutoff", [2.0, 10.0, 50.0])
+def test_lowpass_step_response(cutoff):
+    tau = 1 / (2 * math.pi * cutoff)
+    f = LowPass(1, cutoff)
+    assert f.tau == pytest.approx(tau) == pytest.approx(time_constant(cutoff))
+    t = np.arange(int(5 * tau / DT)) * DT
+    y = run(f, np.where(t > 0, 1.0, 0.0))
+    # 1 - 1/e of the step one time constant after it (the step is at t = DT)
+    crossed = t[np.argmax(y >= 1 - 1 / math.e)] - DT
+    assert crossed == pytest.approx(tau, rel=0.02, abs=DT)
+    assert y[-1] == pytest.approx(1 - math.exp(-5), abs=0.005)
+
+
+def test_lowpass_ramp_lag_is_its_latency():
+    f = LowPass(1, 5.0)
+    speed = 1000.0 # ticks/s
+    t = np.arange(int(1.0 / DT)) * DT
+    y = run(f, speed * t)
+    assert (speed * t[-1] - y[-1]) / speed == pytest.approx(f.latency(speed), rel=0.01)
+
+
+def test_oneeuro_lags_less_when_fast():
+    slow, fast = 10.0, 2000.0
+    f = OneEuro(1, min_cutoff=1.0, beta=0.01, d_cutoff=1.0)
+    assert f.latency(0.0) == pytest.approx(time_constant(1.0))
+    assert f.latency(fast) == pytest.approx(time_constant(1.0 + 0.01 * fast))
+    t = np.arange(int(3.0 / DT)) * DT
+    lags = {}
+    for speed in (slow, fast):
+        f = OneEuro(1, min_cutoff=1.0, beta=0.01, d_cutoff=1.0)
+        lags[speed] = (speed * t[-1] - run(f, speed * t)[-1]) / speed
+        assert lags[speed] == pytest.approx(f.latency(speed), rel=0.05)
+    assert lags[fast] < lags[slow] / 10
+
+
+def test_oneeuro_without_beta_is_a_lowpass():
+    t = np.arange(2000) * DT
+    x = np.sin(2 * math.pi * 3 * t)
+    assert run(OneEuro(1, min_cutoff=4.0), x) == pytest.approx(run(LowPass(1, 4.0), x))
+
+
+def test_make_filter():
+    assert make_filter("", 3) is None and make_filter("none", 3) is None
+    f = make_filter("lowpass:10", 3)
+    assert isinstance(f, LowPass) and f.cutoff == 10.0 and len(f.value) == 3
+    f = make_filter("oneeuro:1.5,0.005", 3)
+    assert f.settings() == {"type": "oneeuro", "min_cutoff": 1.5, "beta": 0.005, "d_cutoff": 1.0}
+    assert make_filter("oneeuro", 3).settings()["min_cutoff"] == 1.0
+
+
+@pytest.mark.parametrize("spec", [
+    "median:3", "lowpass", "lowpass:abc", "lowpass:0", "lowpass:-5", "lowpass:inf",
+    "lowpass:10,2", "oneeuro:1,0.005,1,7", "oneeuro:0", "oneeuro:1,-1", "oneeuro:1,0,0",
+])
+def test_bad_specs_are_rejected(spec):
+    with pytest.raises(ValueError):
+        make_filter(spec, 3)
+
+
+def test_specs_from_the_environment():
+    code = "from control.filters import FilterStage; print(FilterStage.from_specs(2).settings()['position']['type'])"
+    env = dict(os.environ, KIRIGIRISU_FILTER_POSITION="oneeuro:1.0,0.005")
+    result = subprocess.run([sys.executable, "-c", code], env=env, capture_output=True, text=True)
+    assert result.returncode == 0 and result.stdout.strip() == "oneeuro"
+    env["KIRIGIRISU_FILTER_CURRENT"] = "lowpass:fast"
+    result = subprocess.run([sys.executable, "-c", code], env=env, capture_output=True, text=True)
+    assert result.returncode != 0 and "bad filter spec 'lowpass:fast'" in result.stderr
+
+
+def test_stage_holds_missed_reads_and_restarts():
+    stage = FilterStage(2, position=LowPass(2, 5.0))
+    valid = np.array([True, True])
+    stage.step(0.0, np.array([100, 100]), np.zeros(2), valid)
+    assert stage.positions.tolist() == [100, 100] # first sample starts from the raw value
+    stage.step(0.01, np.array([200, 200]), np.zeros(2), np.array([True, False]))
+    assert 100 < stage.positions[0] < 200
+    assert stage.positions[1] == 100 # not updated while it doesn't answer
+    assert stage.velocities[0] == pytest.approx(100 / 0.01)
+    stage.step(0.01 + RESET_SECONDS + 0.1, np.array([300, 300]), np.zeros(2), valid)
+    assert stage.positions.tolist() == [300, 300] # back after a long gap: no smoothing across it
+    assert stage.velocities.tolist() == [0, 0]
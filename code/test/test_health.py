@@ -0,0 +1,128 @@
+import time
+
+import numpy as np
+import pytest
+
+from control.dynamixel_port import READ_MODE_BULK, READ_MODE_FAST, READ_MODE_SYNC, DynamixelPort
+from control.health import FAILING, OFFLINE, ONLINE, MotorHealth
+
+MOTOR_IDS = [0, 1, 2, 10, 11, 12]
+RECOVERY_SECONDS = 0.5 # BACKOFF_MIN plus the setup writes, with margin
+
+
+def test_offline_after_consecutive_failures():
+    health = MotorHealth([1, 2, 3], offline_after=3)
+    valid = np.array([True, False, True])
+    attempted = np.ones(3, bool)
+    assert not health.update(0.0, valid, attempted)
+    assert health.state.tolist() == [ONLINE, FAILING, ONLINE]
+    assert not health.update(0.1, valid, attempted)
+    assert health.update(0.2, valid, attempted)
+    assert health.state[1] == OFFLINE
+    assert health.active.tolist() == [True, False, True]
+    assert health.offline_count == 1
+    assert health.last_ok.tolist() == [0.2, -np.inf, 0.2]
+
+
+def test_unattempted_motors_not_blamed():
+    health = MotorHealth([1, 2, 3], offline_after=2)
+    valid = np.array([True, False, False])
+    attempted = np.array([True, True, False]) # the chain stalled behind motor 2
+    health.update(0.0, valid, attempted)
+    health.update(0.1, valid, attempted)
+    assert health.state.tolist() == [ONLINE, OFFLINE, ONLINE]
+    assert health.failures[2] == 0
+
+
+def test_failure_streak_resets_on_success():
+    health = MotorHealth([1], offline_after=3)
+    attempted = np.ones(1, bool)
+    health.update(0.0, np.array([False]), attempted)
+    health.update(0.1, np.array([False]), attempted)
+    health.update(0.2, np.array([True]), attempted)
+    assert health.state[0] == ONLINE and health.failures[0] == 0
+    assert not health.update(0.3, np.array([False]), attempted)
+    assert health.total_failures[0] == 3
+
+
+def test_probe_backoff_and_recovery():
+    health = MotorHealth([1, 2], backoff_min=0.1, backoff_max=0.5)
+    health.set_offline(1, 10.0)
+    assert health.next_due(10.05) is None
+    assert health.next_due(10.1) == 1
+    now = 10.1
+    for expected in (0.2, 0.4, 0.5, 0.5):
+        health.probe_failed(1, now)
+        assert health.backoff[1] == pytest.approx(expected)
+        assert health.next_due(now + expected - 0.01) is None
+        now += expected
+        assert health.next_due(now) == 1
+    health.recovered(1, now)
+    assert health.state[1] == ONLINE and health.active[1]
+    assert health.offline_count == 0 and health.recoveries[1] == 1
+    assert health.next_due(now + 10) is None
+    # Going offline again starts from the shortest backoff
+    health.set_offline(1, now)
+    assert health.backoff[1] == pytest.approx(0.1)
+
+
+def test_summary():
+    health = MotorHealth([7, 8])
+    health.update(1.0, np.array([True, False]), np.ones(2, bool))
+    summary = health.summary(1.5)
+    assert summary[7] == {"state": "online", "failures": 0, "recoveries": 0, "age": 0.5}
+    assert summary[8] == {"state": "failing", "failures": 1, "recoveries": 0, "age": None}
+
+
+@pytest.mark.parametrize("read_mode", [READ_MODE_SYNC, READ_MODE_FAST, READ_MODE_BULK])
+def test_sim_dropout_recovery(read_mode):
+    port = DynamixelPort("sim:", MOTOR_IDS, [], read_mode=read_mode, metrics=False)
+    try:
+        assert port.read_mode == read_mode
+        assert port.fetch_present_status()
+        servo = port.portHandler.bus.servos[1]
+        servo.set_offline(True)
+        deadline = time.monotonic() + 2.0
+        while port.health.active[1]:
+            assert time.monotonic() < deadline, "motor never went offline"
+            port.fetch_present_status()
+        # The rest of the chain keeps reading without it
+        port.fetch_present_status()
+        valid = port.present_valid[:len(MOTOR_IDS)]
+        assert not valid[1] and valid[[0, 2, 3, 4, 5]].all()
+
+        servo.set_offline(False)
+        start = time.monotonic()
+        while not port.fetch_present_status():
+            assert time.monotonic() - start < RECOVERY_SECONDS, f"{read_mode}: no recovery"
+        assert port.health.state[1] == ONLINE
+        assert port.health.recoveries[1] == 1
+        assert port.read_mode == read_mode
+    finally:
+        port.cleanup()
+
+
+def test_hardware_error_alerts_once():
+    port = DynamixelPort("sim:", MOTOR_IDS, [], metrics=False)
+    try:
+        alerts = []
+        port.add_hardware_listener(alerts.append)
+        port.hardware.every = 10
+        for _ in range(20):
+            port.fetch_present_status()
+        assert alerts == [] and port.hardware.checked.all()
+
+        servo = port.portHandler.bus.servos[MOTOR_IDS.index(11)]
+        servo.ctrl[70] = 0x10 # overload
+        for _ in range(50):
+            port.fetch_present_status()
+        assert len(alerts) == 1 # edge-triggered: not once per poll
+        assert alerts[0]["id"] == 11 and alerts[0]["raised"] == ["Overload Error"] and alerts[0]["cleared"] == []
+        assert port.motor_health()[11]["hardware_errors"] == ["Overload Error"]
+
+        servo.ctrl[70] = 0 # rebooted
+        for _ in range(50):
+            port.fetch_present_status()
+        assert len(alerts) == 2 and alerts[1]["cleared"] == ["Overload Error"]
+    finally:
+        port.cleanup()
@@ -0,0 +1,178 @@
+import math
+
+import numpy as np
+import pytest
+
+from control.joint_mapping import JOINT_TRANSFORMS, MOTOR_TO_JOINT, TICKS_PER_REV, TORQUE_CONSTANT, JointMapping
+
+MOTOR_IDS = [0, 1, 2, 10, 11, 12]
+CALIBRATION = {
+    "0": {"min": 3992, "max": 4747}, # multi-turn, past 4096
+    "1": {"min": 1200, "max": 2900},
+    "2": {"min": 2000, "max": 2400},
+    "10": {"min": -200, "max": 200}, # across the 0/4095 wrap
+    "11": {"min": 1000, "max": 3000},
+    "12": {"min": 1800, "max": 2300},
+}
+JOINT_LIMITS = {
+    "left_rev6": (-1.5, 1.5), "left_rev7": (-0.8, 2.2),
+    "left_left_pris1": (0.0, 0.04), "left_right_pris2": (0.0, 0.04),
+    "right_rev6": (-1.5, 1.5), "right_rev7": (-2.2, 0.8),
+    "right_left_pris1": (0.0, 0.04), "right_right_pris2": (0.0, 0.04),
+}
+
+
+def reference(motor_id, ticks, joint_name, calibration=CALIBRATION):
+    # The per-motor loop the bridge used before JointMapping
+    raw_min, raw_max = calibration[str(motor_id)]["min"], calibration[str(motor_id)]["max"]
+    clamped = max(raw_min, min(raw_max, ticks))
+    ratio = (clamped - raw_min) / (raw_max - raw_min)
+    joint_min, joint_max = JOINT_LIMITS[joint_name]
+    angle = joint_min + ratio * (joint_max - joint_min)
+    if joint_name in JOINT_TRANSFORMS:
+        scale, offset = JOINT_TRANSFORMS[joint_name]
+        angle = angle * scale + offset
+    return angle
+
+
+def expected(positions):
+    return [reference(motor_id, positions[MOTOR_IDS.index(motor_id)], name)
+            for motor_id in MOTOR_IDS
+            for name in ([MOTOR_TO_JOINT[motor_id]] if isinstance(MOTOR_TO_JOINT[motor_id], str) else MOTOR_TO_JOINT[motor_id])]
+
+
+@pytest.fixture
+def mapping():
+    return JointMapping(MOTOR_IDS, CALIBRATION, JOINT_LIMITS)
+
+
+def test_matches_per_motor_formula(mapping):
+    rng = np.random.default_rng(0)
+    for _ in range(50):
+        positions = np.array([rng.integers(3992, 4748), rng.integers(1000, 3100), rng.integers(1900, 2500),
+                              rng.integers(-200, 201), rng.integers(900, 3100), rng.integers(1700, 2400)], np.int32)
+        assert mapping.map(positions) == pytest.approx(expected(positions))
+
+
+def test_clamps_to_calibrated_range(mapping):
+    # just outside each range, less than half a turn away so unwrap leaves them
+    low = mapping.map(np.array([3900, 1100, 1900, -300, 900, 1700], np.int32))
+    high = mapping.map(np.array([4800, 3000, 2500, 300, 3100, 2400], np.int32))
+    assert low == pytest.approx(expected([3992, 1200, 2000, -200, 1000, 1800]))
+    assert high == pytest.approx(expected([4747, 2900, 2400, 200, 3000, 2300]))
+
+
+def test_duplicated_gripper_joints(mapping):
+    assert mapping.joint_names == ["left_rev6", "left_rev7", "left_left_pris1", "left_right_pris2",
+                                   "right_rev6", "right_rev7", "right_left_pris1", "right_right_pris2"]
+    assert mapping.index.tolist() == [0, 1, 2, 2, 3, 4, 5, 5]
+    angles = dict(zip(mapping.joint_names, mapping.map(np.array([4000, 2000, 2200, 0, 2000, 2050], np.int32))))
+    # one motor, two fingers with their own transforms
+    assert angles["left_left_pris1"] == pytest.approx(0.02)
+    assert angles["left_right_pris2"] == pytest.approx(-0.02)
+    assert angles["right_left_pris1"] == pytest.approx(-0.02 - 0.05)
+    assert angles["right_right_pris2"] == pytest.approx(0.02 + 0.05)
+    assert mapping.joint_mask(np.array([True, True, False, True, True, True])).tolist() == [
+        True, True, False, False, True, True, True, True]
+
+
+def test_multi_turn_unwrap(mapping):
+    # After a power cycle the turn count restarts: 4196 reads as 100
+    base = np.array([4196, 2000, 2200, 0, 2000, 2050], np.int32)
+    for shift in (-TICKS_PER_REV, TICKS_PER_REV, 2 * TICKS_PER_REV):
+        shifted = base.copy()
+        shifted[0] += shift
+        assert mapping.map(shifted)[0] == pytest.approx(mapping.map(base)[0])
+    assert mapping.map(base)[0] == pytest.approx(reference(0, 4196, "left_rev6"))
+
+
+def test_unwrap_across_zero(mapping):
+    # A range around 0: 4000 is -96, not clamped to the top of the range
+    positions = np.array([4000, 2000, 2200, 4000, 2000, 2050], np.int32)
+    assert mapping.map(positions)[4] == pytest.approx(reference(10, -96, "right_rev6"))
+    positions[3] = 100 - TICKS_PER_REV
+    assert mapping.map(positions)[4] == pytest.approx(reference(10, 100, "right_rev6"))
+
+
+def test_wide_ranges_are_not_unwrapped():
+    calibration = dict(CALIBRATION, **{"1": {"min": 0, "max": 5000}})
+    mapping = JointMapping(MOTOR_IDS, calibration, JOINT_LIMITS)
+    positions = np.array([4000, 4500, 2200, 0, 2000, 2050], np.int32)
+    assert mapping.map(positions)[1] == pytest.approx(reference(1, 4500, "left_rev7", calibration))
+
+
+def test_reversed_range_keeps_joint_min():
+    # The old loop clamped everything to min here, so the joint sat at joint_min
+    calibration = dict(CALIBRATION, **{"1": {"min": 2900, "max": 1200}, "11": {"min": 2000, "max": 2000}})
+    mapping = JointMapping(MOTOR_IDS, calibration, JOINT_LIMITS)
+    for ticks in (0, 1200, 2000, 2900, 4000):
+        angles = mapping.map(np.array([4000, ticks, 2200, 0, ticks, 2050], np.int32))
+        assert angles[1] == pytest.approx(-0.8)
+        assert angles[5] == pytest.approx(-2.2)
+    assert np.isfinite(mapping.effort_gain).all()
+
+
+def test_skips_unmapped_joints():
+    calibration = {key: value for key, value in CALIBRATION.items() if key != "11"}
+    limits = {key: value for key, value in JOINT_LIMITS.items() if key != "left_rev7"}
+    mapping = JointMapping(MOTOR_IDS + [99], calibration, limits)
+    assert set(mapping.skipped) == {"left_rev7", "right_rev7", "motor 99"}
+    assert len(mapping.map(np.zeros(7, np.int32))) == 6
+
+
+def test_out_and_input_dtypes(mapping):
+    positions = [4000, 2000, 2200, 0, 2000, 2050]
+    out = np.empty(len(mapping.joint_names))
+    assert mapping.map(np.array(positions, np.int32), out=out) is out
+    assert mapping.map(np.array(positions, np.int64)) == pytest.approx(out)
+    assert mapping.map(np.array(positions, np.float64)) == pytest.approx(out)
+
+
+def test_velocity_and_effort_of_a_direct_joint():
+    # A quarter turn of ticks over a quarter turn of joint: one joint radian per motor radian
+    mapping = JointMapping([1], {"1": {"min": 0, "max": 1024}}, {"left_rev7": (0.0, math.pi / 2)})
+    # 100 x 0.229 rev/min
+    assert mapping.map_velocities(np.array([100], np.int32))[0] == pytest.approx(22.9 * 2 * math.pi / 60)
+    # 500 mA
+    assert mapping.map_efforts(np.array([500], np.int16))[0] == pytest.approx(0.5 * TORQUE_CONSTANT)
+    assert mapping.map_efforts(np.array([-500], np.int16))[0] == pytest.approx(-0.5 * TORQUE_CONSTANT)
+
+
+def test_velocity_and_effort_scale_with_the_gear_ratio():
+    # Twice the joint range over the same ticks: twice the speed, half the torque
+    mapping = JointMapping([1], {"1": {"min": 0, "max": 1024}}, {"left_rev7": (0.0, math.pi)})
+    assert mapping.map_velocities(np.array([100], np.int32))[0] == pytest.approx(2 * 22.9 * 2 * math.pi / 60)
+    assert mapping.map_efforts(np.array([500], np.int16))[0] == pytest.approx(0.25 * TORQUE_CONSTANT)
+
+
+def test_gripper_velocity_and_force(mapping):
+    # Motor 2 spans 400 ticks for 0.04 m: 1e-4 m per tick, both fingers
+    velocities = np.zeros(6, np.int32)
+    velocities[2] = 10
+    currents = np.zeros(6, np.int16)
+    currents[2] = 300
+    ticks_per_s = 10 * 0.229 * TICKS_PER_REV / 60
+    metres_per_radian = 1e-4 * TICKS_PER_REV / (2 * math.pi)
+    speed = dict(zip(mapping.joint_names, mapping.map_velocities(velocities)))
+    force = dict(zip(mapping.joint_names, mapping.map_efforts(currents)))
+    assert speed["left_left_pris1"] == pytest.approx(ticks_per_s * 1e-4) # m/s
+    assert speed["left_right_pris2"] == pytest.approx(-ticks_per_s * 1e-4) # mirrored finger
+    assert force["left_left_pris1"] == pytest.approx(0.3 * TORQUE_CONSTANT / metres_per_radian) # N
+    assert force["left_right_pris2"] == pytest.approx(-0.3 * TORQUE_CONSTANT / metres_per_radian)
+    assert speed["right_left_pris1"] == speed["right_right_pris2"] == 0.0
+
+
+def test_velocity_and_effort_follow_transforms(mapping):
+    velocities = np.full(6, 50, np.int32)
+    currents = np.full(6, 200, np.int16)
+    speed = dict(zip(mapping.joint_names, mapping.map_velocities(velocities)))
+    effort = dict(zip(mapping.joint_names, mapping.map_efforts(currents)))
+    # left_rev6: 3 rad over motor 0's 755 ticks, inverted
+    gain = -3.0 / 755
+    assert speed["left_rev6"] == pytest.approx(50 * 0.229 * TICKS_PER_REV / 60 * gain)
+    assert effort["left_rev6"] == pytest.approx(0.2 * TORQUE_CONSTANT / (gain * TICKS_PER_REV / (2 * math.pi)))
+    # the offsets of the right fingers don't move anything
+    assert speed["right_left_pris1"] == pytest.approx(-speed["right_right_pris2"])
+    out = np.empty(len(mapping.joint_names))
+    assert mapping.map_velocities(velocities.astype(np.int64), out=out) is out
+    assert out == pytest.approx(list(speed.values()))
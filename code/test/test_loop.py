@@ -0,0 +1,81 @@
+import pytest
+
+from control import loop
+from control.loop import LoopRunner
+
+
+class FakeClock:
+    # Stands in for the time module: sleep() and the steps advance `now`
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(loop, "time", clock)
+    return clock
+
+
+def run_steps(clock, durations, period=1.0):
+    starts = []
+
+    def step():
+        starts.append(clock.now)
+        clock.now += durations[len(starts) - 1]
+        return len(starts) < len(durations)
+
+    runner = LoopRunner(step, period)
+    runner.run()
+    return runner.stats, starts
+
+
+def test_on_time_steps(clock):
+    stats, starts = run_steps(clock, [0.25] * 5)
+    assert starts == [0.0, 1.0, 2.0, 3.0, 4.0]
+    assert stats.overruns == stats.skipped == 0
+    assert clock.sleeps == [0.75] * 4
+    assert stats.lateness.count == 4 and stats.lateness.max == 0
+
+
+def test_slow_steps_count_overruns_and_skips(clock):
+    stats, starts = run_steps(clock, [0.25, 2.5, 0.25, 1.5, 0.25, 3.25, 0.25, 0.25, 0.25])
+    # 2.5 s ends half a period past the 2nd deadline: that one is skipped
+    # and the next step starts right away; 1.5 s only overruns. Every sleep
+    # still wakes on the original whole-second grid, so nothing drifts.
+    assert starts == [0.0, 1.0, 3.5, 4.0, 5.5, 6.0, 9.25, 10.0, 11.0]
+    assert stats.overruns == 3
+    assert stats.skipped == 1 + 0 + 2
+    assert stats.steps == 8 # the last one returned False
+    assert stats.lateness.max == 0
+
+
+def test_period_zero_runs_back_to_back(clock):
+    stats, starts = run_steps(clock, [0.5, 2.0, 0.5], period=0.0)
+    assert starts == [0.0, 0.5, 2.5]
+    assert clock.sleeps == [] and stats.overruns == stats.skipped == 0
+
+
+def test_failing_step_is_counted(clock, monkeypatch, capsys):
+    monkeypatch.setattr(loop, "ERROR_BACKOFF", 0.0)
+    calls = []
+
+    def step():
+        calls.append(clock.now)
+        if len(calls) <= 2:
+            raise OSError("port gone")
+        return False
+
+    runner = LoopRunner(step, 1.0, name="test")
+    runner.run()
+    assert runner.stats.errors == 2 and runner.stats.steps == 0
+    assert runner.stats.last_error == "OSError: port gone"
+    assert capsys.readouterr().err.count("[test] step failed") == 1 # rate limited
@@ -0,0 +1,78 @@
+import threading
+import time
+
+import numpy as np
+import pytest
+
+from control.metrics import SUB_BUCKETS, BusMetrics, Histogram
+
+ERROR = 1 / SUB_BUCKETS # relative width of a bucket above SUB_BUCKETS us
+
+
+def test_buckets_cover_every_value():
+    for us in list(range(200)) + [1000, 4095, 4096, 123456, 10**9]:
+        index = Histogram.index(us)
+        assert Histogram.lower_bound(index) <= us < Histogram.lower_bound(index + 1)
+        assert Histogram.lower_bound(index + 1) - Histogram.lower_bound(index) <= max(1, us * ERROR)
+
+
+def test_percentiles_within_bucket_error():
+    histogram = Histogram()
+    values = np.arange(1, 10001) # us
+    for us in np.random.default_rng(0).permutation(values):
+        histogram.record(us / 1e6)
+    assert histogram.count == len(values) and histogram.max == 10000
+    for q in (50, 90, 99):
+        exact = np.percentile(values, q, method="inverted_cdf")
+        # the upper edge of the bucket holding it
+        assert exact <= histogram.percentile(q) <= exact * (1 + ERROR)
+    summary = histogram.summary()
+    assert summary["mean"] == pytest.approx(5.0005, rel=1e-3)
+    assert summary["max"] == 10.0
+
+
+def test_small_values_are_exact():
+    histogram = Histogram()
+    for us in (3, 3, 3, 7):
+        histogram.record(us / 1e6 + 1e-9)
+    assert histogram.percentile(50) == 3 and histogram.percentile(99) == 7
+
+
+def test_percentile_never_exceeds_max():
+    histogram = Histogram()
+    histogram.record(0.001)
+    assert histogram.percentile(99) == 1000
+    assert Histogram().summary() == {"count": 0}
+
+
+def test_lock_wait_is_kept_apart_from_bus_time():
+    metrics = BusMetrics()
+    lock = threading.Lock()
+    lock.acquire()
+    threading.Timer(0.05, lock.release).start() # someone else's transaction
+    with metrics.transaction("fetch_present_status", lock):
+        time.sleep(0.01)
+    stats = metrics.op("fetch_present_status")
+    assert stats.lock_wait.count == stats.bus.count == 1
+    assert 40_000 <= stats.lock_wait.max < 200_000 # us
+    assert 10_000 <= stats.bus.max < 40_000
+    assert not lock.locked()
+
+    with metrics.transaction("fetch_present_status", lock):
+        pass
+    snapshot = metrics.snapshot()["ops"]["fetch_present_status"]
+    assert snapshot["lock_wait_ms"]["count"] == snapshot["bus_ms"]["count"] == 2
+    assert snapshot["errors"] == 0 and "wire_ms" not in snapshot
+
+
+def test_failed_reads_and_children():
+    metrics = BusMetrics()
+    metrics.record_reads([0, 1, 2], np.array([True, False, True]))
+    metrics.record_reads([0, 1, 2], np.array([False, False, True]))
+    metrics.error("set_goals")
+    child = metrics.children["sim:"] = BusMetrics()
+    child.record_skew(0.002)
+    snapshot = metrics.snapshot()
+    assert snapshot["failed_reads"] == {0: 1, 1: 2}
+    assert snapshot["ops"]["set_goals"]["errors"] == 1
+    assert snapshot["buses"]["sim:"]["skew_ms"]["count"] == 1
@@ -0,0 +1,66 @@
+import pytest
+
+from control.dynamixel_port import ADDR_GOAL_POSITION, DynamixelError, DynamixelPort, open_controller
+from control.multi_bus import MultiBusPort, parse_bus_spec
+from control.sim_bus import SimPortHandler
+
+DEVICE = "sim:0,1,2;sim:10,11,12"
+MOTOR_IDS = [10, 0, 11, 1, 12, 2] # interleaved across the two buses
+
+
+def servos_by_id(port):
+    return {servo.dxl_id: servo for bus_port in port.ports for servo in bus_port.portHandler.bus.servos}
+
+
+def test_parse_bus_spec():
+    assert parse_bus_spec(DEVICE) == [("sim:0,1,2", [0, 1, 2]), ("sim:10,11,12", [10, 11, 12])]
+    assert parse_bus_spec("/dev/ttyUSB0@0,1;/dev/ttyUSB1@10") == [("/dev/ttyUSB0", [0, 1]), ("/dev/ttyUSB1", [10])]
+    with pytest.raises(ValueError):
+        parse_bus_spec("/dev/ttyUSB0;/dev/ttyUSB1@10")
+
+
+def test_ids_keep_their_order():
+    port = open_controller(DEVICE, MOTOR_IDS, [], metrics=False)
+    try:
+        assert isinstance(port, MultiBusPort) and len(port.ports) == 2
+        servos = servos_by_id(port)
+        for dxl_id, servo in servos.items():
+            servo.home, servo.amplitude = 1000 + 10 * dxl_id, 0.0 # holds still at its own position
+        assert port.fetch_present_status()
+        assert port.present_positions[:len(MOTOR_IDS)].tolist() == [1000 + 10 * dxl_id for dxl_id in MOTOR_IDS]
+        assert port.present_valid[:len(MOTOR_IDS)].all()
+
+        port.set_goal_positions([2000 + dxl_id for dxl_id in MOTOR_IDS])
+        port.fetch_present_status() # the sim applies writes as the bus moves on
+        assert {dxl_id: servo.get(ADDR_GOAL_POSITION, 4) for dxl_id, servo in servos.items()} == {
+            dxl_id: 2000 + dxl_id for dxl_id in MOTOR_IDS}
+    finally:
+        port.cleanup()
+
+
+def test_unplaced_ids_are_rejected():
+    with pytest.raises(ValueError):
+        open_controller(DEVICE, MOTOR_IDS + [20], [], metrics=False)
+
+
+def test_later_bus_failing_closes_the_earlier_ones(monkeypatch):
+    cleaned = []
+    cleanup = DynamixelPort.cleanup
+
+    def record(self):
+        cleaned.append(self)
+        cleanup(self)
+
+    def setup_port(self, cflag_baud, setup_port=SimPortHandler.setupPort):
+        # the second adapter can't be opened
+        return self.port_name != "sim:10,11,12" and setup_port(self, cflag_baud)
+
+    monkeypatch.setattr(DynamixelPort, "cleanup", record)
+    monkeypatch.setattr(SimPortHandler, "setupPort", setup_port)
+    with pytest.raises(DynamixelError):
+        open_controller(DEVICE, MOTOR_IDS, [0], metrics=False)
+    assert len(cleaned) == 1
+    first = cleaned[0]
+    assert first.dxl_ids == [0, 1, 2]
+    assert not first.portHandler.is_open
+    assert all(servo.get(64, 1) == 0 for servo in first.portHandler.bus.servos) # torque off again
@@ -0,0 +1,36 @@
+from control.protocol2 import INST_PING, INST_SYNC_WRITE, build_packet, crc16, parse_packets, stuff, unstuff
+
+
+def test_crc16_matches_manual_ping():
+    # Ping to ID 1 from the Protocol 2.0 e-manual: FF FF FD 00 01 03 00 01 19 4E
+    packet = build_packet(1, INST_PING)
+    assert packet == bytes.fromhex("ff ff fd 00 01 03 00 01 19 4e")
+    assert crc16(packet[:-2]) == 0x4E19
+
+
+def test_crc16_range_and_continuation():
+    data = bytes(range(40))
+    assert crc16(data, 0, 5, 30) == crc16(data[5:30])
+    assert crc16(data[10:], crc16(data[:10])) == crc16(data)
+
+
+def test_stuffing_round_trip():
+    for body in (b"", b"\x01\x02", b"\xff\xff\xfd", b"\x03\xff\xff\xfd\xff\xff\xfd\x00", b"\xff\xff\xfd\xfd"):
+        assert unstuff(stuff(body)) == body
+    assert stuff(b"\x03\xff\xff\xfd\x00") == b"\x03\xff\xff\xfd\xfd\x00"
+
+
+def test_parse_packets_unstuffs_params():
+    params = b"\x74\x00\xff\xff\xfd\x00"
+    buffer = bytearray(b"\x00\x42" + build_packet(3, INST_SYNC_WRITE, params) + build_packet(4, INST_PING))
+    packets = parse_packets(buffer)
+    assert [(dxl_id, inst, bytes(p), ok) for dxl_id, inst, p, ok in packets] == [
+        (3, INST_SYNC_WRITE, params, True), (4, INST_PING, b"", True)]
+    assert not buffer
+
+
+def test_parse_packets_flags_bad_crc():
+    packet = bytearray(build_packet(1, INST_PING))
+    packet[-1] ^= 0xFF
+    (_, _, _, crc_ok), = parse_packets(packet)
+    assert not crc_ok
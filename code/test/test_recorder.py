@@ -0,0 +1,77 @@
+import json
+
+import numpy as np
+import pytest
+
+from control.recorder import _PREFIX, FORMAT_VERSION, MAGIC, PAGE, Recorder, frame_dtype, open_log, read_header
+
+MOTOR_IDS = [0, 1, 2]
+FRAMES = 50
+
+
+def make_frames(version):
+    frames = np.zeros(FRAMES, frame_dtype(len(MOTOR_IDS), version))
+    frames["timestamp"] = 100.0 + np.arange(FRAMES) * 0.01
+    frames["seq"] = np.arange(1, FRAMES + 1)
+    frames["positions"] = np.arange(FRAMES)[:, None] * 3 + [1000, -2000, 70000]
+    frames["currents"] = np.arange(FRAMES)[:, None] - [10, 20, 30]
+    frames["valid"] = 1
+    frames["valid"][7, 1] = 0
+    if version >= 2:
+        frames["velocities"] = np.arange(FRAMES)[:, None] * [1, -1, 2]
+    return frames
+
+
+def write_v1_log(path, frames):
+    # As written before present velocity was recorded
+    meta = json.dumps({"motor_ids": MOTOR_IDS, "calibration": None, "dtype": frames.dtype.descr}).encode()
+    header_size = PAGE
+    with open(path, "wb") as f:
+        f.write(_PREFIX.pack(MAGIC, 1, header_size, len(frames), len(meta)) + meta)
+        f.write(bytes(header_size - _PREFIX.size - len(meta)))
+        f.write(frames.tobytes())
+
+
+def test_round_trip_current_version(tmp_path):
+    path = str(tmp_path / "session.kirilog")
+    frames = make_frames(FORMAT_VERSION)
+    with Recorder(path, MOTOR_IDS, calibration={"0": {"min": 1, "max": 2}}, note="test") as recorder:
+        for f in frames:
+            recorder.append(f["timestamp"], f["seq"], f["positions"], f["currents"], f["valid"], f["velocities"])
+    metadata, logged = open_log(path)
+    assert metadata["version"] == FORMAT_VERSION
+    assert metadata["count"] == FRAMES
+    assert metadata["motor_ids"] == MOTOR_IDS
+    assert metadata["note"] == "test"
+    assert metadata["calibration"] == {"0": {"min": 1, "max": 2}}
+    assert np.array_equal(np.asarray(logged), frames)
+
+
+def test_round_trip_version_1(tmp_path):
+    path = str(tmp_path / "old.kirilog")
+    frames = make_frames(1)
+    write_v1_log(path, frames)
+    metadata, logged = open_log(path)
+    assert metadata["version"] == 1
+    assert "velocities" not in logged.dtype.names
+    assert np.array_equal(np.asarray(logged), frames)
+
+
+def test_grows_past_one_chunk(tmp_path, monkeypatch):
+    monkeypatch.setattr("control.recorder.GROW_FRAMES", 16)
+    path = str(tmp_path / "long.kirilog")
+    frames = make_frames(FORMAT_VERSION)
+    with Recorder(path, MOTOR_IDS) as recorder:
+        for f in frames:
+            recorder.append(f["timestamp"], f["seq"], f["positions"], f["currents"], f["valid"], f["velocities"])
+    metadata, logged = open_log(path)
+    assert metadata["count"] == FRAMES
+    assert np.array_equal(np.asarray(logged), frames)
+
+
+def test_rejects_unknown_version(tmp_path):
+    path = str(tmp_path / "future.kirilog")
+    with open(path, "wb") as f:
+        f.write(_PREFIX.pack(MAGIC, FORMAT_VERSION + 1, PAGE, 0, 2) + b"{}")
+    with pytest.raises(ValueError, match="unsupported log version"):
+        read_header(path)
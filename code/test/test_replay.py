@@ -0,0 +1,69 @@
+import numpy as np
+
+from control.recorder import FORMAT_VERSION, Recorder
+from control.replay import ReplayPort
+from test_recorder import FRAMES, MOTOR_IDS, make_frames, write_v1_log
+
+
+def record(path, frames):
+    with Recorder(path, MOTOR_IDS) as recorder:
+        for f in frames:
+            recorder.append(f["timestamp"], f["seq"], f["positions"], f["currents"], f["valid"], f["velocities"])
+
+
+def replay_all(path, dxl_ids=None):
+    port = ReplayPort(path, dxl_ids, speed=0.0)
+    n = len(port.dxl_ids)
+    rows = []
+    while True:
+        port.fetch_present_status()
+        if port.finished:
+            return port, rows
+        rows.append((port.present_positions[:n].copy(), port.present_currents[:n].copy(),
+                     port.present_velocities[:n].copy(), port.present_valid[:n].copy()))
+
+
+def test_replays_every_frame(tmp_path):
+    path = str(tmp_path / "session.kirilog")
+    frames = make_frames(FORMAT_VERSION)
+    record(path, frames)
+    port, rows = replay_all(path)
+    assert len(rows) == FRAMES
+    for f, (positions, currents, velocities, valid) in zip(frames, rows):
+        assert np.array_equal(positions, f["positions"])
+        assert np.array_equal(currents, f["currents"])
+        assert np.array_equal(velocities, f["velocities"])
+        assert np.array_equal(valid, f["valid"].astype(bool))
+
+
+def test_replays_version_1(tmp_path):
+    path = str(tmp_path / "old.kirilog")
+    frames = make_frames(1)
+    write_v1_log(path, frames)
+    port, rows = replay_all(path)
+    assert len(rows) == FRAMES
+    for f, (positions, currents, velocities, valid) in zip(frames, rows):
+        assert np.array_equal(positions, f["positions"])
+        assert np.array_equal(currents, f["currents"])
+        assert not velocities.any() # not recorded
+        assert np.array_equal(valid, f["valid"].astype(bool))
+
+
+def test_maps_requested_ids(tmp_path):
+    path = str(tmp_path / "session.kirilog")
+    frames = make_frames(FORMAT_VERSION)
+    record(path, frames[:3])
+    port, rows = replay_all(path, dxl_ids=[2, 0, 5])
+    positions, _, _, valid = rows[0]
+    assert positions[:2].tolist() == [frames[0]["positions"][2], frames[0]["positions"][0]]
+    assert valid.tolist() == [True, True, False] # 5 was never recorded
+
+
+def test_seek(tmp_path):
+    path = str(tmp_path / "session.kirilog")
+    frames = make_frames(FORMAT_VERSION)
+    record(path, frames)
+    port = ReplayPort(path, speed=0.0)
+    port.seek_relative(0.1)
+    port.fetch_present_status()
+    assert port.present_positions[:3].tolist() == frames[10]["positions"].tolist()
@@ -0,0 +1,52 @@
+from control.dynamixel_port import CURRENT_BASE_POSITION_CONTROL_MODE, DynamixelPort
+from control.sim_bus import SimPortHandler, VirtualBus
+
+MOTOR_IDS = [0, 1, 2, 10, 11, 12]
+
+
+def count_writes(bus):
+    writes = []
+    for servo in bus.servos:
+        def write(addr, data, servo=servo, write=servo.write):
+            writes.append((servo.dxl_id, addr, bytes(data)))
+            return write(addr, data)
+        servo.write = write
+    return writes
+
+
+def open_port(bus, **kwargs):
+    return DynamixelPort("sim:", MOTOR_IDS, MOTOR_IDS[:3], port_handler=SimPortHandler("sim:", bus), metrics=False, **kwargs)
+
+
+def test_second_startup_writes_nothing(capsys):
+    bus = VirtualBus.with_ids(MOTOR_IDS)
+    first = open_port(bus)
+    first.portHandler.closePort() # no cleanup(): that would turn torque off again
+    assert "wrote operating mode to [0, 1, 2, 10, 11, 12]" in capsys.readouterr().err
+    eeprom_writes = [servo.eeprom_writes for servo in bus.servos]
+
+    writes = count_writes(bus)
+    second = open_port(bus)
+    log = capsys.readouterr().err
+    assert "Setup: 6/6 motors answered, wrote operating mode to [], gains to [], indirect addresses to [], torque to []" in log
+    assert [servo.eeprom_writes for servo in bus.servos] == eeprom_writes
+    assert writes == []
+    second.portHandler.closePort()
+
+
+def test_only_changed_registers_are_written(capsys):
+    bus = VirtualBus.with_ids(MOTOR_IDS)
+    open_port(bus).portHandler.closePort()
+    capsys.readouterr()
+    eeprom_writes = [servo.eeprom_writes for servo in bus.servos]
+
+    writes = count_writes(bus)
+    port = open_port(bus, control_mode=CURRENT_BASE_POSITION_CONTROL_MODE)
+    # torque has to go off for the EEPROM write (off, then on again)
+    assert ("wrote operating mode to [0, 1, 2, 10, 11, 12], gains to [], indirect addresses to [],"
+            " torque to [0, 1, 2, 0, 1, 2]") in capsys.readouterr().err
+    assert [servo.eeprom_writes - before for servo, before in zip(bus.servos, eeprom_writes)] == [1] * len(MOTOR_IDS)
+    assert all(servo.get(11, 1) == CURRENT_BASE_POSITION_CONTROL_MODE for servo in bus.servos)
+    assert [servo.get(64, 1) for servo in bus.servos] == [1, 1, 1, 0, 0, 0]
+    assert writes
+    port.portHandler.closePort()
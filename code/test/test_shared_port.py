@@ -0,0 +1,151 @@
+import os
+import threading
+
+import numpy as np
+import pytest
+
+from control.acquisition import Frame
+from control.shared_port import (FLAG_CURRENT, FLAG_POSITION, FLAG_PWM, OP_GOALS, OP_METRICS, OP_TORQUE, OP_WRITE,
+                                 SLOTS, SharedFrames, SharedPort, encode_command, parse_command)
+
+MOTOR_IDS = [0, 1, 2, 10, 11, 12]
+
+
+@pytest.fixture
+def frames():
+    frames = SharedFrames.create(f"kirigirisu-test-{os.getpid()}", MOTOR_IDS)
+    yield frames
+    frames.unlink()
+    frames.close()
+
+
+def make_frame(value):
+    frame = Frame(len(MOTOR_IDS))
+    frame.timestamp = float(value)
+    frame.positions[:] = np.arange(len(MOTOR_IDS)) + value
+    frame.currents[:] = -value
+    frame.valid[:] = True
+    frame.valid[2] = False
+    frame.age[:] = 0.0
+    frame.filtered_positions[:] = frame.positions + 0.5
+    return frame
+
+
+def corrupt(frames, seq):
+    # One byte of the slot's data, with its seq still marked complete
+    frames._slot_bytes[seq % frames.slot_count, -1] ^= 0xFF
+
+
+def test_writer_to_reader(frames):
+    reader = SharedFrames.attach(frames.shm.name)
+    try:
+        assert reader.dxl_ids == MOTOR_IDS and reader.seq == 0
+        out = Frame(len(MOTOR_IDS))
+        assert reader.latest(out) is out and out.seq == 0 # nothing published yet
+        for value in (100, 200):
+            frames.publish(make_frame(value))
+        assert reader.seq == 2 and not reader.stale()
+        reader.latest(out)
+        assert out.seq == 2 and out.timestamp == 200.0
+        assert out.positions.tolist() == [200, 201, 202, 203, 204, 205]
+        assert out.currents.tolist() == [-200] * 6
+        assert out.valid.tolist() == [True, True, False, True, True, True]
+        assert out.filtered_positions.tolist() == [200.5, 201.5, 202.5, 203.5, 204.5, 205.5]
+        assert reader.read(1, out) and out.positions[0] == 100
+
+        columns = np.array([MOTOR_IDS.index(10), MOTOR_IDS.index(1)], np.intp)
+        subset = Frame(2)
+        reader.latest(subset, columns)
+        assert subset.positions.tolist() == [203, 201]
+    finally:
+        reader.close()
+
+
+def test_overwritten_and_torn_slots_are_rejected(frames):
+    out = Frame(len(MOTOR_IDS))
+    for value in range(SLOTS + 1):
+        frames.publish(make_frame(value))
+    assert not frames.read(1, out) # slot reused by frame SLOTS + 1
+    assert frames.read(SLOTS + 1, out)
+
+    i = (SLOTS + 1) % SLOTS
+    frames._seq[i] = 2 * (SLOTS + 1) - 1 # writer mid-update
+    assert not frames.read(SLOTS + 1, out)
+    frames._seq[i] = 2 * (SLOTS + 1)
+    assert frames.read(SLOTS + 1, out)
+
+
+def test_corrupted_slot_fails_the_crc(frames):
+    out = Frame(len(MOTOR_IDS))
+    frames.publish(make_frame(7))
+    corrupt(frames, 1)
+    assert not frames.read(1, out) # seq looks complete, data doesn't match its CRC
+    assert out.seq == 0 and out.positions[0] == 0
+
+
+def test_latest_retries_until_a_good_frame(frames):
+    frames.publish(make_frame(1))
+    corrupt(frames, 1)
+    # the writer moves on while the reader keeps retrying the head
+    timer = threading.Timer(0.02, frames.publish, [make_frame(2)])
+    timer.start()
+    out = frames.latest(Frame(len(MOTOR_IDS)))
+    timer.join()
+    assert out.seq == 2 and out.positions[0] == 2
+
+
+def test_status_block(frames):
+    assert frames.read_status() == {}
+    assert frames.publish_status({"health": {"0": {"errors": 1}}})
+    assert frames.read_status() == {"health": {"0": {"errors": 1}}}
+    assert not frames.publish_status({"big": "x" * (1 << 16)})
+
+
+def test_shared_port_reads_the_ring(frames):
+    port = SharedPort(frames.shm.name, [12, 2])
+    try:
+        frames.publish(make_frame(10))
+        assert not port.fetch_present_status() # motor 2 didn't answer
+        assert port.present_positions[:2].tolist() == [15, 12]
+        assert port.present_valid[:2].tolist() == [True, False]
+        # the next fetch waits for the daemon's next frame
+        threading.Timer(0.02, frames.publish, [make_frame(20)]).start()
+        port.fetch_present_status()
+        assert port.present_positions[:2].tolist() == [25, 22]
+    finally:
+        port.cleanup()
+    with pytest.raises(ValueError):
+        SharedPort(frames.shm.name, [3])
+
+
+def test_goal_command_round_trip():
+    packet = encode_command(OP_GOALS, [0, 1, 10], FLAG_POSITION | FLAG_PWM, positions=[100, -200, 4095], pwms=[885, -885, 0])
+    op, flags, ids, payload = parse_command(packet)
+    assert (op, flags, ids) == (OP_GOALS, FLAG_POSITION | FLAG_PWM, [0, 1, 10])
+    assert payload["position"].tolist() == [100, -200, 4095]
+    assert payload["pwm"].tolist() == [885, -885, 0]
+    assert "current" not in payload
+
+    # rounded and clipped like any other goal
+    _, _, _, payload = parse_command(encode_command(OP_GOALS, [0, 1], FLAG_CURRENT, currents=[1.6, 1e6]))
+    assert payload["current"].tolist() == [2, 32767]
+
+
+def test_other_commands():
+    assert parse_command(encode_command(OP_TORQUE, [0, 1], 1)) == (OP_TORQUE, 1, [0, 1], None)
+    assert parse_command(encode_command(OP_METRICS, flags=0)) == (OP_METRICS, 0, [], None)
+    assert parse_command(encode_command(OP_WRITE, [10], write=(70, 1, 0x10))) == (OP_WRITE, 0, [10], (70, 1, 0x10))
+
+
+@pytest.mark.parametrize("packet", [
+    b"\x01\x01", # shorter than the header
+    bytes([9, 0, 0]), # unknown op
+    encode_command(OP_GOALS, [0, 1], FLAG_POSITION, positions=[1, 2])[:-1], # truncated
+    encode_command(OP_GOALS, [0, 1], FLAG_POSITION, positions=[1, 2]) + b"\x00", # trailing bytes
+    encode_command(OP_GOALS, [0, 1], FLAG_POSITION | FLAG_CURRENT, positions=[1, 2]), # flag without its values
+    encode_command(OP_WRITE, [0, 1], write=(64, 1, 0)), # write to two motors
+    encode_command(OP_TORQUE, [0, 1], 1) + b"\x00",
+])
+def test_malformed_commands(packet):
+    with pytest.raises(ValueError):
+        parse_command(packet)
@@ -0,0 +1,64 @@
+import numpy as np
+import pytest
+
+from control.dynamixel_port import ADDR_GOAL_CURRENT, ADDR_GOAL_POSITION, DynamixelPort
+from control.protocol2 import BROADCAST_ID, INST_SYNC_WRITE, SyncWriteFrame, build_packet, parse_packets, store_goals
+
+
+def sync_write_params(frame):
+    end = len(frame.packet) - 2
+    return bytes(frame.packet[8:end])
+
+
+def test_sync_write_frame_finalize():
+    frame = SyncWriteFrame([1, 2, 3], 116, 4)
+    goal = frame.field(0, np.int32)
+    goal[:] = [100, -200, 4095]
+    packet = frame.finalize()
+    assert bytes(packet) == build_packet(BROADCAST_ID, INST_SYNC_WRITE, sync_write_params(frame))
+    assert packet is frame.packet # no stuffing needed, sent in place
+
+
+def test_sync_write_frame_finalize_stuffed():
+    frame = SyncWriteFrame([1, 2], 116, 4)
+    goal = frame.field(0, np.int32)
+    goal[:] = [0x00FDFFFF, 7] # little-endian FF FF FD 00
+    params = sync_write_params(frame)
+    packet = frame.finalize()
+    assert packet is not frame.packet
+    assert b"\xff\xff\xfd\xfd" in packet
+    (dxl_id, inst, parsed, crc_ok), = parse_packets(bytearray(packet))
+    assert (dxl_id, inst, bytes(parsed), crc_ok) == (BROADCAST_ID, INST_SYNC_WRITE, params, True)
+    # Back to an unstuffed value, the in-place buffer is used again
+    goal[0] = 1
+    assert frame.finalize() is frame.packet
+
+
+def test_store_goals_rounds_and_clips():
+    out = np.zeros(4, np.int16)
+    store_goals(out, np.array([1.6, -2.5, 1e9, -1e9]))
+    assert out.tolist() == [2, -2, 32767, -32768]
+    store_goals(out, np.array([70000, 5], np.int64))
+    assert out.tolist() == [32767, 5, 32767, -32768] # the rest untouched
+    store_goals(out, [1, 2, 3, 4, 5, 6])
+    assert out.tolist() == [1, 2, 3, 4]
+    with pytest.raises(ValueError):
+        store_goals(out, [np.nan])
+    with pytest.raises(TypeError):
+        store_goals(out, ["1"])
+
+
+def test_short_goal_lists():
+    # Fewer goals than motors: the first motors move, the rest keep theirs
+    port = DynamixelPort("sim:", [0, 1, 2], [], metrics=False)
+    try:
+        servos = port.portHandler.bus.servos
+        held = [servo.get(ADDR_GOAL_POSITION, 4, signed=True) for servo in servos]
+        port.set_goal_positions([100, 200])
+        port.set_goal_currents(np.array([-50]))
+        port.set_goals(pos=np.array([300.4]))
+        port.fetch_present_status() # the sim applies writes as the bus moves on
+        assert [servo.get(ADDR_GOAL_POSITION, 4, signed=True) for servo in servos] == [300, 200, held[2]]
+        assert servos[0].get(ADDR_GOAL_CURRENT, 2, signed=True) == -50
+    finally:
+        port.cleanup()
@@ -0,0 +1,97 @@
+import time
+
+import numpy as np
+import pytest
+
+from control import udp_stream
+from control.udp_stream import FLAG_CURRENTS, HEADER, MAGIC, VERSION, JointStreamReceiver, JointStreamSender, seq_newer
+
+N = 6
+
+
+@pytest.fixture
+def link():
+    receiver = JointStreamReceiver("127.0.0.1", 0, N, max_age=0.1)
+    sender = JointStreamSender("127.0.0.1", receiver.sock.getsockname()[1], N, currents=True)
+    yield sender, receiver
+    sender.close()
+    receiver.close()
+
+
+def send(sender, seq, value, delay=0.0):
+    # One packet with sequence number `seq`, timestamped `delay` seconds ago
+    sender.positions[:] = value
+    sender.currents[:] = -value
+    HEADER.pack_into(sender.buffer, 0, MAGIC, VERSION, FLAG_CURRENTS, N, seq, time.time_ns() - int(delay * 1e9))
+    sender.sock.sendto(sender.buffer, sender.address)
+
+
+def test_seq_newer_wraps():
+    assert seq_newer(2, 1) and not seq_newer(1, 2) and not seq_newer(1, 1)
+    assert seq_newer(0, 0xFFFFFFFF) and not seq_newer(0xFFFFFFFF, 0)
+
+
+def test_receives_positions_and_currents(link):
+    sender, receiver = link
+    sender.send(np.arange(N) + 100, -np.arange(N))
+    assert receiver.receive(1.0)
+    assert receiver.positions.tolist() == list(range(100, 100 + N)) and receiver.currents.tolist() == list(range(0, -N, -1))
+    assert receiver.has_currents and receiver.seq == 1
+    assert not receiver.receive(0.01)
+
+
+def test_out_of_order_is_dropped(link):
+    sender, receiver = link
+    send(sender, 5, 5)
+    assert receiver.receive(1.0)
+    send(sender, 3, 3) # overtaken on the way
+    assert not receiver.receive(0.2)
+    assert receiver.out_of_order == 1
+    assert receiver.positions.tolist() == [5] * N
+    send(sender, 9, 9)
+    assert receiver.receive(1.0)
+    assert receiver.positions.tolist() == [9] * N
+    assert receiver.lost == 3 # 6, 7, 8
+
+
+def test_latest_wins(link):
+    sender, receiver = link
+    send(sender, 1, 1)
+    assert receiver.receive(1.0)
+    for seq in (2, 4, 3):
+        send(sender, seq, seq)
+    time.sleep(0.05)
+    assert receiver.receive(1.0)
+    assert receiver.positions.tolist() == [4] * N
+    assert receiver.superseded == 2 and receiver.lost == 0
+
+
+def test_delayed_packets_are_stale(link):
+    sender, receiver = link
+    send(sender, 1, 1)
+    assert receiver.receive(1.0)
+    send(sender, 2, 2, delay=0.5) # 0.5 s slower than the fastest recent one
+    assert not receiver.receive(1.0)
+    assert receiver.stale == 1 and receiver.delay == pytest.approx(0.5, abs=0.05)
+    assert receiver.positions.tolist() == [1] * N
+    send(sender, 3, 3, delay=0.05) # within max_age
+    assert receiver.receive(1.0)
+    assert receiver.positions.tolist() == [3] * N
+
+
+def test_sender_restart(link, monkeypatch):
+    monkeypatch.setattr(udp_stream, "RESYNC_SECONDS", 0.1)
+    sender, receiver = link
+    send(sender, 1000, 1000)
+    assert receiver.receive(1.0)
+    send(sender, 1, 1) # straight away: out of order
+    assert not receiver.receive(0.05)
+    assert receiver.out_of_order == 1
+
+    time.sleep(0.15)
+    # a restarted sender on another clock: sequence and baseline start over
+    send(sender, 1, 1, delay=2.0)
+    assert receiver.receive(1.0)
+    assert receiver.restarts == 1 and receiver.seq == 1
+    assert receiver.positions.tolist() == [1] * N
+    assert receiver.lost == 0 and receiver.stale == 0
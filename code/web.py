@@ -1,28 +1,36 @@
-from flask import Flask, render_template, jsonify
+from flask import Flask, Response, render_template, jsonify, request
 import threading
 import time
 import json
-import shutil
 import os
-from collections import defaultdict
 
-import numpy as np
+from control.calibration import RangeEstimator
+from control.calibration_store import CalibrationStore
+from control.joint_mapping import JointMapping, load_joint_limits
+from control.streaming import FrameBroadcaster
 
 app = Flask(__name__)
 
 controller = None
 MOTOR_IDS = [0, 1, 2, 10, 11, 12] # Starting from the wrist
+DEVICE = os.environ.get("KIRIGIRISU_DEVICE", "/dev/ttyUSB0") # e.g. "sim:" for the virtual bus
+STREAM_RATE = float(os.environ.get("KIRIGIRISU_STREAM_HZ", "60")) # /stream encoder frames per second
+CALIBRATION_SECONDS = 10 # upper bound, ends earlier once every motor's range has settled
+# 0 keeps the exact min/max; e.g. 0.5 trims the outermost 0.5% of samples per side
+CALIBRATION_PERCENTILE = float(os.environ.get("KIRIGIRISU_CALIBRATION_PERCENTILE", "0"))
 
 try:
     print("[INIT] Attempting to initialize Dynamixel controller...")
-    from control.dynamixel_port import DynamixelPort
+    from control.dynamixel_port import open_controller
 
-    controller = DynamixelPort(
-        device="/dev/ttyUSB0",
+    controller = open_controller(
+        device=DEVICE,
         dxl_ids=MOTOR_IDS,
         motor_with_torque=MOTOR_IDS
     )
     controller.disable_torque(MOTOR_IDS)
+    # One thread reads the bus; routes and calibration share its latest frame
+    controller.start_acquisition()
     print("[INIT] Dynamixel controller initialized successfully.")
 
 except Exception as e:
@@ -33,48 +41,90 @@ if controller is None:
     print("[EXIT] Dynamixel controller not available. Aborting.")
     raise SystemExit()
 
+# Calibration lives in memory; only a save touches static/calibration.json
+calibration_store = CalibrationStore()
+
+# Encoder ticks -> joint angles, needs the URDF limits exported by the ROS 2 bridge
+joint_mapping = None
+joint_mapping_lock = threading.Lock() # JointMapping is single-threaded, routes run on many
+
+def load_joint_mapping():
+    global joint_mapping
+    if calibration_store.data is None:
+        joint_mapping = None
+        return
+    try:
+        joint_mapping = JointMapping(MOTOR_IDS, calibration_store.data, load_joint_limits())
+    except FileNotFoundError as e:
+        print(f"[INIT] Joint angles unavailable until the ROS 2 bridge has run once: {e.filename}")
+        joint_mapping = None
+
+load_joint_mapping()
+
+# Pushes encoder frames and calibration state to every open /stream
+broadcaster = FrameBroadcaster(controller.latest_frame, MOTOR_IDS, rate=STREAM_RATE)
+broadcaster.start()
+
 # Calibration state
 calibrating = False
 calibration_thread = None
-min_max_values = {motor_id: {"min": float("inf"), "max": float("-inf")} for motor_id in MOTOR_IDS}
+estimator = RangeEstimator(len(MOTOR_IDS))
 
 def calibrate_motors():
-    global calibrating, min_max_values
-    start_time = time.time()
-    while calibrating and (time.time() - start_time < 10):
-        controller.fetch_present_status()
-        for i, motor_id in enumerate(MOTOR_IDS):
-            pos = controller.present_positions[i]
-            min_max_values[motor_id]["min"] = min(min_max_values[motor_id]["min"], pos)
-            min_max_values[motor_id]["max"] = max(min_max_values[motor_id]["max"], pos)
-        time.sleep(1)
+    global calibrating
+    # Every acquisition frame goes into the estimator, not one sample a second
+    acquisition = controller.acquisition
+    frame = controller.latest_frame()
+    start_time = time.monotonic()
+    while calibrating and (time.monotonic() - start_time < CALIBRATION_SECONDS):
+        if not acquisition.wait(frame.seq, timeout=0.1):
+            continue
+        controller.latest_frame(frame)
+        estimator.update(frame.positions, frame.valid, frame.timestamp)
+        if estimator.converged(frame.timestamp).all():
+            print(f"[CALIBRATION] Ranges settled after {time.monotonic() - start_time:.1f}s")
+            break
     save_results()
     time.sleep(1)
     calibrating = False
+    publish_calibration_state()
 
 def save_results():
-    def convert(obj):
-        if isinstance(obj, np.integer):
-            return int(obj)
-        return obj
-
-    cleaned = {
-        motor: {
-            "min": convert(values["min"]),
-            "max": convert(values["max"])
-        }
-        for motor, values in min_max_values.items()
-    }
+    cleaned = estimator.result(MOTOR_IDS, CALIBRATION_PERCENTILE)
+    calibration_store.save(cleaned)
+    load_joint_mapping()
+    print("Calibration saved:", cleaned)
+    return cleaned
+
+def calibration_state():
+    # Only include calibration data if calibration is done
+    if calibrating or calibration_store.data is None:
+        return {"running": calibrating}
+    return {"running": False, "calibration": calibration_store.data}
 
-    temp_path = os.path.join(os.path.dirname(__file__), "calibration_temp.json")
-    static_path = os.path.join(os.path.dirname(__file__), "static", "calibration.json")
+def conditional_json(body, etag):
+    # 304 when the client already has this version (If-None-Match)
+    response = Response(body, mimetype="application/json")
+    response.set_etag(etag)
+    response.headers["Cache-Control"] = "no-cache"
+    return response.make_conditional(request)
 
-    with open(temp_path, "w") as f:
-        json.dump(cleaned, f, indent=2)
+def publish_calibration_state():
+    broadcaster.publish_event("calibration", calibration_state())
 
-    shutil.move(temp_path, static_path)
-    print("Calibration saved:", cleaned)
-    return cleaned
+publish_calibration_state()
+
+def hardware_state(alert=None):
+    # Current hardware errors per motor, and the change that triggered this if any
+    health = controller.motor_health()
+    return {"errors": {dxl_id: state["hardware_errors"] for dxl_id, state in health.items() if "hardware_errors" in state},
+            "alert": alert}
+
+def publish_hardware_state(alert=None):
+    broadcaster.publish_event("hardware", hardware_state(alert))
+
+controller.add_hardware_listener(publish_hardware_state)
+publish_hardware_state()
 
 
 @app.route("/")
@@ -83,15 +133,16 @@ def index():
 
 @app.route("/toggle_calibration", methods=["POST"])
 def toggle_calibration():
-    global calibrating, calibration_thread, min_max_values
+    global calibrating, calibration_thread, estimator
 
     if not calibrating:
         print("[FLASK] Calibration starting")
         calibrating = True
-        min_max_values = defaultdict(lambda: {"min": float('inf'), "max": float('-inf')})
+        estimator = RangeEstimator(len(MOTOR_IDS))
 
         calibration_thread = threading.Thread(target=calibrate_motors)
         calibration_thread.start()
+        publish_calibration_state()
 
         return jsonify(status="started")
 
@@ -103,6 +154,7 @@ def toggle_calibration():
             calibration_thread.join()  # BLOCK until done
 
         cleaned = save_results()
+        publish_calibration_state()
         print(f"[FLASK] Calibration stopped, results: {cleaned}")
         return jsonify(status="stopped", calibration=cleaned)
 
@@ -119,28 +171,63 @@ def delayed_save_and_return():
 
 @app.route("/status")
 def status():
-    # Only include calibration data if calibration is done
-    if not calibrating:
-        with open(os.path.join(app.static_folder, "calibration.json")) as f:
-            calibration = json.load(f)
-        return jsonify(running=calibrating, calibration=calibration)
-
-    return jsonify(running=calibrating)
+    state = calibration_state()
+    return conditional_json(json.dumps(state), f"{calibration_store.etag}-{int(state['running'])}")
 
+@app.route("/stream")
+def stream():
+    # Server-sent events: "hello" (motor ids), "encoders" frames at
+    # STREAM_RATE, "calibration" whenever the calibration state changes and
+    # "hardware" whenever a motor's hardware error status does
+    subscriber = broadcaster.subscribe()
+    return Response(broadcaster.stream(subscriber), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
 
 
 @app.route("/encoder_values")
 def encoder_values():
-    controller.fetch_present_status()
+    frame = controller.latest_frame()
     joint_positions = {
-        f"motor_{motor_id}": int(controller.present_positions[i])
+        f"motor_{motor_id}": int(frame.positions[i])
         for i, motor_id in enumerate(MOTOR_IDS)
     }
     return jsonify(joint_positions)
 
+@app.route("/joint_values")
+def joint_values():
+    mapping = joint_mapping # may be swapped by a calibration save meanwhile
+    if mapping is None:
+        return jsonify(error="joint limits not available"), 503
+    frame = controller.latest_frame()
+    with joint_mapping_lock:
+        angles = mapping.map(frame.positions).tolist()
+    return jsonify(dict(zip(mapping.joint_names, angles)))
+
+@app.route("/metrics", methods=["GET", "POST"])
+def metrics():
+    # Per-transaction bus timing. Off unless KIRIGIRISU_METRICS=1, or
+    # POST {"enabled": true} (and {"reset": true} to start over).
+    if request.method == "POST":
+        body = request.get_json(silent=True) or {}
+        if body.get("enabled") is False or body.get("reset"):
+            controller.disable_metrics()
+        if body.get("enabled", body.get("reset", False)):
+            controller.enable_metrics()
+    acquisition = controller.acquisition
+    result = {"enabled": controller.metrics is not None,
+              "acquisition": dict(acquisition.stats.summary(), realtime=acquisition.realtime,
+                                  filters=acquisition.filters.settings()) if acquisition is not None else None,
+              "stream_clients": broadcaster.subscriber_count(),
+              "health": controller.motor_health()}
+    if controller.metrics is not None:
+        result.update(controller.metrics.snapshot())
+    return jsonify(result)
+
 @app.route('/calibration-data')
 def serve_calibration_data():
-    return app.send_static_file('calibration.json')
+    if calibration_store.body is None:
+        return jsonify(error="not calibrated"), 404
+    return conditional_json(calibration_store.body, calibration_store.etag)
 
 #app.run
 if __name__ == "__main__":